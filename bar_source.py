@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    K线推送源: 把K线逐根推送给回调函数, 供indexes.stream中的流式指标使用
+    ReplaySource 回放本地已保存的数据(可离线测试)
+    FutuKlineSource 订阅Futu OpenD的实时K线推送
+"""
+
+import threading
+from typing import Callable, Dict, List, NamedTuple
+
+import pandas as pd
+
+from dto_enum import OHLCV
+
+
+class Bar(NamedTuple):
+    """ 一根K线 date为'YYYY-MM-DD'(日K)或'YYYY-MM-DD HH:MM:SS'(分钟K) """
+    symbol: str
+    date: str
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+
+
+class BarSource():
+    """ K线推送源基类 """
+
+    def run(self, callback: Callable[[Bar], None]):
+        """ 把K线按时间顺序逐根传给callback, 直到数据结束或调用了stop() """
+        raise NotImplementedError
+
+    def stop(self):
+        """ 停止推送 """
+        raise NotImplementedError
+
+
+class ReplaySource(BarSource):
+    """
+        回放已保存的K线, 多只股票按日期交错推送(同一天按symbols的顺序)
+        默认从global_data_instance读取; 也可传入frames直接使用给定的 {symbol: dataframe} (格式同GlobalData.add_data的返回值)
+    """
+
+    def __init__(self, symbols: List[str], start: str = '', end: str = '9999-12-31', frames: Dict[str, pd.DataFrame] = None):
+        self.symbols = list(symbols)
+        self.start = start
+        self.end = end
+        self.frames = frames
+        self._stopped = False
+
+    def _load(self, symbol: str):
+        """ 返回该symbol的日期列表和OHLCV数组 """
+        if self.frames is not None:
+            df = self.frames[symbol]
+            return list(df.index), [df[column.name.lower()].to_numpy() for column in OHLCV]
+
+        from global_data import global_data_instance
+        arrays = [global_data_instance.get_array_since_date(symbol, column, global_data_instance.START_DOWNLOAD_DATE) for column in OHLCV]
+        return global_data_instance.symbol_to_date_list[symbol], arrays
+
+    def run(self, callback: Callable[[Bar], None]):
+        self._stopped = False
+        bars = []
+        for order, symbol in enumerate(self.symbols):
+            dates, (opens, highs, lows, closes, volumes) = self._load(symbol)
+            for i, date in enumerate(dates):
+                if self.start <= date <= self.end:
+                    bars.append((date, order, Bar(symbol, date, float(opens[i]), float(highs[i]), float(lows[i]),
+                                                  float(closes[i]), float(volumes[i]))))
+        bars.sort(key=lambda item: item[:2])
+
+        for _, _, bar in bars:
+            if self._stopped:
+                break
+            callback(bar)
+
+    def stop(self):
+        self._stopped = True
+
+
+class FutuKlineSource(BarSource):
+    """
+        订阅Futu OpenD的K线推送。OpenD会在一根K线形成过程中反复推送它的最新状态,
+        这里只在收到同一symbol的下一根K线时才把上一根(已经走完的)K线传给callback, 所以每根K线只推送一次
+    """
+
+    def __init__(self, symbols: List[str], ktype: str = 'K_1M', host: str = 'localhost', port: int = 11111):
+        self.symbols = list(symbols)
+        self.ktype = ktype
+        self.host = host
+        self.port = port
+        self._pending: Dict[str, Bar] = {}  # 每个symbol尚未走完的K线
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def on_kline(self, df: pd.DataFrame, callback: Callable[[Bar], None]):
+        """ 处理一次推送的数据(futu的CurKline格式) """
+        for row in df.itertuples(index=False):
+            bar = Bar(row.code, row.time_key, float(row.open), float(row.high), float(row.low), float(row.close), float(row.volume))
+            with self._lock:
+                pending = self._pending.get(bar.symbol)
+                self._pending[bar.symbol] = bar
+            if pending is not None and pending.date < bar.date:
+                callback(pending)
+
+    def run(self, callback: Callable[[Bar], None]):
+        import futu
+
+        source = self
+
+        class _Handler(futu.CurKlineHandlerBase):
+            def on_recv_rsp(self, rsp_pb):
+                return_code, data = super().on_recv_rsp(rsp_pb)
+                if return_code != futu.RET_OK:
+                    print(f'futu kline push error: {data}')
+                    return futu.RET_ERROR, data
+                source.on_kline(data, callback)
+                return futu.RET_OK, data
+
+        self._stop_event.clear()
+        quote_ctx = futu.OpenQuoteContext(host=self.host, port=self.port)
+        try:
+            quote_ctx.set_handler(_Handler())
+            return_code, data = quote_ctx.subscribe(self.symbols, [getattr(futu.SubType, self.ktype)], subscribe_push=True)
+            if return_code != futu.RET_OK:
+                raise RuntimeError(f'subscribe futu kline error: {data}')
+            self._stop_event.wait()
+        finally:
+            quote_ctx.close()  # 使线程退出 不阻塞主进程
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    离线性能测试 数据由synthetic.py生成, 不访问网络。在项目根目录运行:
+        python benchmarks/bench.py                                  默认规模 1k 10k 100k 1M 10M
+        python benchmarks/bench.py --sizes 1000,100000 --output result.json
+        python benchmarks/bench.py --compare old.json --output new.json      与之前的结果对比
+    kernel: 直接调用indexes/base.py等处的numba函数  cold为进程内第一次调用(numba核心在import时已编译或从缓存载入) warm为之后多次调用的最小值
+    getter: 调用各指标的get_*  cold为没有缓存时的整条计算 warm为有缓存时 append为追加一根K线后(只计算新增部分)
+    getter的数据从START_DOWNLOAD_DATE开始每天一根K线, 日期为'YYYY-MM-DD'格式, 所以最多约290万根, 超过时记为skipped
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numba
+import numpy as np
+from global_data import global_data_instance
+from indexes import cci_instance, dmi_instance, kdj_instance, ma_instance, macd_instance, mtm_instance, rsi_instance
+from indexes.base import calc_avedev, calc_ema, calc_hhv, calc_llv, calc_ma, calc_sma, ref, sum_recent
+from indexes.dmi import calc_mtr
+from indexes.graph import graph_instance
+from synthetic import max_bars, synthetic_arrays, synthetic_ohlcv
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# name: f(open, high, low, close, volume)
+KERNELS: Dict[str, Callable] = {
+    'calc_ma': lambda o, h, l, c, v: calc_ma(c, 20),
+    'calc_ema': lambda o, h, l, c, v: calc_ema(c, 12),
+    'calc_sma': lambda o, h, l, c, v: calc_sma(c, 6, 1),
+    'calc_llv': lambda o, h, l, c, v: calc_llv(l, 9),
+    'calc_hhv': lambda o, h, l, c, v: calc_hhv(h, 9),
+    'calc_avedev': lambda o, h, l, c, v: calc_avedev(c, 14),
+    'sum_recent': lambda o, h, l, c, v: sum_recent(c, 14),
+    'ref': lambda o, h, l, c, v: ref(c, 1),
+    'calc_mtr': lambda o, h, l, c, v: calc_mtr(h, l, c, 14),
+}
+
+# name: f(symbol, 最后一天, 100个日期)
+GETTERS: Dict[str, Callable] = {
+    'get_ma': lambda s, d, ds: ma_instance.get_ma(s, d, 5),
+    'get_macd': lambda s, d, ds: macd_instance.get_macd(s, d, 12, 26, 9),
+    'get_rsi': lambda s, d, ds: rsi_instance.get_rsi(s, d, 6),
+    'get_kdj': lambda s, d, ds: kdj_instance.get_kdj(s, d, 9, 3),
+    'get_mtm': lambda s, d, ds: mtm_instance.get_mtm(s, d, 12, 6),
+    'get_cci': lambda s, d, ds: cci_instance.get_cci(s, d, 14),
+    'get_dmi': lambda s, d, ds: dmi_instance.get_dmi(s, d, 14),
+    'get_ma_range': lambda s, d, ds: ma_instance.get_ma_range(s, '', d, 5),
+    'get_macd_range': lambda s, d, ds: macd_instance.get_macd_range(s, '', d, 12, 26, 9),
+    'get_rsi_range': lambda s, d, ds: rsi_instance.get_rsi_range(s, '', d, 6),
+    'get_kdj_range': lambda s, d, ds: kdj_instance.get_kdj_range(s, '', d, 9, 3),
+    'get_mtm_range': lambda s, d, ds: mtm_instance.get_mtm_range(s, '', d, 12, 6),
+    'get_cci_range': lambda s, d, ds: cci_instance.get_cci_range(s, '', d, 14),
+    'get_dmi_range': lambda s, d, ds: dmi_instance.get_dmi_range(s, '', d, 14),
+    'get_ma_batch': lambda s, d, ds: ma_instance.get_ma_batch(s, ds, 5),
+    'get_rsi_batch': lambda s, d, ds: rsi_instance.get_rsi_batch(s, ds, 6),
+    'get_ma_grid': lambda s, d, ds: ma_instance.get_ma_grid(s, [5, 10, 20, 60]),
+    'get_macd_grid': lambda s, d, ds: macd_instance.get_macd_grid(s, [6, 12], [26, 30], [9]),
+    'get_rsi_grid': lambda s, d, ds: rsi_instance.get_rsi_grid(s, [6, 12, 24]),
+    'get_kdj_grid': lambda s, d, ds: kdj_instance.get_kdj_grid(s, [9, 14], [3]),
+}
+
+INDEX_INSTANCES = (ma_instance, macd_instance, rsi_instance, kdj_instance, mtm_instance, cci_instance, dmi_instance, graph_instance)
+
+
+def _timed(f: Callable) -> float:
+    begin = time.perf_counter()
+    f()
+    return time.perf_counter() - begin
+
+
+def _clear_memos(symbol: str):
+    for instance in INDEX_INSTANCES:
+        instance.computed_memo.remove_symbol(symbol)
+
+
+def bench_kernels(size: int, repeat: int, names: Optional[Sequence[str]] = None) -> List[dict]:
+    arrays = synthetic_arrays(size, seed=size)
+    results = []
+    for name in names or KERNELS:
+        kernel = KERNELS[name]
+        cold = _timed(lambda: kernel(*arrays))
+        warm = min(_timed(lambda: kernel(*arrays)) for _ in range(repeat))
+        results.append({'group': 'kernel', 'name': name, 'size': size, 'cold': cold, 'warm': warm})
+    return results
+
+
+def bench_getters(size: int, repeat: int, names: Optional[Sequence[str]] = None) -> List[dict]:
+    names = names or list(GETTERS)
+    start = global_data_instance.START_DOWNLOAD_DATE  # 指标只使用这天之后的数据
+    if size + len(names) > max_bars(start):
+        return [{'group': 'getter', 'name': name, 'size': size, 'skipped': f'more than {max_bars(start)} dated bars'} for name in names]
+
+    symbol = f'BENCH.{size}'
+    df = synthetic_ohlcv(size + len(names), seed=size, start=start)  # 后面的K线留给append逐根追加
+    global_data_instance.put_data(symbol, df.iloc[:size])
+    dates = list(df.index)
+    sample = [dates[i] for i in np.random.default_rng(0).integers(0, size, 100)]
+    results = []
+    for i, name in enumerate(names):
+        getter = GETTERS[name]
+        last = dates[size + i - 1]
+        _clear_memos(symbol)
+        cold = _timed(lambda: getter(symbol, last, sample))
+        warm = min(_timed(lambda: getter(symbol, last, sample)) for _ in range(repeat))
+        global_data_instance.append_data(symbol, df.iloc[size + i:size + i + 1])
+        append = _timed(lambda: getter(symbol, dates[size + i], sample))
+        results.append({'group': 'getter', 'name': name, 'size': size, 'cold': cold, 'warm': warm, 'append': append})
+    _clear_memos(symbol)
+    return results
+
+
+def run(sizes: Sequence[int] = DEFAULT_SIZES, repeat: int = 5, kernels: Optional[Sequence[str]] = None,
+        getters: Optional[Sequence[str]] = None, log: Callable[[str], None] = print) -> dict:
+    """ 返回 {'meta': 运行环境, 'results': [{'group', 'name', 'size', 'cold', 'warm'(, 'append')}]} 时间单位为秒 """
+    results = []
+    for size in sizes:
+        for result in bench_kernels(size, repeat, kernels) + bench_getters(size, repeat, getters):
+            results.append(result)
+            if 'skipped' not in result:
+                log(f"{result['group']:6} {result['name']:16} {size:>10}  cold {result['cold']*1e3:10.3f} ms  warm {result['warm']*1e3:10.3f} ms"
+                    + (f"  append {result['append']*1e3:10.3f} ms" if 'append' in result else ''))
+    return {'meta': _meta(repeat), 'results': results}
+
+
+def _meta(repeat: int) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'repeat': repeat, 'python': platform.python_version(),
+            'numpy': np.__version__, 'numba': numba.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def compare(old: dict, new: dict, threshold: float = 1.2) -> List[str]:
+    """ 返回warm时间比old慢threshold倍以上的项 """
+    old_results = {(r['group'], r['name'], r['size']): r for r in old['results'] if 'skipped' not in r}
+    regressions = []
+    for r in new['results']:
+        before = old_results.get((r['group'], r['name'], r['size']))
+        if before is None or 'skipped' in r:
+            continue
+        for phase in ('warm', 'append'):
+            if phase in r and phase in before and r[phase] > before[phase] * threshold and r[phase] > 1e-5:
+                regressions.append(f"{r['group']} {r['name']} {r['size']} {phase}: {before[phase]*1e3:.3f} ms -> {r[phase]*1e3:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='offline benchmark of kernels and indicator getters')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma separated bar counts')
+    parser.add_argument('--repeat', type=int, default=5, help='warm runs, the fastest is reported')
+    parser.add_argument('--kernels', help='comma separated kernel names, default all')
+    parser.add_argument('--getters', help='comma separated getter names, default all')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='JSON from a previous run, report regressions')
+    args = parser.parse_args()
+
+    result = run([int(s) for s in args.sizes.split(',')], args.repeat,
+                 args.kernels.split(',') if args.kernels else None, args.getters.split(',') if args.getters else None)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(json.load(f), result)
+        print('\n'.join(['REGRESSIONS:'] + regressions) if regressions else 'no regressions')
+
+if __name__ == '__main__':
+    main()
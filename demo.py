@@ -5,13 +5,13 @@ from global_data import global_data_instance
 from indexes import *
 
 
-def main(symbol='000001', date=global_data_instance.NEWEST_TRADE_DATE,
+def main(symbol='000001', date=None,
          p_MA=5, p_MACD=(12,26,9), p_RSI=6, p_KDJ=(9,3), p_MTM=(12,6),
          p_CCI=14, p_DMI=14):
     """
         Example
         symbol: str, '000001',
-        date: str, '2017-08-18',
+        date: str, '2017-08-18', 默认为最近的交易日
         p_MA: int, 5
         p_MACD: tuple, (12,26,9)
         p_RSI: int, 6
@@ -20,6 +20,8 @@ def main(symbol='000001', date=global_data_instance.NEWEST_TRADE_DATE,
         p_CCI: int, 14
         p_DMI: int, 14
     """
+    if date is None:
+        date = global_data_instance.NEWEST_TRADE_DATE
 
     print(f'MA{p_MA} on {date}', ma_instance.get_ma(symbol, date, p_MA))
     print(f'MACD{p_MACD} on {date}', macd_instance.get_macd(symbol, date, *p_MACD))
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    Futu OpenD行情连接池 OpenQuoteContext建立连接并启动后台线程的开销比一次K线请求还大,
+    所以连接建立后一直保留, 在多次请求以及多个下载线程之间复用
+"""
+
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable
+
+
+class QuoteContextPool:
+    """
+        最多同时存在size个连接, 由factory()创建(如 lambda: futu.OpenQuoteContext(host, port)), 第一次使用时才创建
+        每个连接同一时间只借给一个线程; 使用中抛出异常的连接可能已经断开, 关闭后不再放回
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 1):
+        assert size >= 1
+        self._factory = factory
+        self._size = size
+        self._idle: 'queue.LifoQueue' = queue.LifoQueue()  # 最近用过的连接先被复用
+        self._count = 0  # 已创建(包括借出中)的连接数
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """ with pool.connection() as quote_ctx: 借出一个连接, 用完自动归还 """
+        ctx = self._acquire()
+        try:
+            yield ctx
+        except BaseException:
+            self._discard(ctx)
+            raise
+        else:
+            self._idle.put(ctx)
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                create = self._count < self._size
+                if create:
+                    self._count += 1  # 先占一个名额 创建连接时不持有锁
+            if create:
+                try:
+                    return self._factory()
+                except BaseException:
+                    with self._lock:
+                        self._count -= 1
+                    raise
+            try:  # 连接都在使用中 等待归还; 定时醒来检查是否有连接被丢弃而空出名额
+                return self._idle.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _discard(self, ctx):
+        with self._lock:
+            self._count -= 1
+        try:
+            ctx.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """ 关闭所有空闲的连接 使其后台线程退出; 之后再使用时会重新创建 """
+        while True:
+            try:
+                ctx = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(ctx)
+
+    def __len__(self) -> int:
+        """ 已创建的连接数 """
+        return self._count
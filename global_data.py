@@ -1,64 +1,116 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+import atexit
 import configparser
 import datetime
-import functools
+import hashlib
 import logging
 import os
 import pickle
 import socket
+import threading
 import time
-from typing import Dict, List, Set
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
-import futu
 import numpy as np
 import pandas as pd
-import requests
-import tushare as ts  # reference: https://tushare.pro/
-import yfinance as yf
 from numba.typed.typedlist import List as NumbaList
 
 from dto_enum import OHLCV
-from util import bin_search
+from futu_pool import QuoteContextPool
+from metrics import metrics_instance
+from rate_limit import TokenBucket
+from store import COLUMNS, ColumnStore
+from trade_calendar import TradeCalendar
 
 logging.disable(30)  # 屏蔽futu OpenQuoteContext初始化时的log
 
 
-class GlobalData:
+class _LazyDict(dict):
+    """ 缺少某个key时先调用loader(key)尝试载入, 仍然缺少则抛出KeyError """
+
+    def __init__(self, loader: Callable[[str], None]):
+        super().__init__()
+        self._loader = loader
+
+    def __missing__(self, key):
+        self._loader(key)
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+
+class _NewestTradeDate:
+    """ GlobalData.NEWEST_TRADE_DATE 第一次访问时才读取交易日历(可能需要访问网络) """
+
+    def __get__(self, instance, owner) -> str:
+        return owner.trade_calendar.newest_trade_date()  # '2020-01-01'
+
 
-    print('getting newest trade date..')
-    _trade_calendar = ts.pro_api().trade_cal(is_open=1, start_date='20220101', end_date=time.strftime('%Y%m%d'))
-    _newest_trade_date_8: str = _trade_calendar.iloc[-1]['cal_date']  # '20200101'
-    NEWEST_TRADE_DATE = f'{_newest_trade_date_8[:4]}-{_newest_trade_date_8[4:6]}-{_newest_trade_date_8[-2:]}'  # '2020-01-01'
+def _empty_frame() -> pd.DataFrame:
+    """ 没有下载到K线时使用的空数据 """
+    return pd.DataFrame({column: np.empty(0) for column in COLUMNS}, index=pd.Index([], dtype=object))
+
+
+class GlobalData:
+    # futu tushare yfinance等数据源在用到时才import, import本模块时不访问网络
 
     _conf = configparser.ConfigParser()
     _conf.read('config.ini')
     START_DECISION_DATE = _conf['Config']['start_decision_date']
     START_DOWNLOAD_DATE = _conf['Config']['start_download_date']
 
+    trade_calendar = TradeCalendar(os.path.join(_conf['Config']['save_result_dir'], 'trade_calendar.json'),
+                                   _conf['Config'].getfloat('trade_calendar_ttl_hours', fallback=12) * 3600)
+    NEWEST_TRADE_DATE = _NewestTradeDate()
+
     def __init__(self):
         self._basic_info: Dict[str, pd.DataFrame] = {}
         self._futu_enabled = self._conf['Config'].getboolean('futu_enabled')
         self._futu_host = self._conf['Config']['futu_hostname'] if self._futu_enabled else None
         self._futu_port = 11111
-
-        # 尝试载入本地的database.bin原始数据
-        self.db_file_path = os.path.join(self._conf['Config']['save_result_dir'], 'database.bin')
-        if os.path.exists(self.db_file_path):
-            print('WILL READ FROM SAVED DATABASE FILE!')
-            with open(self.db_file_path, 'rb') as f:
-                d = pickle.load(f)
-                self._symbol_to_dataframe = d['_symbol_to_dataframe']
-                self.symbol_to_date_list = d['symbol_to_date_list']
-                self.symbol_to_date_set = d['symbol_to_date_set']
-        else:
-            self._symbol_to_dataframe: Dict[str, pd.DataFrame] = {}
-            self.symbol_to_date_list: Dict[str, List[str]] = {}  # 保存各symbol的日期list
-            self.symbol_to_date_set: Dict[str, Set[str]] = {}  # 保存各symbol的日期set
-
+        self._replace_listeners: List[Callable[[str], None]] = []  # 某symbol的数据被整体替换时调用 用于使已计算的指标缓存作废
+        self._data_version: Dict[str, int] = {}  # 各symbol数据的版本号
+        self._lookup_cache: Dict[str, Tuple[int, dict]] = {}  # {symbol: (版本号, {按日期查找的结果})} 版本号不一致时作废
+
+        self._symbol_to_dataframe: Dict[str, pd.DataFrame] = {}  # 下载得到的原始数据
+        self._symbol_to_columns: Dict[str, Dict[str, np.ndarray]] = {}  # 各symbol的OHLCV各列 {symbol: {'close': array, ...}}
+        self.symbol_to_date_list: Dict[str, List[str]] = _LazyDict(self._load_from_store)  # 保存各symbol的日期list
+        self.symbol_to_date_set: Dict[str, Set[str]] = _LazyDict(self._load_from_store)  # 保存各symbol的日期set
+        self._dirty: Set[str] = set()  # 数据有变化 尚未保存的symbol
+        self._data_lock = threading.RLock()  # 多个下载线程同时写入数据时使用
+
+        # 各数据源的请求频率限制与失败重试 下载线程共用
+        config = self._conf['Config']
+        self._rate_limiters: Dict[str, TokenBucket] = {
+            provider: TokenBucket(config.getfloat(f'{provider}_rate', fallback=2), config.getfloat(f'{provider}_burst', fallback=1))
+            for provider in ('futu', 'yfinance')}
+        self._download_workers = config.getint('download_workers', fallback=4)
+        self._download_retries = config.getint('download_retries', fallback=3)
+        self._download_backoff = config.getfloat('download_backoff', fallback=1)
+
+        # futu行情连接在多次下载之间保留 每个下载线程最多占用一个
+        self._futu_pool = QuoteContextPool(self._new_futu_context, self._download_workers)
+        self._futu_page_size = config.getint('futu_page_size', fallback=1000)  # request_history_kline每页的K线数
+        atexit.register(self._futu_pool.close)  # 使连接的线程退出 不阻塞主进程
+
+        # 本地数据库 按列保存 用到某个symbol时才从文件映射 不需要在启动时读入全部数据
+        self.db_dir_path = os.path.join(self._conf['Config']['save_result_dir'], 'database')
+        self.store = ColumnStore(self.db_dir_path)
+        self.db_file_path = os.path.join(self._conf['Config']['save_result_dir'], 'database.bin')  # 旧版本的数据库
+        if not self.store.exists() and os.path.exists(self.db_file_path):
+            self._import_pickle_database()
+
+
+    def _new_futu_context(self):
+        import futu
+        return futu.OpenQuoteContext(host=self._futu_host, port=self._futu_port)
 
     def load_basic_info(self):
+        import futu
+        import tushare as ts  # reference: https://tushare.pro/
         try:
             print('Getting basic F10 info for CN..')
             stock_basic = ts.pro_api().stock_basic(list_status='L', fields='ts_code,symbol,name')  # L是正在上市股票
@@ -75,150 +127,396 @@ class GlobalData:
             except socket.error as e:
                 raise RuntimeError(f'{self._futu_host}:self._futu_port connect failed') from e
 
-            quote_ctx = futu.OpenQuoteContext(host=self._futu_host, port=self._futu_port)
-            print('Getting basic F10 info for HK..')
-            return_code, data_df = quote_ctx.get_stock_basicinfo(futu.Market.HK, stock_type=futu.SecurityType.STOCK)
-            if return_code == 0:
-                self._basic_info['HK'] = data_df.set_index('code')
-            else:
-                self._basic_info['HK'] = pd.DataFrame()
-                print(f'get data from futu error: {data_df}')
-
-            print('Getting basic F10 info for US..')
-            return_code, data_df = quote_ctx.get_stock_basicinfo(futu.Market.US, stock_type=futu.SecurityType.STOCK)
-            if return_code == 0:
-                self._basic_info['US'] = data_df.set_index('code')
-            else:
-                self._basic_info['US'] = pd.DataFrame()
-                print(f'get data from futu error: {data_df}')
-            quote_ctx.close()
-
-    def add_data(self, symbol: str, start: str) -> pd.DataFrame:
+            with self._futu_pool.connection() as quote_ctx:
+                print('Getting basic F10 info for HK..')
+                return_code, data_df = quote_ctx.get_stock_basicinfo(futu.Market.HK, stock_type=futu.SecurityType.STOCK)
+                if return_code == 0:
+                    self._basic_info['HK'] = data_df.set_index('code')
+                else:
+                    self._basic_info['HK'] = pd.DataFrame()
+                    print(f'get data from futu error: {data_df}')
+
+                print('Getting basic F10 info for US..')
+                return_code, data_df = quote_ctx.get_stock_basicinfo(futu.Market.US, stock_type=futu.SecurityType.STOCK)
+                if return_code == 0:
+                    self._basic_info['US'] = data_df.set_index('code')
+                else:
+                    self._basic_info['US'] = pd.DataFrame()
+                    print(f'get data from futu error: {data_df}')
+
+    def add_data(self, symbol: str, start: str, update: bool = False) -> pd.DataFrame:
         """ 添加对应股票的从给定日期开始的全部K线数据到self._symbol_to_dataframe, 并返回该股票的数据。
             参数start的格式: 1月必须写作01, 如2019-01-01
+            update为True且已有该股票的数据时, 只下载最后一天及之后的K线追加到末尾, 见_update_data
 
             返回dataframe格式
                             open   close    high     low     volume 
             date (字符串)
             2016-11-14     8.883   8.941   8.970    8.883    975078
         """
+        if update and self.has_data(symbol):
+            return self._update_data(symbol, start)
+
         print(f'downloading data of {symbol}')
+        pages = []  # 全部页下载完成后才一次替换已有的数据, 下载失败时已有的数据不变
+        self._download(symbol, start, pages.append)
+        if len(pages) <= 1:  # yfinance一次返回全部K线
+            return self.put_data(symbol, pages[0] if pages else _empty_frame())
+        # 多页时每列只合并一次, 不把所有页拼成一个DataFrame(需要时由_get_dataframe按列建立)
+        self._replace_data(symbol, [date for df in pages for date in df.index],
+                           {column: np.concatenate([df[column].to_numpy() for df in pages]) for column in COLUMNS})
+        return self._get_dataframe(symbol)
+
+    def put_data(self, symbol: str, df: pd.DataFrame) -> pd.DataFrame:
+        """ 用df(格式同add_data的返回值)替换该symbol的全部数据 不访问网络, 可用于载入离线或合成的数据 """
+        self._replace_data(symbol, list(df.index), {column: df[column].to_numpy() for column in COLUMNS}, df)
+        return df
+
+    def _replace_data(self, symbol: str, dates: List[str], columns: Dict[str, np.ndarray], df: Optional[pd.DataFrame] = None):
+        """ put_data的实现 用按列的数据替换该symbol的全部数据 df为None时需要时由_get_dataframe重新建立 """
+        with self._data_lock:
+            replaced = symbol in self._symbol_to_columns
+            self._symbol_to_columns[symbol] = columns
+            if df is None:
+                self._symbol_to_dataframe.pop(symbol, None)
+            else:
+                self._symbol_to_dataframe[symbol] = df
+            self.symbol_to_date_list[symbol] = dates
+            self.symbol_to_date_set[symbol] = set(dates)
+            self._data_changed(symbol)
+            if replaced:  # 重新下载的数据可能经过了复权 旧数据算出的指标不能再用
+                for listener in self._replace_listeners:
+                    listener(symbol)
+        return df
+
+    def has_data(self, symbol: str) -> bool:
+        """ 内存或本地数据库中是否已有该symbol的数据 """
+        self._load_from_store(symbol)
+        return symbol in self._symbol_to_columns
+
+    def loaded_symbols(self) -> List[str]:
+        """ 内存或本地数据库中已有数据的全部symbol """
+        return sorted(set(self._symbol_to_columns) | set(self.store.symbols()))
+
+    def prefetch(self, symbols: Sequence[str], start: Optional[str] = None, update: bool = False, workers: Optional[int] = None,
+                 progress: Optional[Callable[[int, int, str, Optional[BaseException]], None]] = None) -> Dict[str, BaseException]:
+        """
+            用多个线程同时下载多个symbol的数据, 各数据源的请求频率由config.ini中的 <数据源>_rate/<数据源>_burst 限制
+            update为False时跳过已有数据的symbol, 为True时按add_data(update=True)更新所有symbol
+            每完成一个symbol调用一次progress(已完成数, 总数, symbol, 异常或None), 不传时打印进度
+            返回下载失败的 {symbol: 异常}, 失败的symbol不影响其他symbol
+        """
+        start = start or self.START_DOWNLOAD_DATE
+        symbols = list(dict.fromkeys(symbols))  # 去重 保持顺序
+        if not update:
+            symbols = [symbol for symbol in symbols if not self.has_data(symbol)]
+
+        failures: Dict[str, BaseException] = {}
+        if not symbols:
+            return failures
+        with ThreadPoolExecutor(max_workers=workers or self._download_workers) as executor:
+            futures = {executor.submit(self.add_data, symbol, start, update): symbol for symbol in symbols}
+            for done, future in enumerate(as_completed(futures), 1):
+                symbol = futures[future]
+                error = future.exception()
+                if error is not None:
+                    failures[symbol] = error
+                if progress is not None:
+                    progress(done, len(symbols), symbol, error)
+                else:
+                    print(f'prefetch [{done}/{len(symbols)}] {symbol}' + (f' failed: {error}' if error is not None else ''))
+        return failures
+
+    def _update_data(self, symbol: str, start: str) -> pd.DataFrame:
+        """
+            从已有数据的最后一天开始下载, 用重叠的这一天检查价格是否变化:
+            没有变化则把之后的K线追加到末尾(已缓存的指标只需计算新增部分), 有变化(复权, 或最后一天是盘中数据)则从start重新下载全部
+        """
+        last_date = self.symbol_to_date_list[symbol][-1]
+        columns = self._get_columns(symbol)
+        print(f'updating data of {symbol} since {last_date}')
+        pages = []  # 只有最后一天及之后的K线 数据量小
+        self._download(symbol, last_date, pages.append)
+        delta = pd.concat(pages) if len(pages) > 1 else pages[0] if pages else _empty_frame()
+        if len(delta) == 0 or delta.index[0] != last_date or \
+                not all(np.isclose(delta[column].iloc[0], columns[column][-1], rtol=1e-6, atol=0) for column in ('open', 'high', 'low', 'close')):
+            print(f'{symbol} changed on {last_date}, downloading full history')
+            return self.add_data(symbol, start)
+        return self.append_data(symbol, delta)
+
+    def _download(self, symbol: str, start: str, on_page: Callable[[pd.DataFrame], None]):
+        """
+            按symbol的格式选择数据源 下载从start开始的K线, 每收到一页调用一次on_page(df)
+            每次请求前经过该数据源的限速, 失败时等待后重试(间隔逐次翻倍), 重试时从已收到的最后一天接着下载
+        """
+        provider = self._provider(symbol)
+        fetch = self._get_data_from_futu_opend if provider == 'futu' else self._get_data_from_yfinance
+        last_date = None  # 已收到的最后一天
+        for attempt in range(self._download_retries + 1):
+            self._rate_limiters[provider].acquire()
+            try:
+                with metrics_instance.timer('download', provider=provider):
+                    pages = fetch(symbol, start if last_date is None else last_date)
+                    for df in [pages] if isinstance(pages, pd.DataFrame) else pages:  # yfinance一次返回全部K线, futu逐页返回
+                        if last_date is not None:
+                            df = df[df.index > last_date]  # 重试时重叠的一天
+                        if metrics_instance.enabled:
+                            metrics_instance.inc('download_bytes', int(df.memory_usage().sum()), provider=provider)
+                            metrics_instance.inc('download_bars', len(df), provider=provider)
+                        on_page(df)
+                        if len(df):
+                            last_date = df.index[-1]
+                return
+            except Exception as e:
+                metrics_instance.inc('download_errors', provider=provider)
+                if attempt == self._download_retries:
+                    raise
+                print(f'download {symbol} failed ({e}), retrying..')
+                time.sleep(self._download_backoff * 2 ** attempt)
+
+    @staticmethod
+    def _provider(symbol: str) -> str:
+        """ symbol对应的数据源 """
         if symbol.isdigit():  # 如果是纯数字 则调用tushare的沪深数据接口
             raise RuntimeError(f'not supported yet: {symbol}')
-            df = get_data_from_tushare(symbol, start)
         elif symbol.endswith('.SH') or symbol.endswith('.SZ'):  # 调用tushare pro  需要先设置其token
             raise RuntimeError(f'not supported yet: {symbol}')
-            df = get_data_from_tushare_pro(symbol, start)
         elif symbol.startswith('SH.') or symbol.startswith('SZ.') or symbol.startswith('HK.'):
-            df = self._get_data_from_futu_opend(symbol, start)
+            return 'futu'
         elif symbol.startswith('US.'):
-            df = self._get_data_from_yfinance(symbol, start)
+            return 'yfinance'
         elif symbol.startswith('LB-'):
             raise RuntimeError(f'not supported yet: {symbol}')
-            df = get_data_from_longbridge(symbol, start)
         else:
             raise RuntimeError(f'Unknown symbol: {symbol}')
 
-        self._symbol_to_dataframe[symbol] = df
-        self.symbol_to_date_list[symbol] = list(df.index)
-        self.symbol_to_date_set[symbol] = set(df.index)
-        return df
+    def append_data(self, symbol: str, df: pd.DataFrame) -> pd.DataFrame:
+        """
+            把新的K线追加到已有数据的末尾, df中日期不晚于现有最后一天的行会被忽略, 返回追加后的全部数据。
+            已有的K线保持不变, 所以已缓存的指标序列在下次查询时只需计算新增的部分
+        """
+        with self._data_lock:
+            columns = self._get_columns(symbol)
+            dates = self.symbol_to_date_list[symbol]
+            new_rows = df[df.index > dates[-1]] if dates else df
+            if len(new_rows) == 0:
+                return self._get_dataframe(symbol)
+
+            # 按列追加到已有的数组后面, 不合并DataFrame(需要时由_get_dataframe重新建立)
+            self._symbol_to_columns[symbol] = {column: np.concatenate([columns[column], new_rows[column].to_numpy()])
+                                               for column in COLUMNS}
+            self._symbol_to_dataframe.pop(symbol, None)
+            dates.extend(new_rows.index)
+            self.symbol_to_date_set[symbol].update(new_rows.index)
+            self._data_changed(symbol)
+            return self._get_dataframe(symbol)
+
+    def add_replace_listener(self, listener: Callable[[str], None]):
+        """ 注册回调, 某symbol的数据被add_data整体替换时以symbol为参数调用 """
+        self._replace_listeners.append(listener)
+
+    def data_version(self, symbol: str) -> int:
+        """ symbol的数据每次变化(下载或追加K线)后加1 """
+        return self._data_version.get(symbol, 0)
+
+    def _data_changed(self, symbol: str):
+        """ 数据变化后该symbol按日期查找的缓存全部作废 """
+        self._data_version[symbol] = self.data_version(symbol) + 1
+        self._dirty.add(symbol)
+
+    def _load_from_store(self, symbol: str):
+        """ 从本地数据库映射该symbol的数据(不复制) 数据库中没有时什么都不做 """
+        if symbol in self._symbol_to_columns:
+            return
+        loaded = self.store.load(symbol)
+        if loaded is None:
+            return
+        dates, columns = loaded
+        self._symbol_to_columns[symbol] = columns
+        date_list = np.datetime_as_string(dates).tolist()
+        dict.__setitem__(self.symbol_to_date_list, symbol, date_list)
+        dict.__setitem__(self.symbol_to_date_set, symbol, set(date_list))
+        self._symbol_cache(symbol)['index'] = dates
+
+    def _import_pickle_database(self):
+        """ 把旧版本的database.bin转存为按列保存的数据库 只需进行一次 """
+        print('CONVERTING database.bin TO COLUMNAR DATABASE..')
+        with open(self.db_file_path, 'rb') as f:
+            d = pickle.load(f)
+        for symbol, df in d['_symbol_to_dataframe'].items():
+            self.store.save(symbol, np.array(list(df.index), dtype='datetime64[D]'), {column: df[column].to_numpy() for column in COLUMNS})
+
+    def _symbol_cache(self, symbol: str) -> dict:
+        """ 该symbol当前版本数据的查找缓存 数据变化后自动换成新的空缓存 """
+        version = self.data_version(symbol)
+        entry = self._lookup_cache.get(symbol)
+        if entry is None or entry[0] != version:
+            entry = self._lookup_cache[symbol] = (version, {})
+        return entry[1]
 
     def _get_dataframe(self, symbol: str) -> pd.DataFrame:
         """ 返回对应的dataframe, 若未下载则马上下载数据后返回 """
         df = self._symbol_to_dataframe.get(symbol)
         if df is not None:
             return df
-        else:
-            return self.add_data(symbol, self.START_DOWNLOAD_DATE)
+        columns = self._get_columns(symbol)
+        if symbol not in self._symbol_to_dataframe:  # 从本地数据库载入的 只有OHLCV各列
+            self._symbol_to_dataframe[symbol] = pd.DataFrame(columns, index=self.symbol_to_date_list[symbol])
+        return self._symbol_to_dataframe[symbol]
+
+    def _get_columns(self, symbol: str) -> Dict[str, np.ndarray]:
+        """ 返回对应的OHLCV各列 先尝试本地数据库, 若没有则马上下载数据后返回 """
+        columns = self._symbol_to_columns.get(symbol)
+        if columns is None:
+            self._load_from_store(symbol)
+            if symbol not in self._symbol_to_columns:
+                self.add_data(symbol, self.START_DOWNLOAD_DATE)
+            columns = self._symbol_to_columns[symbol]
+        return columns
+
+    def get_date_index(self, symbol: str) -> np.ndarray:
+        """ 该symbol的日期数组 dtype为datetime64[D], 与symbol_to_date_list[symbol]一一对应 """
+        cache = self._symbol_cache(symbol)
+        index = cache.get('index')
+        if metrics_instance.enabled:
+            metrics_instance.count_lookup('date_index', index is not None)
+        if index is None:
+            index = cache['index'] = np.array(self.symbol_to_date_list[symbol], dtype='datetime64[D]')
+        return index
+
+    def data_fingerprint(self, symbol: str, length: Optional[int] = None) -> Optional[str]:
+        """
+            前length根K线(日期与OHLCV)的指纹 '长度-哈希', length默认为全部; 数据不足length根时返回None
+            追加K线不改变已有部分的指纹, 复权等改变了已有数据时指纹随之改变
+        """
+        dates = self.get_date_index(symbol)
+        length = len(dates) if length is None else length
+        if length > len(dates):
+            return None
+        cache = self._symbol_cache(symbol)
+        fingerprint = cache.get(('fingerprint', length))
+        if metrics_instance.enabled:
+            metrics_instance.count_lookup('fingerprint', fingerprint is not None)
+        if fingerprint is None:
+            columns = self._get_columns(symbol)
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(np.ascontiguousarray(dates[:length]).view(np.int64))
+            for column in COLUMNS:  # 统一为float64 与数据来源的类型无关
+                digest.update(np.ascontiguousarray(columns[column][:length], dtype=np.float64))
+            fingerprint = cache[('fingerprint', length)] = f'{length}-{digest.hexdigest()}'
+        return fingerprint
 
-    @functools.cache
     def find_date_offset(self, symbol: str, date: str) -> int:
-        """ 找到给定symbol的给定日期的数组偏移量, 这个偏移量是相对于当前数据的起始日期(START_DOWNLOAD_DATE) """
+        """
+            找到给定symbol的给定日期的数组偏移量, 这个偏移量是相对于当前数据的起始日期(START_DOWNLOAD_DATE)
+            date不是交易日时返回其后第一个交易日的偏移量, 晚于最后一天时返回最后一天的偏移量
+        """
         dates = self.symbol_to_date_list[symbol]
-        if date >= dates[-1]:
+        if date >= dates[-1]:  # 实际使用时大部分都属于这种情况 可以直接返回不需要搜索
             return len(dates) - 1
-        elif date <= dates[-0]:
+        elif date <= dates[0]:
             return 0
-        else:  # 以上均是快捷返回，其实作用与bin_search是一样的，但是实际使用时大部分都属于date >= dates[-1]的情况，可以直接返回不需要搜索
-            return bin_search(self.symbol_to_date_list[symbol], date)
+        else:
+            return int(np.searchsorted(self.get_date_index(symbol), np.datetime64(date, 'D')))
 
-    @functools.cache
     def get_dates_since_date(self, symbol: str, date: str) -> List[str]:
         """
             提取从给定日期开始的交易日列表，加入缓存机制。
             注意: 这里的date允许传入一个非交易日(即在数据的日期列表中不存在)
         """
-        offset = self.find_date_offset(symbol, date)
-        result = self.symbol_to_date_list[symbol][offset:]
-        return NumbaList(result)
+        cache = self._symbol_cache(symbol)
+        result = cache.get(('dates', date))
+        if metrics_instance.enabled:
+            metrics_instance.count_lookup('dates_since_date', result is not None)
+        if result is None:
+            offset = self.find_date_offset(symbol, date)
+            result = cache[('dates', date)] = NumbaList(self.symbol_to_date_list[symbol][offset:])
+        return result
 
-    @functools.cache
     def get_array_since_date(self, symbol: str, column: OHLCV, date: str) -> np.ndarray:
         """
             从df中提取从给定日期开始的给定的列array, 由于df提取series转array很慢, 所以加入缓存机制。
             注意: 这里的date允许传入一个非交易日(即在数据的日期列表中不存在)
         """
-        df = self._get_dataframe(symbol)
+        cached = self._symbol_cache(symbol).get((column, date))
+        if metrics_instance.enabled:
+            metrics_instance.count_lookup('array_since_date', cached is not None)
+        if cached is not None:
+            return cached
+
+        columns = self._get_columns(symbol)
         if column == OHLCV.OPEN:
-            array = df['open'].to_numpy()
+            array = columns['open']
         elif column == OHLCV.HIGH:
-            array = df['high'].to_numpy()
+            array = columns['high']
         elif column == OHLCV.LOW:
-            array = df['low'].to_numpy()
+            array = columns['low']
         elif column == OHLCV.CLOSE:
-            array = df['close'].to_numpy()
+            array = columns['close']
         elif column == OHLCV.VOLUME:
-            array = df['volume'].to_numpy()
+            array = columns['volume']
         else:
             raise NameError
 
         offset = self.find_date_offset(symbol, date)
         result = array[offset:]
+        self._symbol_cache(symbol)[(column, date)] = result  # 下载数据后版本已变化 需重新取缓存
         return result
 
-    def _get_data_from_futu_opend(self, symbol: str, start: str) -> pd.DataFrame:
-        quote_ctx = futu.OpenQuoteContext(host=self._futu_host, port=self._futu_port)
+    def find_date_range(self, symbol: str, start: str, end: str) -> Tuple[int, int]:
+        """ 返回日期在 [start, end] 之间的K线的偏移量范围 [lo, hi), start、end可以是非交易日, start可以为'' """
+        index = self.get_date_index(symbol)
+        lo = int(np.searchsorted(index, np.datetime64(start, 'D'))) if start else 0
+        hi = int(np.searchsorted(index, np.datetime64(end, 'D'), side='right'))
+        return lo, hi
+
+    def find_date_offsets(self, symbol: str, dates: Sequence[str]) -> np.ndarray:
+        """ 返回多个日期各自的偏移量 数据中不存在的日期(非交易日)为-1 """
+        index = self.get_date_index(symbol)
+        targets = np.asarray(dates, dtype='datetime64[D]')
+        offsets = np.searchsorted(index, targets)
+        found = offsets < len(index)
+        found[found] = index[offsets[found]] == targets[found]
+        return np.where(found, offsets, -1)
+
+    def _get_data_from_futu_opend(self, symbol: str, start: str) -> Iterator[pd.DataFrame]:
+        """
+            用连接池中的连接分页请求K线 每页最多futu_page_size根, 用page_req_key请求下一页
+            逐页返回, 每页只保留OHLCV各列并改为按日期索引, 翻页的请求同样经过限速
+        """
         today_date = time.strftime('%Y-%m-%d')  # 以现在时间为准 NEWEST_TRADE_DATE只适用于中国市场
-        return_code, df, _ = quote_ctx.request_history_kline(symbol, start=start, end=today_date)
-        if return_code != 0:  # 最多重试一次
-            time.sleep(1)
-            return_code, df, _ = quote_ctx.request_history_kline(symbol, start=start, end=today_date)
-        if return_code != 0:
-            quote_ctx.close()  # 使线程退出 不阻塞主进程
-            raise RuntimeError(f'get data from futu error: {df}')
-
-        # 返回的日期格式为'yyyy-mm-dd 00:00:00' 把后面的去掉 日期格式保持统一
-        df['time_key'] = df['time_key'].apply(lambda s: s.split(' ')[0])
-        df.set_index('time_key', inplace=True)  # 改成按日期索引
-        quote_ctx.close()
-        time.sleep(0.5)
-        return df
+        page_req_key = None
+        with self._futu_pool.connection() as quote_ctx:
+            while True:
+                return_code, df, page_req_key = quote_ctx.request_history_kline(
+                    symbol, start=start, end=today_date, max_count=self._futu_page_size, page_req_key=page_req_key)
+                if return_code != 0:  # 由_download重试
+                    raise RuntimeError(f'get data from futu error: {df}')
+
+                # 返回的日期格式为'yyyy-mm-dd 00:00:00' 把后面的去掉 日期格式保持统一
+                df.index = [s.split(' ')[0] for s in df['time_key']]  # 改成按日期索引
+                yield df[list(COLUMNS)]
+                if page_req_key is None:
+                    break
+                self._rate_limiters['futu'].acquire()
 
     def _get_data_from_yfinance(self, symbol: str, start: str) -> pd.DataFrame:
+        import yfinance as yf
         ticker = yf.Ticker(symbol.replace('US.', ''))
-        try:
-            df = ticker.history(start=start, back_adjust=True)
-        except:
-            time.sleep(1)
-            df = ticker.history(start=start, back_adjust=True)
+        df = ticker.history(start=start, back_adjust=True)  # 出错时由_download重试
         df.columns = ['open', 'high', 'low', 'close', 'volume', 'Dividends', 'Stock Splits']  # 改为小写以统一
 
         # 返回的日期格式为DatetimeIndex对象 转换为字符串
         py_datetime_index = df.index.to_pydatetime()
         date_list = list(map(lambda x: x.strftime('%Y-%m-%d'), py_datetime_index))
         df.index = date_list
-        time.sleep(0.5)
         return df
 
     def save_database(self):
-        """ 保存当前数据到文件中 """
-        d = {}
-        d['_symbol_to_dataframe'] = self._symbol_to_dataframe
-        d['symbol_to_date_list'] = self.symbol_to_date_list
-        d['symbol_to_date_set'] = self.symbol_to_date_set
-        with open(self.db_file_path, 'wb') as f:
-            pickle.dump(d, f)
+        """ 把有变化的symbol保存到本地数据库 没有变化的不会重写 """
+        for symbol in sorted(self._dirty):
+            self.store.save(symbol, self.get_date_index(symbol), self._symbol_to_columns[symbol])
+        self._dirty.clear()
 
     def get_chinese_name(self, symbol: str) -> str:
         """ 获取对应代码的中文名称 """
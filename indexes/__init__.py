@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+import importlib
+
 from .base import Index
 
 # 下面都使用单例，不要浪费计算得出的数据
@@ -11,3 +13,12 @@ from .kdj import kdj_instance
 from .mtm import mtm_instance
 from .cci import cci_instance
 from .dmi import dmi_instance
+
+# Panel、选股及参数扫描、回测、公式等模块的numba核心是并行的, 编译较慢; 只用get_xxx时不需要, 第一次访问时才import
+_LAZY = {'Panel': 'panel', 'screener_instance': 'screener'}
+
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        return getattr(importlib.import_module(f'.{_LAZY[name]}', __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
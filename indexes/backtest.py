@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    回测: 用买入、卖出信号矩阵 (symbol × date) 在所有股票上一次模拟交易, 不再逐日逐股调用get_xxx
+        result = backtest('kdj(9,3) < 0 and rsi(6) < 20', 'kdj(9,3) > 100', fee=0.0003, slippage=0.001, lot=100)
+        result.stats        各股票的交易次数、胜率、收益率、最大回撤、持仓天数占比
+        result.portfolio    组合的收益率、年化收益率、波动率、夏普比率、最大回撤
+        result.trades()     每笔交易
+    信号可以是选股表达式(见indexes/screener.py), 也可以是与panel对齐的bool矩阵
+    规则: 从START_DECISION_DATE起, 每只股票各有一份资金capital, 空仓时收盘出现买入信号(同时没有卖出信号)则下一根K线开盘买入,
+        按 开盘价×(1+slippage) 成交, 花费当时现金的size倍(含手续费fee), 股数取lot的整数倍;
+        持仓时收盘出现卖出信号则下一根K线开盘按 开盘价×(1-slippage) 全部卖出, 扣除手续费fee
+        停牌(没有K线)的日子不交易, 信号顺延到下一根K线; 净值按最近的收盘价计算
+    组合为所有股票的资金之和; 每只股票一行, 用一个并行的numba核心模拟
+"""
+
+from typing import Dict, Optional, Sequence, Union
+
+import numba
+import numpy as np
+import pandas as pd
+from global_data import global_data_instance
+
+from indexes.panel import Panel
+from indexes.screener import screener_instance
+from indexes.signature import FLOAT, INT, MATRIX, MATRIX_MASK, NONE, OUT_MATRIX, kernel
+
+TRADING_DAYS = 252  # 一年的交易日数 用于年化
+STATS = ['trades', 'wins', 'bars', 'held', 'max_drawdown']  # simulate写入stats的各列
+
+Signal = Union[str, np.ndarray]
+
+
+@kernel(NONE, MATRIX, MATRIX, MATRIX_MASK, MATRIX_MASK, MATRIX_MASK, INT, INT, FLOAT, FLOAT, FLOAT, INT, FLOAT,
+        OUT_MATRIX, OUT_MATRIX, OUT_MATRIX, parallel=True)
+def simulate(open_: np.ndarray, close: np.ndarray, mask: np.ndarray, entries: np.ndarray, exits: np.ndarray, begin: int, end: int,
+             fee: float, slippage: float, size: float, lot: int, capital: float,
+             equity: np.ndarray, shares: np.ndarray, stats: np.ndarray):
+    """
+        按模块说明中的规则模拟日期偏移量在 [begin, end) 的交易 各行之间并行
+        equity、shares为 (symbol × (end-begin)), 写入每天收盘后的资金与持股数; stats每行写入STATS中的各项
+    """
+    for r in numba.prange(open_.shape[0]):
+        cash = capital
+        held = 0.0
+        cost = 0.0
+        pending = 0  # 1: 下一根K线买入  -1: 下一根K线卖出
+        price = np.nan
+        trades = 0
+        wins = 0
+        bars = 0
+        days_held = 0
+        peak = capital
+        drawdown = 0.0
+        for t in range(begin, end):
+            if mask[r, t]:
+                bars += 1
+                if pending != 0 and not np.isnan(open_[r, t]):
+                    if pending == 1:
+                        fill = open_[r, t] * (1 + slippage)
+                        held = np.floor(cash * size / (fill * (1 + fee)) / lot) * lot
+                        if held > 0:
+                            cost = held * fill * (1 + fee)
+                            cash -= cost
+                            trades += 1
+                    else:
+                        proceeds = held * open_[r, t] * (1 - slippage) * (1 - fee)
+                        cash += proceeds
+                        if proceeds > cost:
+                            wins += 1
+                        held = 0.0
+                    pending = 0
+                price = close[r, t]
+                if held == 0 and entries[r, t] and not exits[r, t]:
+                    pending = 1
+                elif held > 0 and exits[r, t]:
+                    pending = -1
+                if held > 0:
+                    days_held += 1
+            value = cash + held * price if held > 0 else cash
+            equity[r, t-begin] = value
+            shares[r, t-begin] = held
+            peak = max(peak, value)
+            drawdown = max(drawdown, 1 - value / peak)
+        stats[r, 0] = trades
+        stats[r, 1] = wins
+        stats[r, 2] = bars
+        stats[r, 3] = days_held
+        stats[r, 4] = drawdown
+
+
+class BacktestResult():
+    """ 回测结果 equity、shares为 (symbol × dates) 的矩阵: 每只股票每天收盘后的资金与持股数 """
+
+    def __init__(self, panel: Panel, begin: int, end: int, equity: np.ndarray, shares: np.ndarray, stats: np.ndarray,
+                 capital: float, fee: float, slippage: float):
+        self.panel = panel
+        self.symbols = panel.symbols
+        self.dates: np.ndarray = panel.dates[begin:end]
+        self.equity = equity
+        self.shares = shares
+        self.capital = capital
+        self._begin = begin
+        self._end = end
+        self._fee = fee
+        self._slippage = slippage
+        columns = dict(zip(STATS, stats.T))
+        self._wins = columns['wins']
+        self._closed = columns['trades'] - (shares[:, -1] > 0)  # 已平仓的交易数
+        with np.errstate(all='ignore'):
+            self.stats = pd.DataFrame({
+                'trades': columns['trades'].astype(np.int64),
+                'win_rate': self._wins / self._closed,  # 已平仓交易中盈利的比例
+                'return': equity[:, -1] / capital - 1,
+                'max_drawdown': columns['max_drawdown'],
+                'exposure': columns['held'] / columns['bars'],  # 持仓天数占有K线天数的比例
+            }, index=pd.Index(self.symbols, name='symbol'))
+        self.portfolio_equity: np.ndarray = equity.sum(axis=0)  # 组合每天的资金
+        self.portfolio = self._portfolio_stats()
+
+    def _portfolio_stats(self) -> Dict[str, float]:
+        initial = self.capital * len(self.symbols)
+        curve = np.concatenate([[initial], self.portfolio_equity])
+        returns = curve[1:] / curve[:-1] - 1
+        volatility = float(returns.std(ddof=1) * np.sqrt(TRADING_DAYS)) if len(returns) > 1 else np.nan
+        closed = self._closed.sum()
+        return {
+            'return': float(curve[-1] / initial - 1),
+            'annual_return': float((curve[-1] / initial) ** (TRADING_DAYS / len(returns)) - 1),
+            'volatility': volatility,
+            'sharpe': float(returns.mean() * TRADING_DAYS / volatility) if volatility else np.nan,
+            'max_drawdown': float(np.max(1 - curve / np.maximum.accumulate(curve))),
+            'trades': int(self.stats['trades'].sum()),
+            'win_rate': float(self._wins.sum() / closed) if closed else np.nan,
+        }
+
+    def trades(self) -> pd.DataFrame:
+        """ 每笔交易一行 按买入的股票与日期排列; 未平仓的交易exit_date为空, proceeds按最近的收盘价计算(不扣手续费) """
+        change = np.diff(self.shares, axis=1, prepend=0)
+        entry_rows, entry_columns = np.nonzero(change > 0)
+        exit_rows, exit_columns = np.nonzero(change < 0)
+        last = np.append(entry_rows[1:] != entry_rows[:-1], True)  # 每行最后一次买入
+        is_open = last & (self.shares[entry_rows, -1] > 0)
+        closed = ~is_open  # 与卖出按顺序一一对应
+
+        open_ = self.panel.open[:, self._begin:self._end]
+        close = pd.DataFrame(self.panel.close[:, self._begin:self._end]).ffill(axis=1).to_numpy()[:, -1]  # 最近的收盘价
+        quantity = self.shares[entry_rows, entry_columns]
+        proceeds = quantity * close[entry_rows]
+        proceeds[closed] = quantity[closed] * open_[exit_rows, exit_columns] * (1 - self._slippage) * (1 - self._fee)
+        exit_dates = np.full(len(entry_rows), None, dtype=object)
+        exit_dates[closed] = self.dates[exit_columns]
+        cost = quantity * open_[entry_rows, entry_columns] * (1 + self._slippage) * (1 + self._fee)
+        return pd.DataFrame({
+            'symbol': np.array(self.symbols, dtype=object)[entry_rows],
+            'entry_date': self.dates[entry_columns],
+            'exit_date': exit_dates,
+            'shares': quantity,
+            'cost': cost,
+            'proceeds': proceeds,
+            'return': proceeds / cost - 1,
+        })
+
+
+def backtest(entries: Signal, exits: Signal, symbols: Optional[Sequence[str]] = None, panel: Optional[Panel] = None,
+             start: Optional[str] = None, end: Optional[str] = None, fee: float = 0.0003, slippage: float = 0.0,
+             size: float = 1.0, lot: int = 1, capital: float = 100000.0) -> BacktestResult:
+    """
+        entries、exits为选股表达式或 (symbol × date) 的bool矩阵; 传入矩阵时需同时传入与之对齐的panel
+        表达式在screener_instance.panel(symbols)上求值, symbols默认为本地已有数据的全部symbol
+        在 [start, end] 的日期上交易 start默认为config.ini中的start_decision_date, 之前的K线只用于计算指标; end默认为最后一天
+        fee为每次买卖的手续费率, slippage为成交价相对开盘价的滑点比例, size为每次买入花费现金的比例, lot为每手股数
+    """
+    if panel is None:
+        if not (isinstance(entries, str) and isinstance(exits, str)):
+            raise ValueError('panel is required when signals are matrices')
+        panel = screener_instance.panel(symbols)
+    matrices = [screener_instance.signals(signal, panel=panel) if isinstance(signal, str) else np.asarray(signal, np.bool_)
+                for signal in (entries, exits)]
+    for matrix in matrices:
+        if matrix.shape != panel.close.shape:
+            raise ValueError(f'Signal shape {matrix.shape} does not match panel {panel.close.shape}')
+    if not 0 < size <= 1 or lot < 1:
+        raise ValueError('size must be in (0, 1] and lot >= 1')
+    start = start or global_data_instance.START_DECISION_DATE
+    begin = int(np.searchsorted(panel.dates, start))
+    stop = int(np.searchsorted(panel.dates, end, side='right')) if end else len(panel.dates)
+    if begin >= stop:
+        raise ValueError(f'No trading day between {start} and {end or panel.dates[-1]}')
+
+    shape = (len(panel.symbols), stop - begin)
+    equity = np.empty(shape)
+    shares = np.empty(shape)
+    stats = np.empty((len(panel.symbols), len(STATS)))
+    simulate(panel.open, panel.close, panel.mask, np.ascontiguousarray(matrices[0]), np.ascontiguousarray(matrices[1]), begin, stop,
+             fee, slippage, size, lot, capital, equity, shares, stats)
+    return BacktestResult(panel, begin, stop, equity, shares, stats, capital, fee, slippage)
@@ -1,136 +1,260 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
-import numba
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
 import numpy as np
-from memo import Memo
+from global_data import global_data_instance
+from memo import Memo, MemoStore
+from metrics import metrics_instance
+
+from indexes.rolling import rolling_avedev, rolling_max, rolling_mean, rolling_min, rolling_sum
+from indexes.signature import ANY, IN, INT, NEW, OPT_OUT, OUT, kernel
+
+
+def _memo_store() -> Optional[MemoStore]:
+    """ config.ini中memo_persist为1时 各指标的缓存可以保存到save_result_dir/memo, 重启后载入 """
+    config = global_data_instance._conf['Config']
+    if not config.getboolean('memo_persist', fallback=False):
+        return None
+    return MemoStore(os.path.join(config['save_result_dir'], 'memo'), global_data_instance.data_fingerprint)
+
+memo_store = _memo_store()
 
 
 class Index():
     """ 指标基类 """
 
     def __init__(self):
-        self.computed_memo = Memo()  # 缓存经计算得出的数据
+        self.computed_memo = Memo(type(self).__name__, store=memo_store)  # 缓存经计算得出的数据 用memo.save_memos()保存
+        global_data_instance.add_replace_listener(self.computed_memo.remove_symbol)  # 数据被整体替换后缓存作废
+
+    def extend_series(self, symbol: str, key: Tuple, length: int, compute: Callable[[np.ndarray, int], None]) -> np.ndarray:
+        """
+            取出缓存的序列并使其长度等于length:
+            缓存的长度相等则直接返回; 比现有数据短(追加了新K线)则只调用compute(out, start)计算out[start:];
+            没有缓存或缓存比数据长则调用compute(out, 0)整条计算。计算结果填入缓存
+        """
+        start = 0
+        out = None
+        cached = self.computed_memo.lookup(symbol, key)
+        if cached is not None:
+            if len(cached) == length:
+                return cached
+            elif len(cached) < length:
+                start = len(cached)
+                out = grow(cached, length)
+        if out is None:
+            out = grow(np.empty(0), length)
+        with metrics_instance.timer('compute', index=self.computed_memo.name, series=str(key[0]), mode='append' if start else 'full'):
+            compute(out, start)
+        self.computed_memo.set(symbol, key, out)  # 计算出来后填入缓存
+        return out
+
+    @staticmethod
+    def slice_dates(symbol: str, series: np.ndarray, start: str, end: str) -> np.ndarray:
+        """ 取出序列中日期在 [start, end] 之间的部分 返回只读视图(不复制) start、end可以是非交易日 """
+        lo, hi = global_data_instance.find_date_range(symbol, start, end)
+        view = series[lo:hi]
+        view.flags.writeable = False  # 与缓存共用内存 不能修改
+        return view
+
+    @staticmethod
+    def take_dates(symbol: str, series: np.ndarray, dates: Sequence[str]) -> np.ndarray:
+        """ 取出序列中多个日期的值 数据中不存在的日期(非交易日)为NaN """
+        offsets = global_data_instance.find_date_offsets(symbol, dates)
+        result = series[offsets]
+        result[offsets < 0] = np.nan
+        return result
 
-    def ma(self, array: np.ndarray, days: int) -> np.ndarray:
-        """ 计算简单移动平均线 传入一个array和days 返回一个array """
-        ma_array = calc_ma(array, days)
+    def ma(self, array: np.ndarray, days: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ 计算简单移动平均线 传入一个array和days 返回一个array  out为写入结果的数组, 不传时新分配(下同) """
+        ma_array = calc_ma(array, days, out)
         return ma_array
 
-    def ema(self, array: np.ndarray, days: int) -> np.ndarray:
+    def ema(self, array: np.ndarray, days: int, out: Optional[np.ndarray] = None) -> np.ndarray:
         """ 计算指数移动平均线 传入一个array和int 返回一个array """
-        ema_array = calc_ema(array, days)
+        ema_array = calc_ema(array, days, out)
         return ema_array
 
-    def sma(self, array: np.ndarray, n: int, m: int) -> np.ndarray:
+    def sma(self, array: np.ndarray, n: int, m: int, out: Optional[np.ndarray] = None) -> np.ndarray:
         """ 计算array的n日移动平均 m为权重  ema相当于sma(x,n+1,2) """
-        sma_array = calc_sma(array, n, m)
+        sma_array = calc_sma(array, n, m, out)
         return sma_array
 
-    def llv(self, array: np.ndarray, n: int) -> np.ndarray:
+    def llv(self, array: np.ndarray, n: int, out: Optional[np.ndarray] = None) -> np.ndarray:
         """ n日内最低价的最低值 从数据的第一天开始往后计算 """
-        llv_array = calc_llv(array, n)
+        llv_array = calc_llv(array, n, out)
         return llv_array
 
-    def hhv(self, array: np.ndarray, n: int) -> np.ndarray:
+    def hhv(self, array: np.ndarray, n: int, out: Optional[np.ndarray] = None) -> np.ndarray:
         """ n日内最高价的最高值 """
-        hhv_array = calc_hhv(array, n)
+        hhv_array = calc_hhv(array, n, out)
         return hhv_array
 
-    def avedev(self, array, n):
-        """ 平均绝对误差 一定区间内的值与该区间MA的差的绝对值之平均 """
-        avedev_array = calc_avedev(array, n)
+    def avedev(self, array: np.ndarray, n: int, ma: Optional[np.ndarray] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ 平均绝对误差 一定区间内的值与该区间MA的差的绝对值之平均  若已算出MA(array,n)可传入ma避免重复计算 """
+        if ma is None:
+            return calc_avedev(array, n, out)
+        assert len(array) > n
+        if out is None:
+            out = np.empty(len(array), np.float64)
+        avedev_array = rolling_avedev(array, ma, n, out)
         return avedev_array
 
 
-@numba.jit(nopython=True, cache=True)
-def calc_ma(array: np.ndarray, days: int) -> np.ndarray:
-    """ 计算简单移动平均线 传入一个array和days 返回一个array """
-    _weights = np.ones(days) / days  # 权重相等
-    ma = np.convolve(_weights, array)[days-1:1-days]  # 求出(array-days+1)天的MA(days) 最早的(days-1)天缺数据
-    ma = np.concatenate((np.array([np.nan] * (days-1)), ma))  # 缺数据所以填入(days-1)个nan 确保长度相等日期对齐
-    assert len(array) == len(ma)
-    return ma
+_grown_buffers = weakref.WeakValueDictionary()  # 由grow()分配的缓冲区 {id: buffer} 只有这些缓冲区的预留空间可以被复用
 
-@numba.jit(nopython=True, cache=True)
-def calc_ema(array: np.ndarray, days: int) -> np.ndarray:
-    """ 计算指数移动平均线 传入一个array和int 返回一个array """
-    _result = [0.0] * len(array)
-    _result[0] = 0.0 if np.isnan(array[0]) else array[0] # result初始值定为array的初值
-    for i in range(1, len(array)):  # 后面的进行递归计算
+def grow(array: np.ndarray, length: int) -> np.ndarray:
+    """
+        把一维float64序列延长到length, 前面的值保持不变, 新增部分未初始化
+        缓冲区尾部按1/8预留空间, 每次追加少量K线时多数情况下无需复制
+    """
+    base = array.base
+    if base is not None and _grown_buffers.get(id(base)) is base and len(base) >= length and array.ctypes.data == base.ctypes.data:
+        return base[:length]
+    buffer = np.empty(length + length // 8 + 16, np.float64)
+    buffer[:len(array)] = array
+    _grown_buffers[id(buffer)] = buffer
+    return buffer[:length]
+
+
+class BufferPool(threading.local):
+    """
+        计算中间结果用的临时缓冲区 每个线程各有一份, 用完后归还以便下次计算复用
+        反复重算(扫描大量股票、追加K线)时不再每次分配临时数组
+            with buffer_pool_instance.borrow(length, 2) as (a, b):
+                ...
+        借出的是长度为length的视图, 内容未初始化, 不能在with之外继续使用
+    """
+
+    def __init__(self):
+        self._free: List[np.ndarray] = []
+
+    def _take(self, length: int) -> np.ndarray:
+        """ 取出最短的足够长的空闲缓冲区 都不够长时丢弃其中最长的一个并新分配, 同样按1/8预留空间 """
+        fits = [i for i, buffer in enumerate(self._free) if len(buffer) >= length]
+        if fits:
+            return self._free.pop(min(fits, key=lambda i: len(self._free[i])))
+        if self._free:  # 空闲缓冲区的数量不超过同时借出的最大数量
+            self._free.pop(max(range(len(self._free)), key=lambda i: len(self._free[i])))
+        return np.empty(length + length // 8 + 16, np.float64)
+
+    @contextmanager
+    def borrow(self, length: int, count: int = 1) -> Iterator[List[np.ndarray]]:
+        """ 借出count个长度为length的float64数组 可以嵌套使用 """
+        buffers = [self._take(length) for _ in range(count)]
+        try:
+            yield [buffer[:length] for buffer in buffers]
+        finally:
+            self._free.extend(buffers)
+
+buffer_pool_instance = BufferPool()
+
+
+@kernel(NEW, OPT_OUT, INT)
+def out_array(out: Optional[np.ndarray], length: int) -> np.ndarray:
+    """ 供calc_*的out参数使用 out为None时新分配长length的数组, 否则检查长度后直接使用 """
+    if out is None:
+        return np.empty(length, np.float64)
+    assert len(out) == length, 'out的长度不对'
+    return out
+
+@kernel(NEW, ANY, INT, OPT_OUT)
+def calc_ma(array: np.ndarray, days: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ 计算简单移动平均线 传入一个array和days 返回一个array 最早的(days-1)天缺数据填NaN  传入out时写入out并返回out """
+    array = np.ascontiguousarray(array)
+    out = out_array(out, len(array))
+    rolling_mean(array, days, out)
+    return out
+
+@kernel(OUT, IN, INT, OUT, INT)
+def calc_ema_into(array: np.ndarray, days: int, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """ 计算指数移动平均线写入out 只计算out[start:], start>0时从out[start-1]接着递推 """
+    if start == 0:
+        out[0] = 0.0 if np.isnan(array[0]) else array[0] # result初始值定为array的初值
+    for i in range(max(start, 1), len(array)):  # 后面的进行递归计算
         # EMA(N) = 前一日EMA(N) X (N-1)/(N+1) + 今日收盘价 X 2/(N+1)
         # e.g.
         # EMA(9) = 前一日EMA(9) X 8/10 + 今日收盘价 X 2/10
-        _result[i] = _result[i-1] * (days-1) / (days+1) + array[i] * 2 / (days+1)
-    return np.array(_result)  # 返回一个np.array而不是list对象 list对象不能运算
+        out[i] = out[i-1] * (days-1) / (days+1) + array[i] * 2 / (days+1)
+    return out
 
-@numba.jit(nopython=True, cache=True)
-def calc_sma(array: np.ndarray, n:int, m:int) -> np.ndarray:
-    """ 计算array的n日移动平均 m为权重  ema相当于sma(x,n+1,2) """
-    _result = [0.0] * len(array)
-    _result[0] = 0.0 if np.isnan(array[0]) else array[0] # result初始值定为array的初值
-    for i in range(1, len(array)):  # 后面的进行递归计算
+@kernel(NEW, ANY, INT, OPT_OUT)
+def calc_ema(array: np.ndarray, days: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ 计算指数移动平均线 传入一个array和int 返回一个array """
+    array = np.ascontiguousarray(array)
+    out = out_array(out, len(array))
+    calc_ema_into(array, days, out)
+    return out
+
+@kernel(OUT, IN, INT, INT, OUT, INT)
+def calc_sma_into(array: np.ndarray, n:int, m:int, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """ 计算array的n日移动平均写入out 只计算out[start:], start>0时从out[start-1]接着递推 """
+    if start == 0:
+        out[0] = 0.0 if np.isnan(array[0]) else array[0] # result初始值定为array的初值
+    for i in range(max(start, 1), len(array)):  # 后面的进行递归计算
         # SMA(N,M) = 前一日SMA(N) X (N-M)/N + 今日收盘价 X M/N
         # e.g.
         # SMA(6,1) = 前一日SMA(6) X 5/6 + 今日收盘价 X 1/6
-        _result[i] = _result[i-1] * (n-m) / n + array[i] * m / n
-    return np.array(_result)  # 返回一个np.array而不是list对象 list对象不能运算
+        out[i] = out[i-1] * (n-m) / n + array[i] * m / n
+    return out
+
+@kernel(NEW, ANY, INT, INT, OPT_OUT)
+def calc_sma(array: np.ndarray, n:int, m:int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ 计算array的n日移动平均 m为权重  ema相当于sma(x,n+1,2) """
+    array = np.ascontiguousarray(array)
+    out = out_array(out, len(array))
+    calc_sma_into(array, n, m, out)
+    return out
 
-@numba.jit(nopython=True, cache=True)
-def calc_llv(array: np.ndarray, n:int) -> np.ndarray:
+@kernel(NEW, ANY, INT, OPT_OUT)
+def calc_llv(array: np.ndarray, n:int, out: Optional[np.ndarray] = None) -> np.ndarray:
     """ n日内最低价的最低值 从数据的第一天开始往后计算 """
     assert n > 1, 'n应>=2'
-    _result = []
-    for i in range(len(array)):
-        if i >= n:
-            _result.append(min(array[i-n+1:i+1]))
-        else:  # 初始的几天 数据不够
-            _result.append(min(array[:i+1]))
-    return np.array(_result)  # 返回一个np.array而不是list对象 list对象不能运算
-
-@numba.jit(nopython=True, cache=True)
-def calc_hhv(array: np.ndarray, n:int) -> np.ndarray:
+    array = np.ascontiguousarray(array)
+    out = out_array(out, len(array))
+    rolling_min(array, n, out)
+    return out
+
+@kernel(NEW, ANY, INT, OPT_OUT)
+def calc_hhv(array: np.ndarray, n:int, out: Optional[np.ndarray] = None) -> np.ndarray:
     """ n日内最高价的最高值 """
     assert n > 1, 'n应>=2'
-    _result = []
-    for i in range(len(array)):
-        if i >= n:
-            _result.append(max(array[i-n+1:i+1]))
-        else:  # 初始的几天 数据不够
-            _result.append(max(array[:i+1]))
-    return np.array(_result)  # 返回一个np.array而不是list对象 list对象不能运算
-
-@numba.jit(nopython=True, cache=True)
-def calc_avedev(array: np.ndarray, n:int):
-    """ 平均绝对误差 一定区间内的值与该区间MA的差的绝对值之平均 """
+    array = np.ascontiguousarray(array)
+    out = out_array(out, len(array))
+    rolling_max(array, n, out)
+    return out
+
+@kernel(NEW, ANY, INT, OPT_OUT, OPT_OUT)
+def calc_avedev(array: np.ndarray, n:int, out: Optional[np.ndarray] = None, ma: Optional[np.ndarray] = None):
+    """ 平均绝对误差 一定区间内的值与该区间MA的差的绝对值之平均  传入ma时MA(array,n)写入ma, 不再分配 """
     assert len(array) > n
-    ma = calc_ma(array, n)
-
-    _result = [np.nan] * len(array)
-    for i in range(n-1, len(array)):
-        _sum = 0
-        for j in range(n):
-            _sum += abs(array[i-j] - ma[i])  # i-n ~ i-1
-        _sum /= n
-        _result[i] = _sum
-    return np.array(_result)
-
-@numba.jit(nopython=True, cache=True)
-def sum_recent(array: np.ndarray, n:int) -> np.ndarray:
+    array = np.ascontiguousarray(array)
+    ma = calc_ma(array, n, ma)
+    out = out_array(out, len(array))
+    rolling_avedev(array, ma, n, out)
+    return out
+
+@kernel(NEW, ANY, INT, OPT_OUT)
+def sum_recent(array: np.ndarray, n:int, out: Optional[np.ndarray] = None) -> np.ndarray:
     """ 最近n日的求和 """
     assert len(array) > n
+    array = np.ascontiguousarray(array)
+    out = out_array(out, len(array))
+    rolling_sum(array, n, out)
+    return out
 
-    _result = [np.nan] * len(array)
-    for i in range(n-1, len(array)):  # 前(n-1)个无数据
-        _result[i] = np.sum(array[i-n+1:i+1])
-    return np.array(_result)
-
-@numba.jit(nopython=True, cache=True)
-def ref(array: np.ndarray, n:int) -> np.ndarray:
-    """ 前n日的值 相当于时间平移  [1, 2, 3] -> [NaN, 1, 2]"""
+@kernel(NEW, ANY, INT, INT, OPT_OUT)
+def ref(array: np.ndarray, n:int, begin: int = 0, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """ 前n日的值 相当于时间平移  [1, 2, 3] -> [NaN, 1, 2]  begin>0时只返回从begin开始的部分 """
     assert len(array) > n
 
-    _result = [np.nan] * len(array)
-    for i in range(n, len(array)):  # 前(n-1)个无数据
-        _result[i] = array[i-n]
-    return np.array(_result)
+    out = out_array(out, len(array) - begin)
+    for i in range(begin, len(array)):
+        out[i-begin] = array[i-n] if i >= n else np.nan  # 前n个无数据
+    return out
@@ -1,11 +1,16 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+from typing import Sequence
+
 import numpy as np
 from dto_enum import OHLCV
 from global_data import global_data_instance
 
 from indexes import Index
+from indexes.base import buffer_pool_instance
+from indexes.graph import graph_instance
+from indexes.rolling import rolling_avedev
 
 
 class CCI(Index):
@@ -17,27 +22,52 @@ class CCI(Index):
     def get_cci(self, symbol: str, date: str, n: int):
         """ 计算所有日期的 CCI(n) 序列, 返回给定日期的 CCI(n) """
 
-        key = f'cci-{n}'
-        if self.computed_memo.contains(symbol, key):
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                if date in global_data_instance.symbol_to_date_set[symbol]:
-                    offset = global_data_instance.find_date_offset(symbol, date)
-                    return self.computed_memo.get(symbol, key)[offset]
-                else:
-                    return np.nan
+        key = ('cci', n)
+        cached = self.computed_memo.lookup(symbol, key)
+        if cached is not None and len(cached) == len(global_data_instance.symbol_to_date_list[symbol]):  # 已有计算 并且array长度相等(数据存在且正确)
+            if date in global_data_instance.symbol_to_date_set[symbol]:
+                offset = global_data_instance.find_date_offset(symbol, date)
+                return cached[offset]
+            else:
+                return np.nan
+
+        cci = self._cci_series(symbol, n)
+
+        offset = global_data_instance.find_date_offset(symbol, date)
+        return cci[offset]
+
+    def get_cci_range(self, symbol: str, start: str, end: str, n: int) -> np.ndarray:
+        """ 返回日期在 [start, end] 之间的 CCI(n) 序列, 是缓存序列的只读视图(不复制) """
+        return self.slice_dates(symbol, self._cci_series(symbol, n), start, end)
+
+    def get_cci_batch(self, symbol: str, dates: Sequence[str], n: int) -> np.ndarray:
+        """ 返回多个日期的 CCI(n), 数据中不存在的日期为NaN """
+        return self.take_dates(symbol, self._cci_series(symbol, n), dates)
 
+    def _cci_series(self, symbol: str, n: int) -> np.ndarray:
+        """ 计算所有日期的 CCI(n) 序列 有缓存时只计算新增的K线 """
         close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
-        high_array = global_data_instance.get_array_since_date(symbol, OHLCV.HIGH, global_data_instance.START_DOWNLOAD_DATE)
-        low_array = global_data_instance.get_array_since_date(symbol, OHLCV.LOW, global_data_instance.START_DOWNLOAD_DATE)
 
+        length = len(close_array)
+        assert length > n
 
-        # TYP:=(HIGH+LOW+CLOSE)/3;
-        # CCI:(TYP-MA(TYP,N))/(0.015*AVEDEV(TYP,N));
-        typ = (high_array + low_array + close_array) / 3
-        cci = (typ - self.ma(typ, n)) / (0.015 * self.avedev(typ, n))
-        self.computed_memo.set(symbol, key, cci)  # 计算出来后填入缓存
+        # TYP:=(HIGH+LOW+CLOSE)/3;  TYP与MA(TYP,N)在计算图中 各周期的CCI共用
+        typ_node = ('typ',)
+        typ = graph_instance.series(symbol, typ_node)
+        ma_typ = graph_instance.series(symbol, ('ma', typ_node, n))
 
-        offset = global_data_instance.find_date_offset(symbol, date)
-        return cci[offset]
+        # CCI:(TYP-MA(TYP,N))/(0.015*AVEDEV(TYP,N));  MA(TYP,N)只算一次
+        def compute_cci(out: np.ndarray, start: int):
+            begin = max(0, start - n)
+            cci = out[start:]
+            with buffer_pool_instance.borrow(length - begin) as (avedev,):
+                rolling_avedev(typ[begin:], ma_typ[begin:], n, avedev, start - begin)
+                avedev = avedev[start-begin:]
+                np.multiply(avedev, 0.015, out=avedev)
+                np.subtract(typ[start:], ma_typ[start:], out=cci)
+                np.divide(cci, avedev, out=cci)
+        cci = self.extend_series(symbol, ('cci', n), length, compute_cci)
+
+        return cci
 
 cci_instance = CCI()
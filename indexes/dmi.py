@@ -1,12 +1,15 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
-import numba
+from typing import Optional, Sequence, Tuple
+
 import numpy as np
 from dto_enum import OHLCV
 from global_data import global_data_instance
 
-from indexes.base import Index, ref, sum_recent
+from indexes.base import Index, out_array
+from indexes.graph import graph_instance, true_range
+from indexes.signature import ANY, IN, INT, NEW, OPT_OUT, OUT, kernel
 
 
 class DMI(Index):
@@ -27,65 +30,96 @@ class DMI(Index):
     def get_dmi(self, symbol: str, date: str, n: int):
         """ 计算所有日期的 PDI、MDI 序列, 返回给定日期的 (PDI, MDI) 值 """
 
-        key_pdi = f'pdi-{n}'
-        pdi = None
-        if self.computed_memo.contains(symbol, key_pdi):  # 已有计算
-            if len(self.computed_memo.get(symbol, key_pdi)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                pdi = self.computed_memo.get(symbol, key_pdi)
-
-        key_mdi = f'mdi-{n}'
-        mdi = None
-        if self.computed_memo.contains(symbol, key_mdi):  # 已有计算
-            if len(self.computed_memo.get(symbol, key_mdi)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                mdi = self.computed_memo.get(symbol, key_mdi)
-
-        if (pdi is not None) and (mdi is not None):
+        key_pdi = ('pdi', n)
+        key_mdi = ('mdi', n)
+        pdi = self.computed_memo.lookup(symbol, key_pdi)
+        mdi = self.computed_memo.lookup(symbol, key_mdi)
+        if (pdi is not None) and (mdi is not None) and len(pdi) == len(mdi) == len(global_data_instance.symbol_to_date_list[symbol]):  # 已有计算 并且array长度相等(数据存在且正确)
             if date in global_data_instance.symbol_to_date_set[symbol]:
                 offset = global_data_instance.find_date_offset(symbol, date)
-                return (self.computed_memo.get(symbol, key_pdi)[offset], self.computed_memo.get(symbol, key_mdi)[offset])
+                return (pdi[offset], mdi[offset])
+
+
+        pdi, mdi = self._dmi_series(symbol, n)
+
+        offset = global_data_instance.find_date_offset(symbol, date)
+        return (pdi[offset], mdi[offset])
+
+    def get_dmi_range(self, symbol: str, start: str, end: str, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ 返回日期在 [start, end] 之间的 (PDI, MDI) 序列, 是缓存序列的只读视图(不复制) """
+        pdi, mdi = self._dmi_series(symbol, n)
+        return (self.slice_dates(symbol, pdi, start, end), self.slice_dates(symbol, mdi, start, end))
 
+    def get_dmi_batch(self, symbol: str, dates: Sequence[str], n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ 返回多个日期的 (PDI, MDI), 数据中不存在的日期为NaN """
+        pdi, mdi = self._dmi_series(symbol, n)
+        return (self.take_dates(symbol, pdi, dates), self.take_dates(symbol, mdi, dates))
 
+    def _dmi_series(self, symbol: str, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ 计算所有日期的 (PDI, MDI) 序列 有缓存时只计算新增的K线 """
         close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
-        high_array = global_data_instance.get_array_since_date(symbol, OHLCV.HIGH, global_data_instance.START_DOWNLOAD_DATE)
-        low_array = global_data_instance.get_array_since_date(symbol, OHLCV.LOW, global_data_instance.START_DOWNLOAD_DATE)
 
-        mtr = calc_mtr(high_array, low_array, close_array, n)
-        hd: np.ndarray = np.nan_to_num(high_array - ref(high_array, 1))
-        ld: np.ndarray = np.nan_to_num(ref(low_array, 1) - low_array)
+        length = len(close_array)
+        assert length > n, 'data too few'
 
-        dmp = sum_recent(np.where(np.logical_and(hd>0, hd>ld), hd, 0), n)
-        dmm = sum_recent(np.where(np.logical_and(ld>0, ld>hd), ld, 0), n)
+        # MTR、DMP、DMM都是滑动求和 在计算图中 TR、REF(CLOSE,1)、HD、LD等与其他指标或其他参数的DMI共用
+        mtr = graph_instance.series(symbol, ('sum', ('tr',), n))
+        dmp = graph_instance.series(symbol, ('sum', ('pdm',), n))
+        dmm = graph_instance.series(symbol, ('sum', ('mdm',), n))
 
-        pdi = dmp * 100 / mtr
-        mdi = dmm * 100 / mtr
+        # PDI:DMP*100/MTR;  MDI:DMM*100/MTR;
+        def compute_pdi(out: np.ndarray, start: int):
+            pdi = out[start:]
+            np.multiply(dmp[start:], 100, out=pdi)
+            np.divide(pdi, mtr[start:], out=pdi)
+        pdi = self.extend_series(symbol, ('pdi', n), length, compute_pdi)
 
-        self.computed_memo.set(symbol, key_pdi, pdi)  # 计算出来后填入缓存
-        self.computed_memo.set(symbol, key_mdi, mdi)  # 计算出来后填入缓存
+        def compute_mdi(out: np.ndarray, start: int):
+            mdi = out[start:]
+            np.multiply(dmm[start:], 100, out=mdi)
+            np.divide(mdi, mtr[start:], out=mdi)
+        mdi = self.extend_series(symbol, ('mdi', n), length, compute_mdi)
 
-        offset = global_data_instance.find_date_offset(symbol, date)
-        return (pdi[offset], mdi[offset])
+        return (pdi, mdi)
 
 
-@numba.jit(nopython=True, cache=True)
-def calc_mtr(high: np.ndarray, low: np.ndarray, close: np.ndarray, n: int):
+@kernel(OUT, IN, IN, IN, INT, OUT, INT)
+def mtr_into(high: np.ndarray, low: np.ndarray, close: np.ndarray, n: int, out: np.ndarray, start: int = 0):
+    """
+        计算MTR写入out 只计算out[start:] 见calc_mtr
+        即rolling_sum(TR, n): 滑出窗口的TR重新算一次, 不保存整条TR序列, 不分配临时数组
+    """
+    length = len(close)
+    for i in range(start, min(n - 1, length)):
+        out[i] = np.nan
+    for i in range(max(start, n - 1), length):
+        if i == 0 or i % n == n - 1 or not np.isfinite(out[i-1]):
+            _sum = 0.0
+            for j in range(i - n + 1, i + 1):
+                _sum += true_range(high, low, close, j)
+            out[i] = _sum
+        else:
+            out[i] = out[i-1] + true_range(high, low, close, i) - true_range(high, low, close, i - n)
+    return out
+
+@kernel(NEW, ANY, ANY, ANY, INT, OPT_OUT)
+def calc_mtr(high: np.ndarray, low: np.ndarray, close: np.ndarray, n: int, out: Optional[np.ndarray] = None):
     """
     SUM( MAX( MAX(HIGH - LOW, ABS(HIGH - REF(CLOSE, 1)) ), ABS(REF(CLOSE, 1) - LOW) ), N)
                   ----1-----             -----2-------         -----2-------
                               -----------3-------------    ----------4-------------
               ------------------5------------------------
          ---------------------------------6------------------------------------------
+    传入out时写入out并返回out
     """
     assert len(close) == len(high) == len(low), 'size must be same'
     assert len(close) > n, 'data too few'
 
-    arr1 = high - low
-    arr2 = ref(close, 1)
-    arr3 = np.abs(high - arr2)
-    arr4 = np.abs(arr2 - low)
-    arr5 = np.maximum(arr1, arr3)
-    arr6 = np.maximum(arr4, arr5)
-
-    mtr = sum_recent(arr6, n)
-    return mtr
+    high = np.ascontiguousarray(high)
+    low = np.ascontiguousarray(low)
+    close = np.ascontiguousarray(close)
+    out = out_array(out, len(close))
+    mtr_into(high, low, close, n, out, 0)
+    return out
 
 dmi_instance = DMI()
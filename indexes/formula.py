@@ -0,0 +1,506 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    通达信公式编译器: 把公式文本编译为一个numba核心, 不用写Python就能增加自定义指标
+        kdj = compile_formula('''
+            RSV:=(CLOSE-LLV(LOW,N))/(HHV(HIGH,N)-LLV(LOW,N))*100;
+            K:SMA(RSV,M,1);
+            D:SMA(K,M,1);
+            J:3*K-2*D;
+        ''')
+        kdj.series('SZ.000001', N=9, M=3)  ->  {'K': array, 'D': array, 'J': array}
+    语法: NAME:=表达式; 为中间变量, NAME:表达式; 为输出; {}中为注释; 名称不区分大小写
+        行情 OPEN/O HIGH/H LOW/L CLOSE/C VOL/V, 数字, + - * /, > < >= <= = <>, AND/&& OR/|| NOT, 括号
+        函数 REF MA EMA SMA LLV HHV SUM AVEDEV IF MAX MIN ABS CROSS, 窗口长度可以是数字、参数或它们的算式
+        其他名称都是参数, 调用时以关键字传入
+    生成的核心只遍历一次K线: 每根K线依次算出公式中的每一项, 有状态的函数(均线、滑动窗口)各自只保存窗口内的值,
+    除了输出之外不分配整条序列的中间数组; 相同的子表达式只计算一次(如CCI中的MA(TYP,N)与AVEDEV共用)
+    下面的step_xxx是各函数每根K线的一步, 递推方式与indexes/base.py、indexes/rolling.py中的核心相同, 结果与get_xxx一致
+    生成的源文件按公式的哈希命名, 写入config.ini中formula_cache_dir指定的目录(默认为临时目录), numba的编译结果随之缓存
+"""
+
+import configparser
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+import numpy as np
+from dto_enum import OHLCV
+from global_data import global_data_instance
+
+from indexes.signature import BOOL, FLOAT, INT, OUT, OUT_INTS, kernel
+
+COMPILER_VERSION = 4  # 生成的代码有变化时加1 旧的缓存不再使用
+
+
+@kernel(BOOL, FLOAT)
+def truth(x: float) -> bool:
+    """ 作为条件时 非0且不是NaN为真 """
+    return x == x and x != 0.0
+
+@kernel(FLOAT, FLOAT, FLOAT)
+def fmax(a: float, b: float) -> float:
+    """ 同np.maximum 有NaN时为NaN """
+    if np.isnan(a) or np.isnan(b):
+        return np.nan
+    return a if a >= b else b
+
+@kernel(FLOAT, FLOAT, FLOAT)
+def fmin(a: float, b: float) -> float:
+    if np.isnan(a) or np.isnan(b):
+        return np.nan
+    return a if a <= b else b
+
+@kernel(INT, INT)
+def ring_size(n: int) -> int:
+    """ 环形缓冲区的长度: 不小于n的2的幂, 下标用 & (长度-1) 代替取模 """
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+@kernel(FLOAT, OUT, INT, FLOAT, INT)
+def step_ref(buffer: np.ndarray, i: int, x: float, n: int) -> float:
+    """ REF(X,N) buffer长ring_size(n+1) 保存最近的值 """
+    mask = len(buffer) - 1
+    buffer[i & mask] = x
+    return buffer[(i-n) & mask] if i >= n else np.nan
+
+@kernel(FLOAT, OUT, OUT, INT, FLOAT, INT)
+def step_sum(state: np.ndarray, buffer: np.ndarray, i: int, x: float, n: int) -> float:
+    """ SUM(X,N) 同rolling_sum buffer长ring_size(n+1), state[0]为前一个结果 """
+    mask = len(buffer) - 1
+    leaving = buffer[(i-n) & mask]
+    buffer[i & mask] = x
+    if i < n - 1:
+        state[0] = np.nan
+    elif i == 0 or i % n == n - 1 or not np.isfinite(state[0]):
+        _sum = 0.0
+        for j in range(i - n + 1, i + 1):
+            _sum += buffer[j & mask]
+        state[0] = _sum
+    else:
+        state[0] = state[0] + x - leaving
+    return state[0]
+
+@kernel(FLOAT, OUT, OUT, INT, FLOAT, INT)
+def step_mean(state: np.ndarray, buffer: np.ndarray, i: int, x: float, n: int) -> float:
+    """ MA(X,N) 同rolling_mean """
+    mask = len(buffer) - 1
+    leaving = buffer[(i-n) & mask]
+    buffer[i & mask] = x
+    if i < n - 1:
+        state[0] = np.nan
+    elif i == 0 or i % n == n - 1 or not np.isfinite(state[0]):
+        _sum = 0.0
+        for j in range(i - n + 1, i + 1):
+            _sum += buffer[j & mask]
+        state[0] = _sum / n
+    else:
+        state[0] = state[0] + (x - leaving) / n
+    return state[0]
+
+@kernel(FLOAT, OUT, INT, FLOAT, INT)
+def step_ema(state: np.ndarray, i: int, x: float, days: int) -> float:
+    """ EMA(X,N) 同calc_ema_into """
+    if i == 0:
+        state[0] = 0.0 if np.isnan(x) else x
+    else:
+        state[0] = state[0] * (days-1) / (days+1) + x * 2 / (days+1)
+    return state[0]
+
+@kernel(FLOAT, OUT, INT, FLOAT, INT, INT)
+def step_sma(state: np.ndarray, i: int, x: float, n: int, m: int) -> float:
+    """ SMA(X,N,M) 同calc_sma_into """
+    if i == 0:
+        state[0] = 0.0 if np.isnan(x) else x
+    else:
+        state[0] = state[0] * (n-m) / n + x * m / n
+    return state[0]
+
+@kernel(FLOAT, OUT, OUT_INTS, INT, FLOAT, INT, BOOL)
+def step_extreme(buffer: np.ndarray, queue: np.ndarray, i: int, x: float, n: int, lowest: bool) -> float:
+    """
+        LLV(X,N)/HHV(X,N) 同rolling_min/rolling_max的单调队列
+        buffer长ring_size(n) 保存窗口内的值; queue长ring_size(n)+2, 前面是窗口内的下标, 最后两个为队首与队列长度
+    """
+    mask = len(buffer) - 1
+    head = queue[mask + 1]
+    size = queue[mask + 2]
+    window_start = i - n + 1 if i >= n else 0
+    if size > 0 and queue[head] < window_start:  # 队首已滑出窗口
+        head = (head + 1) & mask
+        size -= 1
+    buffer[i & mask] = x
+    if not np.isnan(x):
+        while size > 0:
+            last = buffer[queue[(head + size - 1) & mask] & mask]
+            if (x >= last) if lowest else (x <= last):
+                break
+            size -= 1
+        queue[(head + size) & mask] = i
+        size += 1
+    queue[mask + 1] = head
+    queue[mask + 2] = size
+    first = buffer[window_start & mask]
+    return first if np.isnan(first) else buffer[queue[head] & mask]
+
+@kernel(FLOAT, OUT, INT, FLOAT, FLOAT, INT)
+def step_avedev(buffer: np.ndarray, i: int, x: float, mean: float, n: int) -> float:
+    """ AVEDEV(X,N) 同rolling_avedev mean为MA(X,N) buffer长ring_size(n) """
+    mask = len(buffer) - 1
+    buffer[i & mask] = x
+    if i < n - 1:
+        return np.nan
+    _sum = 0.0
+    for j in range(n):
+        _sum += abs(buffer[(i-j) & mask] - mean)
+    return _sum / n
+
+@kernel(FLOAT, OUT, INT, FLOAT, FLOAT)
+def step_cross(state: np.ndarray, i: int, a: float, b: float) -> float:
+    """ CROSS(A,B) A从下方穿过B: 前一根A<B 这一根A>B; state保存前一根的A、B """
+    crossed = i > 0 and state[0] < state[1] and a > b
+    state[0] = a
+    state[1] = b
+    return 1.0 if crossed else 0.0
+
+
+COLUMNS = {'OPEN': 'open_', 'O': 'open_', 'HIGH': 'high', 'H': 'high', 'LOW': 'low', 'L': 'low',
+           'CLOSE': 'close', 'C': 'close', 'VOL': 'volume', 'V': 'volume', 'VOLUME': 'volume'}
+FUNCTIONS = {'REF': 2, 'MA': 2, 'EMA': 2, 'SMA': 3, 'LLV': 2, 'HHV': 2, 'SUM': 2, 'AVEDEV': 2,
+             'IF': 3, 'MAX': 2, 'MIN': 2, 'ABS': 1, 'CROSS': 2}  # 参数个数
+_COMPARE = {'>': '>', '<': '<', '>=': '>=', '<=': '<=', '=': '==', '==': '==', '<>': '!=', '!=': '!='}
+_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|([^\W\d]\w*)|(:=|>=|<=|<>|!=|==|&&|\|\||[-+*/(),;:<>=]))')
+
+
+class FormulaError(ValueError):
+    """ 公式有语法错误或使用了不支持的函数 """
+
+
+def tokenize(text: str) -> List[str]:
+    text = re.sub(r'\{[^}]*\}', ' ', text)  # 注释
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        if text[pos:].strip() == '':
+            break
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise FormulaError(f'Unexpected character: {text[pos:].strip()[:10]}')
+        tokens.append(match.group(match.lastindex).upper())
+        pos = match.end()
+    return tokens
+
+
+class Parser():
+    """
+        把公式解析为语句列表 [(名称, 是否输出, 表达式)], 表达式为tuple:
+        ('num', 值) ('col', 列名) ('param', 名称) ('op', 运算符, a, b) ('neg', a) ('not', a) ('call', 函数名, 参数...)
+        引用前面定义的名称时直接替换为其表达式, 相同的子表达式因而是相等的tuple
+    """
+
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.defined: Dict[str, Tuple] = {}
+        self.params: List[str] = []
+
+    def parse(self) -> List[Tuple[str, bool, Tuple]]:
+        statements = []
+        while self.pos < len(self.tokens):
+            if self.peek() == ';':
+                self.pos += 1
+                continue
+            name = self.next()
+            if not re.match(r'[^\W\d]\w*$', name) or self.peek() not in (':', ':='):
+                raise FormulaError(f'Expected NAME: or NAME:= at {name}')
+            if name in self.defined or name in COLUMNS or name in FUNCTIONS:
+                raise FormulaError(f'{name} is already defined')
+            output = self.next() == ':'
+            expression = self.expression()
+            if self.pos < len(self.tokens) and self.next() != ';':
+                raise FormulaError(f'Expected ; after {name}')
+            self.defined[name] = expression
+            statements.append((name, output, expression))
+        if not any(output for _, output, _ in statements):
+            raise FormulaError('No output, use NAME: expression;')
+        return statements
+
+    def peek(self) -> str:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ''
+
+    def next(self) -> str:
+        if self.pos >= len(self.tokens):
+            raise FormulaError('Unexpected end of formula')
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def expect(self, token: str):
+        if self.next() != token:
+            raise FormulaError(f'Expected {token} at {self.tokens[self.pos - 1]}')
+
+    def expression(self) -> Tuple:
+        node = self.conjunction()
+        while self.peek() in ('OR', '||'):
+            self.pos += 1
+            node = ('op', 'or', node, self.conjunction())
+        return node
+
+    def conjunction(self) -> Tuple:
+        node = self.comparison()
+        while self.peek() in ('AND', '&&'):
+            self.pos += 1
+            node = ('op', 'and', node, self.comparison())
+        return node
+
+    def comparison(self) -> Tuple:
+        node = self.additive()
+        while self.peek() in _COMPARE:
+            node = ('op', _COMPARE[self.next()], node, self.additive())
+        return node
+
+    def additive(self) -> Tuple:
+        node = self.term()
+        while self.peek() in ('+', '-'):
+            node = ('op', self.next(), node, self.term())
+        return node
+
+    def term(self) -> Tuple:
+        node = self.unary()
+        while self.peek() in ('*', '/'):
+            node = ('op', self.next(), node, self.unary())
+        return node
+
+    def unary(self) -> Tuple:
+        if self.peek() == '-':
+            self.pos += 1
+            return ('neg', self.unary())
+        if self.peek() == '+':
+            self.pos += 1
+            return self.unary()
+        if self.peek() == 'NOT':
+            self.pos += 1
+            return ('not', self.unary())
+        return self.primary()
+
+    def primary(self) -> Tuple:
+        token = self.next()
+        if token == '(':
+            node = self.expression()
+            self.expect(')')
+            return node
+        if re.match(r'[\d.]', token):
+            return ('num', float(token))
+        if not re.match(r'[^\W\d]\w*$', token):
+            raise FormulaError(f'Unexpected {token}')
+        if self.peek() == '(':
+            if token not in FUNCTIONS:
+                raise FormulaError(f'Unsupported function: {token}')
+            self.pos += 1
+            args = [self.expression()]
+            while self.peek() == ',':
+                self.pos += 1
+                args.append(self.expression())
+            self.expect(')')
+            if len(args) != FUNCTIONS[token]:
+                raise FormulaError(f'{token} takes {FUNCTIONS[token]} arguments')
+            return ('call', token, *args)
+        if token in self.defined:
+            return self.defined[token]
+        if token in COLUMNS:
+            return ('col', COLUMNS[token])
+        if token not in self.params:
+            self.params.append(token)
+        return ('param', token)
+
+
+class Generator():
+    """ 由解析结果生成核心的源代码 每个不同的子表达式在循环中成为一个局部变量 """
+
+    def __init__(self, statements: List[Tuple[str, bool, Tuple]], params: List[str]):
+        self.params = params
+        self.prelude: List[str] = []  # 循环之前: 参数、窗口长度与各函数的状态
+        self.body: List[str] = []  # 循环之内: 每根K线的计算
+        self.values: Dict[Tuple, str] = {}
+        self.outputs = [(name, expression) for name, output, expression in statements if output]
+
+    def source(self, text: str) -> str:
+        results = [self.value(expression) for _, expression in self.outputs]
+        lines = ['#!/usr/bin/python3', '# -*- encoding: utf-8 -*-', '',
+                 '# 由indexes/formula.py生成 不要修改', *[f'# {line}' for line in text.strip().splitlines()], '',
+                 'import numpy as np', '',
+                 'from indexes.formula import (fmax, fmin, ring_size, step_avedev, step_cross, step_ema, step_extreme, step_mean, step_ref, step_sma,',
+                 '                              step_sum, truth)',
+                 'from indexes.signature import IN, NEW_MATRIX, kernel', '', '',
+                 "@kernel(NEW_MATRIX, IN, IN, IN, IN, IN, IN, error_model='numpy')",  # x/0得到inf或NaN, 与get_xxx一致, 不抛出异常
+                 'def formula(open_, high, low, close, volume, params):',
+                 '    length = len(close)',
+                 f'    out = np.empty(({len(results)}, length), np.float64)',
+                 *[f'    p{k} = params[{k}]' for k in range(len(self.params))],
+                 *[f'    {line}' for line in self.prelude],
+                 '    for i in range(length):',
+                 *[f'        {line}' for line in self.body],
+                 *[f'        out[{k}, i] = {result}' for k, result in enumerate(results)],
+                 '    return out', '']
+        return '\n'.join(lines)
+
+    def constant(self, node: Tuple) -> str:
+        """ 窗口长度等只由数字与参数组成的表达式 """
+        kind = node[0]
+        if kind == 'num':
+            return repr(node[1])
+        if kind == 'param':
+            return f'p{self.params.index(node[1])}'
+        if kind == 'neg':
+            return f'(-{self.constant(node[1])})'
+        if kind == 'op' and node[1] in ('+', '-', '*', '/'):
+            return f'({self.constant(node[2])} {node[1]} {self.constant(node[3])})'
+        raise FormulaError('Window lengths must be numbers or parameters')
+
+    def window(self, node: Tuple, minimum: int) -> str:
+        name = f'n{len(self.prelude)}'
+        self.prelude.append(f'{name} = int({self.constant(node)})')
+        self.prelude.append(f'if {name} < {minimum}:')
+        self.prelude.append(f'    raise ValueError("window length must be >= {minimum}")')
+        return name
+
+    def state(self, code: str) -> str:
+        name = f's{len(self.prelude)}'
+        self.prelude.append(f'{name} = {code}')
+        return name
+
+    def value(self, node: Tuple) -> str:
+        """ 返回该子表达式在第i根K线的值(变量名或字面量) """
+        if node in self.values:
+            return self.values[node]
+        kind = node[0]
+        if kind == 'num':
+            return repr(node[1])
+        if kind == 'col':
+            return f'{node[1]}[i]'
+        if kind == 'param':
+            return f'p{self.params.index(node[1])}'
+        if kind == 'neg':
+            code = f'-{self.value(node[1])}'
+        elif kind == 'not':
+            code = f'0.0 if truth({self.value(node[1])}) else 1.0'
+        elif kind == 'op':
+            a, b = self.value(node[2]), self.value(node[3])
+            if node[1] in ('+', '-', '*', '/'):
+                code = f'{a} {node[1]} {b}'
+            elif node[1] in ('and', 'or'):
+                code = f'1.0 if truth({a}) {node[1]} truth({b}) else 0.0'
+            else:
+                code = f'1.0 if {a} {node[1]} {b} else 0.0'
+        else:
+            code = self.call(node[1], node[2:])
+        name = f'v{len(self.values)}'
+        self.body.append(f'{name} = {code}')
+        self.values[node] = name
+        return name
+
+    def call(self, function: str, args: Tuple) -> str:
+        if function == 'IF':
+            return f'{self.value(args[1])} if truth({self.value(args[0])}) else {self.value(args[2])}'
+        if function in ('MAX', 'MIN'):
+            return f'f{function.lower()}({self.value(args[0])}, {self.value(args[1])})'
+        if function == 'ABS':
+            return f'abs({self.value(args[0])})'
+        if function == 'CROSS':
+            return f'step_cross({self.state("np.zeros(2)")}, i, {self.value(args[0])}, {self.value(args[1])})'
+        x = self.value(args[0])
+        if function == 'REF':
+            n = self.window(args[1], 0)
+            return f'step_ref({self.state(f"np.empty(ring_size({n} + 1))")}, i, {x}, {n})'
+        if function in ('MA', 'SUM'):
+            n = self.window(args[1], 1)
+            step = 'step_mean' if function == 'MA' else 'step_sum'
+            return f'{step}({self.state("np.zeros(1)")}, {self.state(f"np.empty(ring_size({n} + 1))")}, i, {x}, {n})'
+        if function == 'EMA':
+            return f'step_ema({self.state("np.zeros(1)")}, i, {x}, {self.window(args[1], 1)})'
+        if function == 'SMA':
+            n, m = self.window(args[1], 1), self.window(args[2], 0)
+            return f'step_sma({self.state("np.zeros(1)")}, i, {x}, {n}, {m})'
+        if function in ('LLV', 'HHV'):
+            n = self.window(args[1], 1)
+            queue = self.state(f'np.zeros(ring_size({n}) + 2, np.int64)')
+            return f'step_extreme({self.state(f"np.empty(ring_size({n}))")}, {queue}, i, {x}, {n}, {function == "LLV"})'
+        if function == 'AVEDEV':
+            mean = self.value(('call', 'MA', *args))  # 与公式中的MA(X,N)共用
+            n = self.window(args[1], 1)
+            return f'step_avedev({self.state(f"np.empty(ring_size({n}))")}, i, {x}, {mean}, {n})'
+        raise FormulaError(f'Unsupported function: {function}')
+
+
+def cache_dir() -> str:
+    conf = configparser.ConfigParser()
+    conf.read('config.ini')
+    return conf.get('Config', 'formula_cache_dir', fallback='') or os.path.join(tempfile.gettempdir(), 'tdx_formulas')
+
+
+class Formula():
+    """ 编译好的公式 params为公式中的参数, outputs为输出的名称, 都按在公式中出现的顺序 """
+
+    def __init__(self, text: str, key: str, statements: List[Tuple[str, bool, Tuple]], params: List[str]):
+        self.text = text
+        self.key = key
+        self.params = params
+        self.outputs = [name for name, output, _ in statements if output]
+        self.source = Generator(statements, params).source(text)
+        self._kernel = self._load()
+
+    def _load(self):
+        """ 源文件以哈希命名 已存在时不再写入, 修改时间不变, numba的缓存才能继续使用 """
+        directory = cache_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f'tdx_{self.key}'
+        path = os.path.join(directory, f'{name}.py')
+        if not os.path.exists(path):
+            temp = f'{path}.{os.getpid()}.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                f.write(self.source)
+            os.replace(temp, path)
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)  # 按签名编译或从numba的缓存载入
+        return module.formula
+
+    def _param_array(self, params: Dict[str, float]) -> np.ndarray:
+        params = {name.upper(): value for name, value in params.items()}
+        missing = [name for name in self.params if name not in params]
+        if missing:
+            raise TypeError(f'Missing parameters: {", ".join(missing)}')
+        return np.array([params[name] for name in self.params], np.float64)
+
+    def run(self, open_: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray,
+            **params: float) -> Dict[str, np.ndarray]:
+        """ 在给定的K线上计算 返回 {输出名称: 序列} """
+        arrays = [np.ascontiguousarray(array, np.float64) for array in (open_, high, low, close, volume)]
+        result = self._kernel(*arrays, self._param_array(params))
+        return dict(zip(self.outputs, result))
+
+    def series(self, symbol: str, **params: float) -> Dict[str, np.ndarray]:
+        """ 在symbol自START_DOWNLOAD_DATE起的全部K线上计算, 与get_xxx使用相同的数据 """
+        columns = [global_data_instance.get_array_since_date(symbol, column, global_data_instance.START_DOWNLOAD_DATE)
+                   for column in OHLCV]
+        return self.run(*columns, **params)
+
+
+_compiled: Dict[str, Formula] = {}
+
+
+def compile_formula(text: str) -> Formula:
+    """ 编译公式 同一公式(忽略空白、注释与大小写)只编译一次 """
+    parser = Parser(text)
+    statements = parser.parse()
+    key = hashlib.sha1(f'{COMPILER_VERSION} {" ".join(parser.tokens)}'.encode('utf-8')).hexdigest()[:20]
+    if key not in _compiled:
+        _compiled[key] = Formula(text, key, statements, parser.params)
+    return _compiled[key]
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from dto_enum import OHLCV
+from global_data import global_data_instance
+
+from indexes.base import Index, calc_ema_into
+from indexes.rolling import rolling_max, rolling_mean, rolling_min, rolling_sum
+from indexes.signature import BOOL, FLOAT, IN, INT, OUT, kernel
+
+Node = Union[OHLCV, Tuple]
+
+_WINDOW_KERNELS = {'llv': rolling_min, 'hhv': rolling_max}
+_SUM_KERNELS = {'ma': rolling_mean, 'sum': rolling_sum}  # 需要传入切片在整条序列中的下标
+
+
+class Graph(Index):
+    """
+        各指标共用的中间结果 每个中间结果是一个节点, 以元组表示: (运算, 输入, 参数)
+        输入是OHLCV的某一列或另一个节点, 例如
+            ('ema', OHLCV.CLOSE, 12)        EMA(CLOSE,12)
+            ('ref', OHLCV.CLOSE, 1)         REF(CLOSE,1)
+            ('delta', OHLCV.HIGH, 1)        HIGH-REF(HIGH,1)
+            ('llv', OHLCV.LOW, 9)           LLV(LOW,9)  同样的还有 'hhv' 'ma' 'sum'
+            ('typ',)                        (HIGH+LOW+CLOSE)/3
+            ('ma', ('typ',), 14)            MA(TYP,14)
+            ('tr',)                         MAX(MAX(HIGH-LOW,ABS(HIGH-REF(CLOSE,1))),ABS(REF(CLOSE,1)-LOW))
+            ('pdm',) ('mdm',)               DMI中的 IF(HD>0&&HD>LD,HD,0) 与 IF(LD>0&&LD>HD,LD,0)
+        相同的节点每个symbol只计算一次, 被所有指标共用; 追加K线后只计算新增的部分
+    """
+
+    def series(self, symbol: str, node: Node) -> np.ndarray:
+        """ 返回节点在所有日期上的序列 与global_data_instance.symbol_to_date_list[symbol]对齐 """
+        if isinstance(node, OHLCV):
+            return global_data_instance.get_array_since_date(symbol, node, global_data_instance.START_DOWNLOAD_DATE)
+
+        length = len(self.series(symbol, OHLCV.CLOSE))  # 同时保证数据已下载
+        cached = self.cached(symbol, node)
+        if cached is not None:
+            return cached
+
+        op = node[0]
+        if op == 'typ':
+            high, low, close = (self.series(symbol, column) for column in (OHLCV.HIGH, OHLCV.LOW, OHLCV.CLOSE))
+            def compute(out: np.ndarray, start: int):
+                typ_into(high, low, close, out, start)
+        elif op == 'tr':
+            high, low, close = (self.series(symbol, column) for column in (OHLCV.HIGH, OHLCV.LOW, OHLCV.CLOSE))
+            def compute(out: np.ndarray, start: int):
+                tr_into(high, low, close, out, start)
+        elif op in ('pdm', 'mdm'):
+            # HD:=HIGH-REF(HIGH,1);  LD:=REF(LOW,1)-LOW;  HD、LD由pdm和mdm共用
+            delta_high = self.series(symbol, ('delta', OHLCV.HIGH, 1))
+            delta_low = self.series(symbol, ('delta', OHLCV.LOW, 1))
+            def compute(out: np.ndarray, start: int):
+                dm_into(delta_high, delta_low, op == 'pdm', out, start)
+        else:
+            _, source, n = node
+            x = self.series(symbol, source)
+            if op == 'ref':
+                def compute(out: np.ndarray, start: int):
+                    ref_into(x, n, out, start)
+            elif op == 'delta':
+                def compute(out: np.ndarray, start: int):
+                    delta_into(x, n, out, start)
+            elif op == 'ema':
+                def compute(out: np.ndarray, start: int):
+                    begin = max(0, start - 1)  # 递推需要前一天的值
+                    calc_ema_into(x[begin:], n, out[begin:], start - begin)
+            elif op in _WINDOW_KERNELS:
+                kernel = _WINDOW_KERNELS[op]
+                def compute(out: np.ndarray, start: int):
+                    begin = max(0, start - n)  # 需要start之前n天的数据
+                    kernel(x[begin:], n, out[begin:], start - begin)
+            elif op in _SUM_KERNELS:
+                kernel = _SUM_KERNELS[op]
+                def compute(out: np.ndarray, start: int):
+                    begin = max(0, start - n)
+                    kernel(x[begin:], n, out[begin:], start - begin, begin)
+            else:
+                raise ValueError(f'Unknown node: {node}')
+        return self.extend_series(symbol, node, length, compute)
+
+    def cached(self, symbol: str, node: Tuple) -> Optional[np.ndarray]:
+        """ 若节点已算到最新一天则返回其序列, 否则返回None """
+        cached = self.computed_memo.lookup(symbol, node)
+        if cached is not None and len(cached) == len(global_data_instance.symbol_to_date_list[symbol]):
+            return cached
+        return None
+
+
+# 以下逐元素的运算都只计算out[start:] 一次遍历完成, 不产生临时数组
+
+@kernel(OUT, IN, INT, OUT, INT)
+def ref_into(array: np.ndarray, n: int, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """ REF(X,N) 前n个无数据填NaN """
+    for i in range(start, len(array)):
+        out[i] = array[i-n] if i >= n else np.nan
+    return out
+
+@kernel(OUT, IN, INT, OUT, INT)
+def delta_into(array: np.ndarray, n: int, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """ X-REF(X,N) 前n个无数据填NaN """
+    for i in range(start, len(array)):
+        out[i] = array[i] - array[i-n] if i >= n else np.nan
+    return out
+
+@kernel(OUT, IN, IN, IN, OUT, INT)
+def typ_into(high: np.ndarray, low: np.ndarray, close: np.ndarray, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """ TYP:=(HIGH+LOW+CLOSE)/3; """
+    for i in range(start, len(close)):
+        out[i] = (high[i] + low[i] + close[i]) / 3
+    return out
+
+@kernel(FLOAT, IN, IN, IN, INT)
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray, i: int) -> float:
+    """ 第i天的 MAX(MAX(HIGH-LOW,ABS(HIGH-REF(CLOSE,1))),ABS(REF(CLOSE,1)-LOW)) 与np.maximum一样 有NaN时结果为NaN """
+    lc = close[i-1] if i >= 1 else np.nan
+    a = high[i] - low[i]
+    b = abs(high[i] - lc)
+    c = abs(lc - low[i])
+    if np.isnan(a) or np.isnan(b) or np.isnan(c):
+        return np.nan
+    return max(c, max(a, b))
+
+@kernel(OUT, IN, IN, IN, OUT, INT)
+def tr_into(high: np.ndarray, low: np.ndarray, close: np.ndarray, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """ TR 见true_range """
+    for i in range(start, len(close)):
+        out[i] = true_range(high, low, close, i)
+    return out
+
+@kernel(FLOAT, FLOAT)
+def _nan_to_num(x: float) -> float:
+    """ 与np.nan_to_num相同 """
+    if np.isnan(x):
+        return 0.0
+    if np.isinf(x):
+        return np.finfo(np.float64).max if x > 0 else -np.finfo(np.float64).max
+    return x
+
+@kernel(OUT, IN, IN, BOOL, OUT, INT)
+def dm_into(delta_high: np.ndarray, delta_low: np.ndarray, plus: bool, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """
+        HD:=HIGH-REF(HIGH,1);  LD:=REF(LOW,1)-LOW;  缺数据的HD、LD视为0
+        plus为True时计算 IF(HD>0&&HD>LD,HD,0), 否则计算 IF(LD>0&&LD>HD,LD,0)
+    """
+    for i in range(start, len(delta_high)):
+        hd = _nan_to_num(delta_high[i])
+        ld = _nan_to_num(-delta_low[i])
+        if plus:
+            out[i] = hd if (hd > 0 and hd > ld) else 0.0
+        else:
+            out[i] = ld if (ld > 0 and ld > hd) else 0.0
+    return out
+
+graph_instance = Graph()
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    参数扫描用的批量计算核心 一次调用算出多组参数的指标 返回 (参数组 × 日期) 的二维数组
+    相同的中间结果只算一次(每个不同的EMA周期只算一次), 各组参数之间用prange并行
+    每一行的结果与单独调用对应的get_xxx完全相同
+"""
+
+import numba
+import numpy as np
+
+from indexes.rolling import rolling_max, rolling_mean, rolling_min
+from indexes.signature import IN, INTS, NEW_MATRIX, kernel
+
+
+@kernel(NEW_MATRIX, IN, INTS, parallel=True)
+def calc_ma_grid(array: np.ndarray, periods: np.ndarray) -> np.ndarray:
+    """
+        多个周期的简单移动平均线 数据天数不多于周期的行全为NaN(与get_ma一致)
+        每个周期用与get_ma相同的rolling_mean递推, 不用共用的前缀和: 前缀和遇到一个NaN之后全部为NaN, 而递推在窗口滑过NaN后恢复
+    """
+    length = len(array)
+    result = np.full((len(periods), length), np.nan)
+    for p in numba.prange(len(periods)):
+        days = periods[p]
+        if length > days:
+            rolling_mean(array, days, result[p])
+    return result
+
+
+@kernel(NEW_MATRIX, IN, INTS, parallel=True)
+def calc_ema_grid(array: np.ndarray, spans: np.ndarray) -> np.ndarray:
+    """ 多个周期的指数移动平均线 递推方式与calc_ema相同 """
+    length = len(array)
+    result = np.empty((len(spans), length), np.float64)
+    for p in numba.prange(len(spans)):
+        days = spans[p]
+        result[p, 0] = 0.0 if np.isnan(array[0]) else array[0]
+        for i in range(1, length):
+            result[p, i] = result[p, i-1] * (days-1) / (days+1) + array[i] * 2 / (days+1)
+    return result
+
+
+@kernel(NEW_MATRIX, IN, INTS, INTS, INTS, INTS, parallel=True)
+def calc_macd_grid(array: np.ndarray, spans: np.ndarray, short_idx: np.ndarray, long_idx: np.ndarray,
+                   mids: np.ndarray) -> np.ndarray:
+    """
+        多组参数的MACD, 第k组为 (spans[short_idx[k]], spans[long_idx[k]], mids[k])
+        spans是去重后的EMA周期, 每个周期的EMA只算一次
+    """
+    ema = calc_ema_grid(array, spans)
+    length = len(array)
+    result = np.empty((len(mids), length), np.float64)
+    for k in numba.prange(len(mids)):
+        s = short_idx[k]
+        l = long_idx[k]
+        mid = mids[k]
+        # DIF:EMA(CLOSE,SHORT)-EMA(CLOSE,LONG);  DEA:EMA(DIF,MID);  MACD:(DIF-DEA)*2;
+        dif = ema[s, 0] - ema[l, 0]
+        dea = 0.0 if np.isnan(dif) else dif
+        result[k, 0] = (dif - dea) * 2
+        for i in range(1, length):
+            dif = ema[s, i] - ema[l, i]
+            dea = dea * (mid-1) / (mid+1) + dif * 2 / (mid+1)
+            result[k, i] = (dif - dea) * 2
+    return result
+
+
+@kernel(NEW_MATRIX, IN, INTS, parallel=True)
+def calc_rsi_grid(close: np.ndarray, periods: np.ndarray) -> np.ndarray:
+    """ 多个周期的RSI MAX(CLOSE-LC,0)与ABS(CLOSE-LC)只算一次 """
+    length = len(close)
+    up = np.empty(length, np.float64)
+    change = np.empty(length, np.float64)
+    up[0] = np.nan  # LC:=REF(CLOSE,1) 第一天没有前一日的收盘价
+    change[0] = np.nan
+    for i in range(1, length):
+        diff = close[i] - close[i-1]
+        up[i] = diff if (diff > 0 or np.isnan(diff)) else 0.0  # 与np.maximum(CLOSE-LC,0)一致 NaN保持NaN
+        change[i] = abs(diff)
+
+    result = np.empty((len(periods), length), np.float64)
+    for p in numba.prange(len(periods)):
+        n = periods[p]
+        sma_up = 0.0  # SMA的初始值 array第一个值为NaN时取0
+        sma_change = 0.0
+        result[p, 0] = sma_up / (sma_change + 1e-6) * 100
+        for i in range(1, length):
+            sma_up = sma_up * (n-1) / n + up[i] * 1 / n
+            sma_change = sma_change * (n-1) / n + change[i] * 1 / n
+            result[p, i] = sma_up / (sma_change + 1e-6) * 100
+    return result
+
+
+@kernel(NEW_MATRIX, IN, IN, IN, INTS, INTS, INTS, parallel=True)
+def calc_kdj_grid(close: np.ndarray, high: np.ndarray, low: np.ndarray, ns: np.ndarray,
+                  n_idx: np.ndarray, ms: np.ndarray) -> np.ndarray:
+    """
+        多组参数的KDJ的J值, 第k组为 (ns[n_idx[k]], ms[k])
+        ns是去重后的N, 每个N的LLV/HHV/RSV只算一次
+    """
+    length = len(close)
+    rsv = np.empty((len(ns), length), np.float64)
+    for p in numba.prange(len(ns)):
+        llv = rolling_min(low, ns[p], np.empty(length, np.float64))
+        hhv = rolling_max(high, ns[p], np.empty(length, np.float64))
+        for i in range(length):
+            rsv[p, i] = (close[i] - llv[i]) / (hhv[i] - llv[i] + 0.00000001) * 100
+        if np.isnan(rsv[p, 0]):
+            rsv[p, 0] = 0
+
+    result = np.empty((len(ms), length), np.float64)
+    for k in numba.prange(len(ms)):
+        row = n_idx[k]
+        m = ms[k]
+        # K:SMA(RSV,M1,1);  D:SMA(K,M2,1);  J:3*K-2*D;
+        k_value = rsv[row, 0]
+        d_value = 0.0 if np.isnan(k_value) else k_value
+        result[k, 0] = 3 * k_value - 2 * d_value
+        for i in range(1, length):
+            k_value = k_value * (m-1) / m + rsv[row, i] * 1 / m
+            d_value = d_value * (m-1) / m + k_value * 1 / m
+            result[k, i] = 3 * k_value - 2 * d_value
+    return result
@@ -1,12 +1,16 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+import itertools
+from typing import Sequence
+
 import numpy as np
 from dto_enum import OHLCV
 from global_data import global_data_instance
 
 from indexes import Index
-from indexes.base import Index
+from indexes.base import Index, buffer_pool_instance, calc_sma_into
+from indexes.graph import graph_instance
 
 
 class KDJ(Index):
@@ -24,53 +28,92 @@ class KDJ(Index):
     def get_kdj(self, symbol: str, date: str, n: int, m: int):
         """ 计算所有日期的 KDJ 序列, 返回给定日期的 KDJ 的J值 """
 
-        key = f'kdj-{n}-{m}'
-        if self.computed_memo.contains(symbol, key):
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                if date in global_data_instance.symbol_to_date_set[symbol]:
-                    offset = global_data_instance.find_date_offset(symbol, date)
-                    return self.computed_memo.get(symbol, key)[offset]
-                else:
-                    return np.nan
+        key = ('kdj', n, m)
+        cached = self.computed_memo.lookup(symbol, key)
+        if cached is not None and len(cached) == len(global_data_instance.symbol_to_date_list[symbol]):  # 已有计算 并且array长度相等(数据存在且正确)
+            if date in global_data_instance.symbol_to_date_set[symbol]:
+                offset = global_data_instance.find_date_offset(symbol, date)
+                return cached[offset]
+            else:
+                return np.nan
+
+        j = self._kdj_series(symbol, n, m)
+
+        offset = global_data_instance.find_date_offset(symbol, date)
+        return j[offset]
 
+    def get_kdj_range(self, symbol: str, start: str, end: str, n: int, m: int) -> np.ndarray:
+        """ 返回日期在 [start, end] 之间的 KDJ的J值 序列, 是缓存序列的只读视图(不复制) """
+        return self.slice_dates(symbol, self._kdj_series(symbol, n, m), start, end)
+
+    def get_kdj_batch(self, symbol: str, dates: Sequence[str], n: int, m: int) -> np.ndarray:
+        """ 返回多个日期的 KDJ的J值, 数据中不存在的日期为NaN """
+        return self.take_dates(symbol, self._kdj_series(symbol, n, m), dates)
+
+    def _kdj_series(self, symbol: str, n: int, m: int) -> np.ndarray:
+        """ 计算所有日期的 KDJ的J值 序列 有缓存时只计算新增的K线 """
         close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
         high_array = global_data_instance.get_array_since_date(symbol, OHLCV.HIGH, global_data_instance.START_DOWNLOAD_DATE)
         low_array = global_data_instance.get_array_since_date(symbol, OHLCV.LOW, global_data_instance.START_DOWNLOAD_DATE)
 
-        # 获取LLV(N)
-        key = f'llv-{n}'
-        llv = None
-        if self.computed_memo.contains(symbol, key):  # 已有计算
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                llv = self.computed_memo.get(symbol, key)
-        if llv is None:
-            llv = self.llv(low_array, n)
-            self.computed_memo.set(symbol, key, llv)  # 计算出来后填入缓存
-
-        # 获取HHV(N)
-        key = f'hhv-{n}'
-        hhv = None
-        if self.computed_memo.contains(symbol, key):  # 已有计算
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                hhv = self.computed_memo.get(symbol, key)
-        if hhv is None:
-            hhv = self.hhv(high_array, n)
-            self.computed_memo.set(symbol, key, hhv)  # 计算出来后填入缓存
-
-        # RSV:=(CLOSE-LLV(LOW,N))/(HHV(HIGH,N)-LLV(LOW,N))*100;
-        rsv: np.ndarray = (close_array - llv) / (hhv - llv + 0.00000001) * 100  # 避免除以0
-        if np.isnan(rsv[0]):  # 若第一天停牌 则hhv-llv等于0 相除之后会变成nan 导致之后的计算全部错误
-            rsv[0] = 0
-
-        k = self.sma(rsv, m, 1)
-        d = self.sma(k, m, 1)
-        j = 3 * k - 2 * d
+        length = len(close_array)
+        assert n > 1, 'n应>=2'
+
+        # 获取LLV(LOW,N)与HHV(HIGH,N) 参数N相同的KDJ共用
+        llv = graph_instance.series(symbol, ('llv', OHLCV.LOW, n))
+        hhv = graph_instance.series(symbol, ('hhv', OHLCV.HIGH, n))
+
+        # RSV:=(CLOSE-LLV(LOW,N))/(HHV(HIGH,N)-LLV(LOW,N))*100;  只算从begin开始的部分 写入rsv, spread为临时缓冲区
+        def calc_rsv(begin: int, rsv: np.ndarray, spread: np.ndarray) -> np.ndarray:
+            np.subtract(hhv[begin:], llv[begin:], out=spread)
+            np.add(spread, 0.00000001, out=spread)  # 避免除以0
+            np.subtract(close_array[begin:], llv[begin:], out=rsv)
+            np.divide(rsv, spread, out=rsv)
+            np.multiply(rsv, 100, out=rsv)
+            if begin == 0 and np.isnan(rsv[0]):  # 若第一天停牌 则hhv-llv等于0 相除之后会变成nan 导致之后的计算全部错误
+                rsv[0] = 0
+            return rsv
 
+        # K:SMA(RSV,M1,1);  D:SMA(K,M2,1);  K和D都是递推的 需要缓存下来才能接着往后算
+        def compute_k(out: np.ndarray, start: int):
+            begin = max(0, start - 1)
+            with buffer_pool_instance.borrow(length - begin, 2) as (rsv, spread):
+                calc_sma_into(calc_rsv(begin, rsv, spread), m, 1, out[begin:], start - begin)
+        k = self.extend_series(symbol, ('k', n, m), length, compute_k)
+
+        def compute_d(out: np.ndarray, start: int):
+            begin = max(0, start - 1)
+            calc_sma_into(k[begin:], m, 1, out[begin:], start - begin)
+        d = self.extend_series(symbol, ('d', n, m), length, compute_d)
+
+        # J:3*K-2*D;
         # 计算KDJ需要较多运算 不能直接读取(要算SMA) 所以把结果暂时存下来
-        key = f'kdj-{n}-{m}'
-        self.computed_memo.set(symbol, key, j)
+        def compute_j(out: np.ndarray, start: int):
+            j = out[start:]
+            with buffer_pool_instance.borrow(length - start) as (twice_d,):
+                np.multiply(k[start:], 3, out=j)
+                np.multiply(d[start:], 2, out=twice_d)
+                np.subtract(j, twice_d, out=j)
+        j = self.extend_series(symbol, ('kdj', n, m), length, compute_j)
 
-        offset = global_data_instance.find_date_offset(symbol, date)
-        return j[offset]
+        return j
+
+    def get_kdj_grid(self, symbol: str, ns, ms) -> np.ndarray:
+        """
+            一次算出多组参数的KDJ的J值序列, 参数组按itertools.product(ns, ms)的顺序排列,
+            返回 (参数组数 × 日期数) 的数组。每个不同的N只算一次LLV/HHV/RSV
+        """
+        from indexes.grid import calc_kdj_grid  # 并行核心编译较慢, 第一次用到时才import
+        close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+        high_array = global_data_instance.get_array_since_date(symbol, OHLCV.HIGH, global_data_instance.START_DOWNLOAD_DATE)
+        low_array = global_data_instance.get_array_since_date(symbol, OHLCV.LOW, global_data_instance.START_DOWNLOAD_DATE)
+
+        combos = list(itertools.product(ns, ms))
+        distinct_ns = sorted(set(ns))
+        assert distinct_ns[0] > 1, 'n应>=2'
+        n_idx = {n: i for i, n in enumerate(distinct_ns)}
+        return calc_kdj_grid(close_array, high_array, low_array, np.array(distinct_ns, dtype=np.int64),
+                             np.array([n_idx[c[0]] for c in combos], dtype=np.int64),
+                             np.array([c[1] for c in combos], dtype=np.int64))
 
 kdj_instance = KDJ()
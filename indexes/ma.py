@@ -1,11 +1,14 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+from typing import Sequence
+
 import numpy as np
 from dto_enum import OHLCV
 from global_data import global_data_instance
 
 from indexes import Index
+from indexes.graph import graph_instance
 
 
 class MA(Index):
@@ -14,25 +17,42 @@ class MA(Index):
     def get_ma(self, symbol: str, date: str, n: int) -> float:
         """ 计算所有日期的 N日均线 的序列（若有缓存则无需计算），返回给定日期的 N日均线 的值 """
 
-        key = f'ma-{n}'
-        if self.computed_memo.contains(symbol, key):  # 已有计算
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                if date in global_data_instance.symbol_to_date_set[symbol]:
-                    offset = global_data_instance.find_date_offset(symbol, date)
-                    return self.computed_memo.get(symbol, key)[offset]
-                else:
-                    return np.nan
+        node = ('ma', OHLCV.CLOSE, n)  # MA(CLOSE,N)保存在计算图中 其他指标可以直接使用
+        cached = graph_instance.cached(symbol, node)
+        if cached is not None:  # 已有计算 并且array长度相等(数据存在且正确)
+            if date in global_data_instance.symbol_to_date_set[symbol]:
+                offset = global_data_instance.find_date_offset(symbol, date)
+                return cached[offset]
+            else:
+                return np.nan
 
-        close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+        ma_array = self._ma_series(symbol, n)
+
+        offset = global_data_instance.find_date_offset(symbol, date)
+        return ma_array[offset]
 
-        # 计算MA
-        if len(close_array) > n:  # 避免只有50天数据却计算了MA90的问题 否则求卷积后提取时会有问题
-            ma_array = self.ma(close_array, n)
-            self.computed_memo.set(symbol, key, ma_array)  # 计算出来后填入缓存
+    def get_ma_range(self, symbol: str, start: str, end: str, n: int) -> np.ndarray:
+        """ 返回日期在 [start, end] 之间的 N日均线 序列, 是缓存序列的只读视图(不复制) """
+        return self.slice_dates(symbol, self._ma_series(symbol, n), start, end)
 
-            offset = global_data_instance.find_date_offset(symbol, date)
-            return ma_array[offset]
-        else:
-            return np.nan
+    def get_ma_batch(self, symbol: str, dates: Sequence[str], n: int) -> np.ndarray:
+        """ 返回多个日期的 N日均线, 数据中不存在的日期为NaN """
+        return self.take_dates(symbol, self._ma_series(symbol, n), dates)
+
+    def _ma_series(self, symbol: str, n: int) -> np.ndarray:
+        """ 计算所有日期的 N日均线 序列 有缓存时只计算新增的K线 """
+        close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+        if len(close_array) <= n:  # 避免只有50天数据却计算了MA90的问题
+            return np.full(len(close_array), np.nan)
+        return graph_instance.series(symbol, ('ma', OHLCV.CLOSE, n))
+
+    def get_ma_grid(self, symbol: str, periods) -> np.ndarray:
+        """
+            一次算出多个周期的 N日均线 序列, 返回 (len(periods) × 日期数) 的数组, 第i行对应periods[i]
+            日期与global_data_instance.symbol_to_date_list[symbol]对齐, 数据天数不多于周期的行全为NaN
+        """
+        from indexes.grid import calc_ma_grid  # 并行核心编译较慢, 第一次用到时才import
+        close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+        return calc_ma_grid(close_array, np.asarray(periods, dtype=np.int64))
 
 ma_instance = MA()
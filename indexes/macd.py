@@ -1,11 +1,16 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+import itertools
+from typing import Sequence
+
 import numpy as np
 from dto_enum import OHLCV
 from global_data import global_data_instance
 
 from indexes import Index
+from indexes.base import buffer_pool_instance, calc_ema_into
+from indexes.graph import graph_instance
 
 
 class MACD(Index):
@@ -22,41 +27,61 @@ class MACD(Index):
     def get_macd(self, symbol: str, date: str, short: int, long: int, mid: int):
         """ 计算所有日期的MACD序列, 返回给定日期的MACD """
 
+        macd = self._macd_series(symbol, short, long, mid)
+
+        offset = global_data_instance.find_date_offset(symbol, date)
+        return macd[offset]
+
+    def get_macd_range(self, symbol: str, start: str, end: str, short: int, long: int, mid: int) -> np.ndarray:
+        """ 返回日期在 [start, end] 之间的 MACD 序列, 是缓存序列的只读视图(不复制) """
+        return self.slice_dates(symbol, self._macd_series(symbol, short, long, mid), start, end)
+
+    def get_macd_batch(self, symbol: str, dates: Sequence[str], short: int, long: int, mid: int) -> np.ndarray:
+        """ 返回多个日期的 MACD, 数据中不存在的日期为NaN """
+        return self.take_dates(symbol, self._macd_series(symbol, short, long, mid), dates)
+
+    def _macd_series(self, symbol: str, short: int, long: int, mid: int) -> np.ndarray:
+        """ 计算所有日期的 MACD 序列 有缓存时只计算新增的K线 """
         close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+        length = len(close_array)
 
-        # 获取EMA(CLOSE,SHORT)
-        key = f'ema-{short}'
-        ema_short = None
-        if self.computed_memo.contains(symbol, key):  # 已有计算
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                ema_short = self.computed_memo.get(symbol, key)
-        if ema_short is None:
-            ema_short = self.ema(close_array, short)
-            self.computed_memo.set(symbol, key, ema_short)  # 计算出来后填入缓存
-
-        # 获取EMA(CLOSE,LONG)
-        key = f'ema-{long}'
-        ema_long = None
-        if self.computed_memo.contains(symbol, key):  # 已有计算
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                ema_long = self.computed_memo.get(symbol, key)
-        if ema_long is None:
-            ema_long = self.ema(close_array, long)
-            self.computed_memo.set(symbol, key, ema_long)  # 计算出来后填入缓存
+        # 获取EMA(CLOSE,SHORT)与EMA(CLOSE,LONG) 有缓存时只计算新增的K线
+        ema_short = graph_instance.series(symbol, ('ema', OHLCV.CLOSE, short))
+        ema_long = graph_instance.series(symbol, ('ema', OHLCV.CLOSE, long))
 
         # DIF:EMA(CLOSE,SHORT)-EMA(CLOSE,LONG);
-        dif: np.ndarray = ema_short - ema_long
-
-        # DEA:EMA(DIF,MID);
-        dea: np.ndarray = self.ema(dif, mid)
+        # DEA:EMA(DIF,MID);  DEA是递推的 需要缓存下来才能接着往后算
+        def compute_dea(out: np.ndarray, start: int):
+            begin = max(0, start - 1)
+            with buffer_pool_instance.borrow(length - begin) as (dif,):
+                np.subtract(ema_short[begin:], ema_long[begin:], out=dif)
+                calc_ema_into(dif, mid, out[begin:], start - begin)
+        dea = self.extend_series(symbol, ('dea', short, long, mid), length, compute_dea)
 
         # MACD:(DIF-DEA)*2;
-        macd: np.ndarray = (dif - dea) * 2
+        def compute_macd(out: np.ndarray, start: int):
+            macd = out[start:]
+            np.subtract(ema_short[start:], ema_long[start:], out=macd)  # DIF
+            np.subtract(macd, dea[start:], out=macd)
+            np.multiply(macd, 2, out=macd)
+        macd = self.extend_series(symbol, ('macd', short, long, mid), length, compute_macd)
 
-        key = f'macd-{short}-{long}-{mid}'
-        self.computed_memo.set(symbol, key, macd)
+        return macd
 
-        offset = global_data_instance.find_date_offset(symbol, date)
-        return macd[offset]
+    def get_macd_grid(self, symbol: str, shorts, longs, mids) -> np.ndarray:
+        """
+            一次算出多组参数的MACD序列, 参数组按itertools.product(shorts, longs, mids)的顺序排列,
+            返回 (参数组数 × 日期数) 的数组。每个不同周期的EMA只算一次
+        """
+        from indexes.grid import calc_macd_grid  # 并行核心编译较慢, 第一次用到时才import
+        close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+
+        combos = list(itertools.product(shorts, longs, mids))
+        spans = sorted(set(shorts) | set(longs))
+        span_idx = {span: i for i, span in enumerate(spans)}
+        short_idx = np.array([span_idx[c[0]] for c in combos], dtype=np.int64)
+        long_idx = np.array([span_idx[c[1]] for c in combos], dtype=np.int64)
+        mid_array = np.array([c[2] for c in combos], dtype=np.int64)
+        return calc_macd_grid(close_array, np.array(spans, dtype=np.int64), short_idx, long_idx, mid_array)
 
 macd_instance = MACD()
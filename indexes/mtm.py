@@ -1,11 +1,15 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+from typing import Sequence
+
 import numpy as np
 from dto_enum import OHLCV
 from global_data import global_data_instance
 
-from indexes.base import Index, ref
+from indexes.base import Index
+from indexes.graph import graph_instance
+from indexes.rolling import rolling_mean
 
 
 class MTM(Index):
@@ -18,26 +22,42 @@ class MTM(Index):
     def get_mtm(self, symbol: str, date: str, n: int, m: int):
         """ 计算所有日期的MTM序列, 返回给定日期的 MTM(n, m) """
 
-        key = f'mtmma-{n}-{m}'
-        if self.computed_memo.contains(symbol, key):
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                if date in global_data_instance.symbol_to_date_set[symbol]:
-                    offset = global_data_instance.find_date_offset(symbol, date)
-                    return self.computed_memo.get(symbol, key)[offset]
-                else:
-                    return np.nan
+        key = ('mtmma', n, m)
+        cached = self.computed_memo.lookup(symbol, key)
+        if cached is not None and len(cached) == len(global_data_instance.symbol_to_date_list[symbol]):  # 已有计算 并且array长度相等(数据存在且正确)
+            if date in global_data_instance.symbol_to_date_set[symbol]:
+                offset = global_data_instance.find_date_offset(symbol, date)
+                return cached[offset]
+            else:
+                return np.nan
+
+
+        mtmma = self._mtm_series(symbol, n, m)
 
+        offset = global_data_instance.find_date_offset(symbol, date)
+        return mtmma[offset]
 
+    def get_mtm_range(self, symbol: str, start: str, end: str, n: int, m: int) -> np.ndarray:
+        """ 返回日期在 [start, end] 之间的 MTM(n, m) 序列, 是缓存序列的只读视图(不复制) """
+        return self.slice_dates(symbol, self._mtm_series(symbol, n, m), start, end)
+
+    def get_mtm_batch(self, symbol: str, dates: Sequence[str], n: int, m: int) -> np.ndarray:
+        """ 返回多个日期的 MTM(n, m), 数据中不存在的日期为NaN """
+        return self.take_dates(symbol, self._mtm_series(symbol, n, m), dates)
+
+    def _mtm_series(self, symbol: str, n: int, m: int) -> np.ndarray:
+        """ 计算所有日期的 MTM(n, m) 序列 有缓存时只计算新增的K线 """
         close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
 
         # DELTA:CLOSE-REF(CLOSE,N)
-        delta: np.ndarray = close_array - ref(close_array, n)
+        delta = graph_instance.series(symbol, ('delta', OHLCV.CLOSE, n))
 
-        # MTMMA:MA(DELTA,M)
-        mtmma = self.ma(delta, m)
-        self.computed_memo.set(symbol, key, mtmma)  # 计算出来后填入缓存
+        # MTMMA:MA(DELTA,M)  有缓存时只计算新增的K线
+        def compute(out: np.ndarray, start: int):
+            begin = max(0, start - m)  # MA(DELTA,M)需要start之前m天的DELTA
+            rolling_mean(delta[begin:], m, out[begin:], start - begin, begin)
+        mtmma = self.extend_series(symbol, ('mtmma', n, m), len(close_array), compute)
 
-        offset = global_data_instance.find_date_offset(symbol, date)
-        return mtmma[offset]
+        return mtmma
 
 mtm_instance = MTM()
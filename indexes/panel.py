@@ -0,0 +1,364 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    横截面计算: 把多只股票的OHLCV按统一的日期轴排成 (symbol × date) 的二维数组, 某只股票没有的K线填NaN
+    每个指标用一个并行的numba核心对所有股票一次算完, 返回同样形状的矩阵
+    每一行只取该股票自身存在的K线来计算, 结果与单只股票调用get_xxx的结果一致
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numba
+import numpy as np
+import pandas as pd
+from dto_enum import OHLCV
+from global_data import global_data_instance
+
+from indexes.base import calc_ema, calc_hhv, calc_llv, calc_ma, calc_sma, ref
+from indexes.dmi import calc_mtr
+from indexes.rolling import rolling_avedev, rolling_sum
+from indexes.signature import IN, INT, MASK, MATRIX, MATRIX_MASK, NEW, NEW_MATRIX, NEW_MATRIX_PAIR, NEW_PAIR, NONE, OUT, kernel
+
+
+class Panel():
+    """ 多只股票对齐到同一日期轴的OHLCV数据 以及在其上计算的各指标矩阵 """
+
+    def __init__(self, symbols: List[str], frames: Dict[str, pd.DataFrame] = None):
+        """ 默认从global_data_instance取数据; 也可传入frames直接使用给定的 {symbol: dataframe} (格式同GlobalData.add_data的返回值) """
+        self.symbols: List[str] = list(symbols)
+        date_lists = []
+        columns = {column: [] for column in OHLCV}
+        for symbol in self.symbols:
+            if frames is None:
+                for column in OHLCV:  # 取数组时若未下载会先下载
+                    columns[column].append(global_data_instance.get_array_since_date(symbol, column, global_data_instance.START_DOWNLOAD_DATE))
+                date_lists.append(global_data_instance.symbol_to_date_list[symbol])
+            else:
+                df = frames[symbol]
+                for column in OHLCV:
+                    columns[column].append(df[column.name.lower()].to_numpy())
+                date_lists.append(list(df.index))
+
+        self.dates: np.ndarray = np.array(sorted(set().union(*date_lists)))  # 所有股票日期的并集 'YYYY-MM-DD'
+        self._date_to_offset: Dict[str, int] = {date: i for i, date in enumerate(self.dates)}
+        self._symbol_to_row: Dict[str, int] = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        shape = (len(self.symbols), len(self.dates))
+        self.mask = np.zeros(shape, dtype=np.bool_)  # 该股票当天是否有K线
+        self._data: Dict[OHLCV, np.ndarray] = {column: np.full(shape, np.nan) for column in OHLCV}
+        for row, date_list in enumerate(date_lists):
+            positions = np.searchsorted(self.dates, date_list)
+            self.mask[row, positions] = True
+            for column in OHLCV:
+                self._data[column][row, positions] = columns[column][row]
+
+        self._computed: Dict[Tuple, object] = {}  # 缓存已算出的指标矩阵
+
+    @property
+    def open(self) -> np.ndarray:
+        return self._data[OHLCV.OPEN]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self._data[OHLCV.HIGH]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self._data[OHLCV.LOW]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self._data[OHLCV.CLOSE]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self._data[OHLCV.VOLUME]
+
+    def row(self, symbol: str) -> int:
+        return self._symbol_to_row[symbol]
+
+    def date_offset(self, date: str) -> int:
+        """ 给定日期在日期轴上的偏移量 日期必须是某只股票的交易日 """
+        return self._date_to_offset[date]
+
+    def at(self, matrix: np.ndarray, date: str) -> np.ndarray:
+        """ 取出矩阵中给定日期的一列 即所有股票当天的值 """
+        return matrix[:, self.date_offset(date)]
+
+    def between(self, matrix: np.ndarray, start: str, end: str) -> np.ndarray:
+        """ 取出矩阵中 [start, end] 日期范围内的列, 返回视图不复制 """
+        left = np.searchsorted(self.dates, start, side='left')
+        right = np.searchsorted(self.dates, end, side='right')
+        return matrix[:, left:right]
+
+    def to_frame(self, matrix: np.ndarray) -> pd.DataFrame:
+        """ 以symbol为行、日期为列转换成DataFrame """
+        return pd.DataFrame(matrix, index=self.symbols, columns=self.dates)
+
+    def _get(self, key: Tuple, compute):
+        if key not in self._computed:
+            self._computed[key] = compute()
+        return self._computed[key]
+
+    def ma(self, n: int) -> np.ndarray:
+        return self._get(('ma', n), lambda: panel_ma(self.close, self.mask, n))
+
+    def forget(self, keys: Sequence[Tuple]):
+        """ 删除已算出的指标矩阵 如 [('macd', 12, 26, 9)], 释放内存 """
+        for key in keys:
+            self._computed.pop(tuple(key), None)
+
+    def ema(self, n: int) -> np.ndarray:
+        """ EMA(CLOSE,N) 参数short或long相同的MACD共用 """
+        return self._get(('ema', n), lambda: panel_ema(self.close, self.mask, n))
+
+    def macd(self, short: int, long: int, mid: int) -> np.ndarray:
+        return self._get(('macd', short, long, mid), lambda: panel_macd_ema(self.ema(short), self.ema(long), self.mask, mid))
+
+    def rsi(self, n: int) -> np.ndarray:
+        return self._get(('rsi', n), lambda: panel_rsi(self.close, self.mask, n))
+
+    def rsv(self, n: int) -> np.ndarray:
+        """ KDJ中的RSV 参数n相同的KDJ共用 """
+        return self._get(('rsv', n), lambda: panel_rsv(self.close, self.high, self.low, self.mask, n))
+
+    def kdj(self, n: int, m: int) -> np.ndarray:
+        """ 返回KDJ的J值矩阵 """
+        return self._get(('kdj', n, m), lambda: panel_kdj_rsv(self.rsv(n), self.mask, m))
+
+    def mtm(self, n: int, m: int) -> np.ndarray:
+        return self._get(('mtm', n, m), lambda: panel_mtm(self.close, self.mask, n, m))
+
+    def cci(self, n: int) -> np.ndarray:
+        return self._get(('cci', n), lambda: panel_cci(self.close, self.high, self.low, self.mask, n))
+
+    def dmi(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ 返回 (PDI, MDI) 两个矩阵 """
+        return self._get(('dmi', n), lambda: panel_dmi(self.close, self.high, self.low, self.mask, n))
+
+
+# 各指标的输出名称 如('dmi', 14)有两个输出 pdi(14)与mdi(14)
+INDICATOR_OUTPUTS: Dict[str, Tuple[str, ...]] = {
+    'ma': ('ma',), 'macd': ('macd',), 'rsi': ('rsi',), 'kdj': ('kdj',), 'mtm': ('mtm',), 'cci': ('cci',), 'dmi': ('pdi', 'mdi'),
+}
+
+
+def output_names(indicator: Sequence) -> List[str]:
+    """ ('macd', 12, 26, 9) -> ['macd(12,26,9)']   ('dmi', 14) -> ['pdi(14)', 'mdi(14)'] """
+    name, *params = indicator
+    return [f'{output}({",".join(map(str, params))})' for output in INDICATOR_OUTPUTS[name]]
+
+
+class IndicatorPanel():
+    """
+        各symbol的指标结果对齐到同一日期轴 布局与Panel相同: 每个输出是 (symbol × date) 的矩阵, 某只股票没有的K线为NaN
+        panel['macd(12,26,9)'] 取出矩阵; 计算失败的symbol不在symbols中, 原因见errors
+    """
+
+    def __init__(self, results: Dict[str, Dict[str, np.ndarray]], outputs: Sequence[str], errors: Dict[str, str] = None):
+        self.symbols: List[str] = list(results)
+        self.errors: Dict[str, str] = dict(errors or {})
+        date_index = np.unique(np.concatenate([r['dates'] for r in results.values()])) if results else np.array([], 'datetime64[D]')
+        self.dates: np.ndarray = np.datetime_as_string(date_index)  # 所有股票日期的并集 'YYYY-MM-DD'
+        self._symbol_to_row: Dict[str, int] = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        shape = (len(self.symbols), len(self.dates))
+        self.mask = np.zeros(shape, dtype=np.bool_)  # 该股票当天是否有K线
+        self.matrices: Dict[str, np.ndarray] = {output: np.full(shape, np.nan) for output in outputs}
+        for row, arrays in enumerate(results.values()):
+            positions = np.searchsorted(date_index, arrays['dates'])
+            self.mask[row, positions] = True
+            for output in outputs:
+                self.matrices[output][row, positions] = arrays[output]
+
+    def __getitem__(self, output: str) -> np.ndarray:
+        return self.matrices[output]
+
+    def row(self, symbol: str) -> int:
+        return self._symbol_to_row[symbol]
+
+    def at(self, output: str, date: str) -> np.ndarray:
+        """ 所有股票在给定日期的值 """
+        return self.matrices[output][:, int(np.searchsorted(self.dates, date))]
+
+    def between(self, output: str, start: str, end: str) -> np.ndarray:
+        """ 日期在 [start, end] 之间的列, 返回视图不复制 """
+        left = np.searchsorted(self.dates, start, side='left')
+        right = np.searchsorted(self.dates, end, side='right')
+        return self.matrices[output][:, left:right]
+
+    def to_frame(self, output: str) -> pd.DataFrame:
+        """ 以symbol为行、日期为列转换成DataFrame """
+        return pd.DataFrame(self.matrices[output], index=self.symbols, columns=self.dates)
+
+
+@kernel(NEW, IN, MASK)
+def _gather(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """ 取出一行中该股票存在的K线 """
+    return values[mask]
+
+@kernel(NONE, OUT, MASK, IN)
+def _scatter(out: np.ndarray, mask: np.ndarray, values: np.ndarray):
+    """ 把按该股票自身K线算出的结果放回日期轴上对应的位置 """
+    j = 0
+    for i in range(len(mask)):
+        if mask[i]:
+            out[i] = values[j]
+            j += 1
+
+# 以下series_xxx计算一只股票自身K线上的指标 数据不够时全为NaN, 与单只股票调用get_xxx一致
+# panel_xxx把每一行的K线取出后调用series_xxx, 各行之间并行
+
+@kernel(NEW, IN, INT)
+def series_ma(close: np.ndarray, n: int) -> np.ndarray:
+    if len(close) <= n:
+        return np.full(len(close), np.nan)
+    return calc_ma(close, n)
+
+@kernel(NEW, IN, INT)
+def series_ema(close: np.ndarray, n: int) -> np.ndarray:
+    if len(close) == 0:
+        return np.empty(0, np.float64)
+    return calc_ema(close, n)
+
+@kernel(NEW, IN, IN, INT)
+def series_macd_ema(ema_short: np.ndarray, ema_long: np.ndarray, mid: int) -> np.ndarray:
+    """ 由EMA(CLOSE,SHORT)与EMA(CLOSE,LONG)算MACD """
+    if len(ema_short) == 0:
+        return np.empty(0, np.float64)
+    dif = ema_short - ema_long
+    dea = calc_ema(dif, mid)
+    return (dif - dea) * 2
+
+@kernel(NEW, IN, INT, INT, INT)
+def series_macd(close: np.ndarray, short: int, long: int, mid: int) -> np.ndarray:
+    return series_macd_ema(series_ema(close, short), series_ema(close, long), mid)
+
+@kernel(NEW, IN, INT)
+def series_rsi(close: np.ndarray, n: int) -> np.ndarray:
+    if len(close) <= 1:
+        return np.full(len(close), np.nan)
+    lc = ref(close, 1)
+    return calc_sma(np.maximum(close-lc, 0), n, 1) / (calc_sma(np.abs(close-lc), n, 1) + 1e-6) * 100
+
+@kernel(NEW, IN, IN, IN, INT)
+def series_rsv(close: np.ndarray, high: np.ndarray, low: np.ndarray, n: int) -> np.ndarray:
+    """ RSV:=(CLOSE-LLV(LOW,N))/(HHV(HIGH,N)-LLV(LOW,N))*100; """
+    if len(close) == 0:
+        return np.empty(0, np.float64)
+    llv = calc_llv(low, n)
+    hhv = calc_hhv(high, n)
+    rsv = (close - llv) / (hhv - llv + 0.00000001) * 100
+    if np.isnan(rsv[0]):
+        rsv[0] = 0
+    return rsv
+
+@kernel(NEW, IN, INT)
+def series_kdj_rsv(rsv: np.ndarray, m: int) -> np.ndarray:
+    """ 由RSV算KDJ的J值 """
+    if len(rsv) == 0:
+        return np.empty(0, np.float64)
+    k = calc_sma(rsv, m, 1)
+    d = calc_sma(k, m, 1)
+    return 3 * k - 2 * d
+
+@kernel(NEW, IN, IN, IN, INT, INT)
+def series_kdj(close: np.ndarray, high: np.ndarray, low: np.ndarray, n: int, m: int) -> np.ndarray:
+    """ KDJ的J值 """
+    return series_kdj_rsv(series_rsv(close, high, low, n), m)
+
+@kernel(NEW, IN, INT, INT)
+def series_mtm(close: np.ndarray, n: int, m: int) -> np.ndarray:
+    if len(close) <= n:
+        return np.full(len(close), np.nan)
+    return calc_ma(close - ref(close, n), m)
+
+@kernel(NEW, IN, IN, IN, INT)
+def series_cci(close: np.ndarray, high: np.ndarray, low: np.ndarray, n: int) -> np.ndarray:
+    if len(close) <= n:
+        return np.full(len(close), np.nan)
+    typ = (high + low + close) / 3
+    ma_typ = calc_ma(typ, n)
+    avedev = rolling_avedev(typ, ma_typ, n, np.empty(len(typ)))
+    return (typ - ma_typ) / (0.015 * avedev)
+
+@kernel(NEW_PAIR, IN, IN, IN, INT)
+def series_dmi(close: np.ndarray, high: np.ndarray, low: np.ndarray, n: int):
+    """ 返回 (PDI, MDI) """
+    if len(close) <= n:
+        return np.full(len(close), np.nan), np.full(len(close), np.nan)
+    mtr = calc_mtr(high, low, close, n)
+    hd = np.nan_to_num(high - ref(high, 1))
+    ld = np.nan_to_num(ref(low, 1) - low)
+    dmp = rolling_sum(np.where(np.logical_and(hd>0, hd>ld), hd, 0.0), n, np.empty(len(hd)))
+    dmm = rolling_sum(np.where(np.logical_and(ld>0, ld>hd), ld, 0.0), n, np.empty(len(ld)))
+    return dmp * 100 / mtr, dmm * 100 / mtr
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_ma(close: np.ndarray, mask: np.ndarray, n: int) -> np.ndarray:
+    result = np.full(close.shape, np.nan)
+    for r in numba.prange(close.shape[0]):
+        _scatter(result[r], mask[r], series_ma(_gather(close[r], mask[r]), n))
+    return result
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_ema(close: np.ndarray, mask: np.ndarray, n: int) -> np.ndarray:
+    result = np.full(close.shape, np.nan)
+    for r in numba.prange(close.shape[0]):
+        _scatter(result[r], mask[r], series_ema(_gather(close[r], mask[r]), n))
+    return result
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_macd_ema(ema_short: np.ndarray, ema_long: np.ndarray, mask: np.ndarray, mid: int) -> np.ndarray:
+    result = np.full(ema_short.shape, np.nan)
+    for r in numba.prange(ema_short.shape[0]):
+        _scatter(result[r], mask[r], series_macd_ema(_gather(ema_short[r], mask[r]), _gather(ema_long[r], mask[r]), mid))
+    return result
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_rsi(close: np.ndarray, mask: np.ndarray, n: int) -> np.ndarray:
+    result = np.full(close.shape, np.nan)
+    for r in numba.prange(close.shape[0]):
+        _scatter(result[r], mask[r], series_rsi(_gather(close[r], mask[r]), n))
+    return result
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_rsv(close: np.ndarray, high: np.ndarray, low: np.ndarray, mask: np.ndarray, n: int) -> np.ndarray:
+    result = np.full(close.shape, np.nan)
+    for r in numba.prange(close.shape[0]):
+        rsv = series_rsv(_gather(close[r], mask[r]), _gather(high[r], mask[r]), _gather(low[r], mask[r]), n)
+        _scatter(result[r], mask[r], rsv)
+    return result
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_kdj_rsv(rsv: np.ndarray, mask: np.ndarray, m: int) -> np.ndarray:
+    result = np.full(rsv.shape, np.nan)
+    for r in numba.prange(rsv.shape[0]):
+        _scatter(result[r], mask[r], series_kdj_rsv(_gather(rsv[r], mask[r]), m))
+    return result
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX_MASK, INT, INT, parallel=True)
+def panel_mtm(close: np.ndarray, mask: np.ndarray, n: int, m: int) -> np.ndarray:
+    result = np.full(close.shape, np.nan)
+    for r in numba.prange(close.shape[0]):
+        _scatter(result[r], mask[r], series_mtm(_gather(close[r], mask[r]), n, m))
+    return result
+
+@kernel(NEW_MATRIX, MATRIX, MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_cci(close: np.ndarray, high: np.ndarray, low: np.ndarray, mask: np.ndarray, n: int) -> np.ndarray:
+    result = np.full(close.shape, np.nan)
+    for r in numba.prange(close.shape[0]):
+        cci = series_cci(_gather(close[r], mask[r]), _gather(high[r], mask[r]), _gather(low[r], mask[r]), n)
+        _scatter(result[r], mask[r], cci)
+    return result
+
+@kernel(NEW_MATRIX_PAIR, MATRIX, MATRIX, MATRIX, MATRIX_MASK, INT, parallel=True)
+def panel_dmi(close: np.ndarray, high: np.ndarray, low: np.ndarray, mask: np.ndarray, n: int):
+    pdi = np.full(close.shape, np.nan)
+    mdi = np.full(close.shape, np.nan)
+    for r in numba.prange(close.shape[0]):
+        p, m = series_dmi(_gather(close[r], mask[r]), _gather(high[r], mask[r]), _gather(low[r], mask[r]), n)
+        _scatter(pdi[r], mask[r], p)
+        _scatter(mdi[r], mask[r], m)
+    return pdi, mdi
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    滑动窗口计算核心 一次遍历O(n)完成LLV/HHV/SUM/MA 结果写入预先分配好的float64数组out
+    数据不足的前几天的处理方式与原先的实现保持一致
+
+    所有核心都有参数start: 只计算out[start:], out[:start]视为已经算好的结果不会改动
+    传入的array需包含start之前至少n天的数据, 这样追加新K线后只需计算新增部分, 结果与整条重算完全相同
+    rolling_sum与rolling_mean还有参数base: array[0]在整条序列中的下标, 传入的是切片时用来在与整条计算相同的日期上重新求和
+"""
+
+import numpy as np
+
+from indexes.signature import IN, INT, OUT, kernel
+
+
+@kernel(OUT, IN, INT, OUT, INT)
+def rolling_min(array: np.ndarray, n: int, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """
+        n日内的最低值(LLV) 单调队列实现 初始数据不够n天时取已有数据的最低值
+        与原先min(array[i-n+1:i+1])的行为一致: 窗口第一个值是NaN时结果为NaN, 否则忽略窗口内的NaN
+    """
+    length = len(array)
+    queue = np.empty(n, np.int64)  # 环形缓冲区 保存窗口内的下标 对应的值单调递增
+    head = 0
+    size = 0
+    for i in range(max(0, start - n + 1), length):  # 从start前n-1天开始 先把窗口填满
+        window_start = i - n + 1 if i >= n else 0
+        if size > 0 and queue[head] < window_start:  # 队首已滑出窗口
+            head = (head + 1) % n
+            size -= 1
+        value = array[i]
+        if not np.isnan(value):
+            while size > 0 and value < array[queue[(head + size - 1) % n]]:  # 队尾比新值大的都不可能再成为最低值
+                size -= 1
+            queue[(head + size) % n] = i
+            size += 1
+        if i < start:
+            continue
+        if np.isnan(array[window_start]):
+            out[i] = array[window_start]
+        else:
+            out[i] = array[queue[head]]
+    return out
+
+
+@kernel(OUT, IN, INT, OUT, INT)
+def rolling_max(array: np.ndarray, n: int, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """ n日内的最高值(HHV) 与rolling_min对称 """
+    length = len(array)
+    queue = np.empty(n, np.int64)  # 环形缓冲区 保存窗口内的下标 对应的值单调递减
+    head = 0
+    size = 0
+    for i in range(max(0, start - n + 1), length):
+        window_start = i - n + 1 if i >= n else 0
+        if size > 0 and queue[head] < window_start:
+            head = (head + 1) % n
+            size -= 1
+        value = array[i]
+        if not np.isnan(value):
+            while size > 0 and value > array[queue[(head + size - 1) % n]]:
+                size -= 1
+            queue[(head + size) % n] = i
+            size += 1
+        if i < start:
+            continue
+        if np.isnan(array[window_start]):
+            out[i] = array[window_start]
+        else:
+            out[i] = array[queue[head]]
+    return out
+
+
+@kernel(OUT, IN, INT, OUT, INT, INT)
+def rolling_sum(array: np.ndarray, n: int, out: np.ndarray, start: int = 0, base: int = 0) -> np.ndarray:
+    """
+        最近n日的求和 前(n-1)个无数据填NaN
+        用前一日的和加上新值减去滑出的值来递推; 整条序列的下标为n的倍数减1或前一日为NaN/inf时对整个窗口直接求和, 避免浮点误差累积
+        每个值只取决于前一日的结果、原数据和下标, 因此从任意位置接着往后算得到的结果都相同
+    """
+    length = len(array)
+    for i in range(start, min(n - 1, length)):
+        out[i] = np.nan
+    for i in range(max(start, n - 1), length):
+        if i == 0 or (base + i) % n == n - 1 or not np.isfinite(out[i-1]):
+            _sum = 0.0
+            for j in range(i - n + 1, i + 1):
+                _sum += array[j]
+            out[i] = _sum
+        else:
+            out[i] = out[i-1] + array[i] - array[i-n]
+    return out
+
+
+@kernel(OUT, IN, INT, OUT, INT, INT)
+def rolling_mean(array: np.ndarray, n: int, out: np.ndarray, start: int = 0, base: int = 0) -> np.ndarray:
+    """
+        最近n日的平均(MA) 前(n-1)个无数据填NaN 递推方式同rolling_sum
+        与原先np.convolve的结果只差最后几位: 误差不超过2·n·eps·(窗口内最大的|x|)
+    """
+    length = len(array)
+    for i in range(start, min(n - 1, length)):
+        out[i] = np.nan
+    for i in range(max(start, n - 1), length):
+        if i == 0 or (base + i) % n == n - 1 or not np.isfinite(out[i-1]):
+            _sum = 0.0
+            for j in range(i - n + 1, i + 1):
+                _sum += array[j]
+            out[i] = _sum / n
+        else:
+            out[i] = out[i-1] + (array[i] - array[i-n]) / n
+    return out
+
+
+@kernel(OUT, IN, IN, INT, OUT, INT)
+def rolling_avedev(array: np.ndarray, mean: np.ndarray, n: int, out: np.ndarray, start: int = 0) -> np.ndarray:
+    """
+        平均绝对误差 mean为array的n日均线 前(n-1)个无数据填NaN
+        偏差是相对于每天都在变化的均值计算的, 不存在O(1)的精确递推, 所以逐窗口累加;
+        由调用方传入均线以便与指标本身共用同一条MA, 不再重复计算
+    """
+    length = len(array)
+    for i in range(start, min(n - 1, length)):
+        out[i] = np.nan
+    for i in range(max(start, n - 1), length):
+        m = mean[i]
+        _sum = 0.0
+        for j in range(n):
+            _sum += abs(array[i-j] - m)
+        out[i] = _sum / n
+    return out
@@ -1,11 +1,14 @@
 #!/usr/bin/python3
 # -*- encoding: utf-8 -*-
 
+from typing import Sequence
+
 import numpy as np
 from dto_enum import OHLCV
 from global_data import global_data_instance
 
-from indexes.base import Index, ref
+from indexes.base import Index, buffer_pool_instance, calc_sma_into
+from indexes.graph import graph_instance
 
 
 class RSI(Index):
@@ -18,25 +21,65 @@ class RSI(Index):
     def get_rsi(self, symbol: str, date: str, n: int):
         """ 计算所有日期的 RSI(n) 序列, 返回给定日期的 RSI(n) """
 
-        key = f'rsi-{n}'
-        if self.computed_memo.contains(symbol, key):
-            if len(self.computed_memo.get(symbol, key)) == len(global_data_instance.symbol_to_date_list[symbol]):  # 并且array长度相等(数据存在且正确)
-                if date in global_data_instance.symbol_to_date_set[symbol]:
-                    offset = global_data_instance.find_date_offset(symbol, date)
-                    return self.computed_memo.get(symbol, key)[offset]
-                else:
-                    return np.nan
+        key = ('rsi', n)
+        cached = self.computed_memo.lookup(symbol, key)
+        if cached is not None and len(cached) == len(global_data_instance.symbol_to_date_list[symbol]):  # 已有计算 并且array长度相等(数据存在且正确)
+            if date in global_data_instance.symbol_to_date_set[symbol]:
+                offset = global_data_instance.find_date_offset(symbol, date)
+                return cached[offset]
+            else:
+                return np.nan
+
+        rsi = self._rsi_series(symbol, n)
+
+        offset = global_data_instance.find_date_offset(symbol, date)
+        return rsi[offset]
+
+    def get_rsi_range(self, symbol: str, start: str, end: str, n: int) -> np.ndarray:
+        """ 返回日期在 [start, end] 之间的 RSI(n) 序列, 是缓存序列的只读视图(不复制) """
+        return self.slice_dates(symbol, self._rsi_series(symbol, n), start, end)
+
+    def get_rsi_batch(self, symbol: str, dates: Sequence[str], n: int) -> np.ndarray:
+        """ 返回多个日期的 RSI(n), 数据中不存在的日期为NaN """
+        return self.take_dates(symbol, self._rsi_series(symbol, n), dates)
 
+    def _rsi_series(self, symbol: str, n: int) -> np.ndarray:
+        """ 计算所有日期的 RSI(n) 序列 有缓存时只计算新增的K线 """
         close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+        length = len(close_array)
 
-        # LC:=REF(CLOSE,1);
-        lc = ref(close_array, 1)
+        # LC:=REF(CLOSE,1);  CLOSE-LC 各周期的RSI共用
+        change = graph_instance.series(symbol, ('delta', OHLCV.CLOSE, 1))
+
+        # 两个SMA是递推的 缓存下来以便追加K线后接着往后算  MAX(CLOSE-LC,0)与ABS(CLOSE-LC)写入临时缓冲区
+        def compute_sma_up(out: np.ndarray, start: int):
+            begin = max(0, start - 1)
+            with buffer_pool_instance.borrow(length - begin) as (up,):
+                np.maximum(change[begin:], 0, out=up)
+                calc_sma_into(up, n, 1, out[begin:], start - begin)
+        sma_up = self.extend_series(symbol, ('rsi-up', n), length, compute_sma_up)
+
+        def compute_sma_abs(out: np.ndarray, start: int):
+            begin = max(0, start - 1)
+            with buffer_pool_instance.borrow(length - begin) as (absolute,):
+                np.abs(change[begin:], out=absolute)
+                calc_sma_into(absolute, n, 1, out[begin:], start - begin)
+        sma_abs = self.extend_series(symbol, ('rsi-abs', n), length, compute_sma_abs)
 
         # RSI:SMA(MAX(CLOSE-LC,0),N1,1)/SMA(ABS(CLOSE-LC),N1,1)*100;
-        rsi = self.sma(np.maximum(close_array-lc, 0), n, 1) / (self.sma(np.abs(close_array-lc), n, 1) + 1e-6) * 100  # 避免0÷0
-        self.computed_memo.set(symbol, key, rsi)  # 计算出来后填入缓存
+        def compute_rsi(out: np.ndarray, start: int):
+            rsi = out[start:]
+            np.add(sma_abs[start:], 1e-6, out=rsi)  # 避免0÷0
+            np.divide(sma_up[start:], rsi, out=rsi)
+            np.multiply(rsi, 100, out=rsi)
+        rsi = self.extend_series(symbol, ('rsi', n), length, compute_rsi)
 
-        offset = global_data_instance.find_date_offset(symbol, date)
-        return rsi[offset]
+        return rsi
+
+    def get_rsi_grid(self, symbol: str, periods) -> np.ndarray:
+        """ 一次算出多个周期的 RSI(n) 序列, 返回 (len(periods) × 日期数) 的数组, 第i行对应periods[i] """
+        from indexes.grid import calc_rsi_grid  # 并行核心编译较慢, 第一次用到时才import
+        close_array = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+        return calc_rsi_grid(close_array, np.asarray(periods, dtype=np.int64))
 
 rsi_instance = RSI()
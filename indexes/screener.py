@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    选股: 用一个布尔表达式对所有股票一次筛选, 不再逐只股票调用get_xxx
+        screener_instance.screen('kdj(9,3) < 0 and rsi(6) < 20 and close > ma(20)', '2021-08-02')
+    表达式中可以使用:
+        K线  open high low close volume
+        指标 ma(n) macd(short,long,mid) rsi(n) kdj(n,m) mtm(n,m) cci(n) pdi(n) mdi(n), 参数为整数, 含义同get_xxx
+        数字, + - * /, 比较 < <= > >= == !=, and or not 与括号
+    用到的指标在Panel上对所有股票一次算出(每个指标一个并行的numba核心), 表达式按 (symbol × date) 的矩阵整体求值
+    没有K线或指标为NaN的股票不满足任何比较
+"""
+
+import ast
+import inspect
+import operator
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from global_data import global_data_instance
+
+from indexes.panel import Panel
+
+# 表达式中的名称: f(panel, *参数) 返回 (symbol × date) 矩阵
+TERMS: Dict[str, Callable] = {
+    'open': lambda panel: panel.open,
+    'high': lambda panel: panel.high,
+    'low': lambda panel: panel.low,
+    'close': lambda panel: panel.close,
+    'volume': lambda panel: panel.volume,
+    'ma': lambda panel, n: panel.ma(n),
+    'macd': lambda panel, short, long, mid: panel.macd(short, long, mid),
+    'rsi': lambda panel, n: panel.rsi(n),
+    'kdj': lambda panel, n, m: panel.kdj(n, m),
+    'mtm': lambda panel, n, m: panel.mtm(n, m),
+    'cci': lambda panel, n: panel.cci(n),
+    'pdi': lambda panel, n: panel.dmi(n)[0],
+    'mdi': lambda panel, n: panel.dmi(n)[1],
+}
+
+_BIN_OPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+_COMPARE_OPS = {ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+                ast.Eq: operator.eq, ast.NotEq: operator.ne}
+
+
+class Expression():
+    """ 解析后的选股表达式 terms为其中用到的K线与指标 {名称如'kdj(9,3)': (TERMS中的名称, 参数)}, 按出现的顺序 """
+
+    def __init__(self, text: str):
+        self.text = text
+        try:
+            self._tree = ast.parse(text.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise ValueError(f'Invalid expression: {text}') from e
+        self.terms: Dict[str, Tuple[str, Tuple[int, ...]]] = {}
+        self._check(self._tree)
+        if not self.terms:
+            raise ValueError(f'No price or indicator in expression: {text}')
+
+    @staticmethod
+    def term_name(node: ast.AST) -> str:
+        if isinstance(node, ast.Name):
+            return node.id
+        return f'{node.func.id}({",".join(str(arg.value) for arg in node.args)})'
+
+    def _check(self, node: ast.AST):
+        """ 只允许上面列出的语法 记录用到的K线与指标 """
+        if isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self._check(value)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+            self._check(node.operand)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.Compare) and all(type(op) in _COMPARE_OPS for op in node.ops):
+            for value in [node.left, *node.comparators]:
+                self._check(value)
+        elif isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            pass
+        elif isinstance(node, ast.Name) and node.id in TERMS:
+            self._add_term(node, node.id, ())
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in TERMS and not node.keywords \
+                and all(isinstance(arg, ast.Constant) and type(arg.value) is int for arg in node.args):
+            self._add_term(node, node.func.id, tuple(arg.value for arg in node.args))
+        else:
+            raise ValueError(f'Unsupported in expression: {ast.unparse(node)}')
+
+    def _add_term(self, node: ast.AST, name: str, params: Tuple[int, ...]):
+        try:
+            inspect.signature(TERMS[name]).bind(None, *params)
+        except TypeError:
+            raise ValueError(f'Wrong number of parameters: {ast.unparse(node)}') from None
+        self.terms[self.term_name(node)] = (name, params)
+
+    def evaluate(self, values: Dict[str, np.ndarray]) -> np.ndarray:
+        """ values为各term的数组(形状相同) 返回同样形状的bool数组 """
+        with np.errstate(all='ignore'):  # NaN与除以0
+            return np.asarray(self._evaluate(self._tree, values), dtype=np.bool_)
+
+    def _evaluate(self, node: ast.AST, values: Dict[str, np.ndarray]):
+        if isinstance(node, ast.BoolOp):
+            reduce = np.logical_and.reduce if isinstance(node.op, ast.And) else np.logical_or.reduce
+            return reduce([self._evaluate(value, values) for value in node.values])
+        if isinstance(node, ast.UnaryOp):
+            operand = self._evaluate(node.operand, values)
+            return np.logical_not(operand) if isinstance(node.op, ast.Not) else -operand
+        if isinstance(node, ast.BinOp):
+            return _BIN_OPS[type(node.op)](self._evaluate(node.left, values), self._evaluate(node.right, values))
+        if isinstance(node, ast.Compare):  # a < b < c 即 a < b and b < c
+            operands = [self._evaluate(value, values) for value in [node.left, *node.comparators]]
+            return np.logical_and.reduce([_COMPARE_OPS[type(op)](left, right)
+                                          for op, left, right in zip(node.ops, operands, operands[1:])])
+        if isinstance(node, ast.Constant):
+            return node.value
+        return values[self.term_name(node)]
+
+
+class Screener():
+    """ 在Panel上对表达式求值 Panel及其算出的指标矩阵在数据没有变化时保留, 多次选股不重复计算 """
+
+    def __init__(self):
+        self._panel: Optional[Panel] = None
+        self._panel_key: Optional[Tuple] = None
+
+    def panel(self, symbols: Optional[Sequence[str]] = None) -> Panel:
+        """ symbols默认为本地已有数据的全部symbol """
+        symbols = tuple(dict.fromkeys(symbols if symbols is not None else global_data_instance.loaded_symbols()))
+        key = (symbols, tuple(global_data_instance.data_version(symbol) for symbol in symbols))
+        if self._panel is None or self._panel_key != key:
+            self._panel = Panel(list(symbols))
+            self._panel_key = (symbols, tuple(global_data_instance.data_version(symbol) for symbol in symbols))  # 可能刚下载
+        return self._panel
+
+    def _compute(self, panel: Panel, expression: Expression) -> Dict[str, np.ndarray]:
+        return {term: TERMS[name](panel, *params) for term, (name, params) in expression.terms.items()}
+
+    def signals(self, expression: str, symbols: Optional[Sequence[str]] = None, panel: Optional[Panel] = None) -> np.ndarray:
+        """ 所有日期上expression是否满足 返回 (symbol × date) 的bool矩阵, 与panel对齐 panel默认为panel(symbols) """
+        parsed = Expression(expression)
+        return parsed.evaluate(self._compute(panel if panel is not None else self.panel(symbols), parsed))
+
+    def screen(self, expression: str, date: str, symbols: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+            返回在date满足expression的股票 以symbol为行, 表达式中的K线与指标为列, 值为当天的值
+            date必须是某只股票的交易日
+        """
+        parsed = Expression(expression)
+        panel = self.panel(symbols)
+        offset = panel.date_offset(date)
+        values = {term: matrix[:, offset] for term, matrix in self._compute(panel, parsed).items()}
+        rows = np.flatnonzero(parsed.evaluate(values))
+        return pd.DataFrame({term: array[rows] for term, array in values.items()},
+                            index=pd.Index([panel.symbols[row] for row in rows], name='symbol'))
+
+    def screen_range(self, expression: str, start: str, end: str, symbols: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """ 返回日期在 [start, end] 之间每天满足expression的股票 以 (date, symbol) 为行, 按日期排列 """
+        parsed = Expression(expression)
+        panel = self.panel(symbols)
+        values = {term: panel.between(matrix, start, end) for term, matrix in self._compute(panel, parsed).items()}
+        dates = panel.between(panel.dates[np.newaxis, :], start, end)[0]
+        matched = parsed.evaluate(values)
+        columns, rows = np.nonzero(matched.T)  # 先按日期再按symbol排列
+        index = pd.MultiIndex.from_arrays([dates[columns], np.array(panel.symbols, dtype=object)[rows]], names=['date', 'symbol'])
+        return pd.DataFrame({term: array[rows, columns] for term, array in values.items()}, index=index)
+
+
+screener_instance = Screener()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    numba核心的显式签名 带签名的函数在import时就编译好(有缓存时直接载入), 第一次调用不再等待编译
+    签名之外的参数类型不会再编译新的版本, 调用时抛出TypeError:
+        IN  只读取的连续float64数组, 可以是只读的(如从数据库映射的数据)
+        ANY 任意布局的float64数组, 用于对外的calc_*等函数, 函数内先用np.ascontiguousarray转为连续数组(本来连续时不复制)
+        OUT 写入结果的连续float64数组 由调用方传入
+        NEW 函数内新分配的float64数组  NEW_PAIR 两个这样的数组组成的tuple
+        OPT_OUT 可选的OUT 参数默认为None, 不传时函数内分配 (calc_*的out=)
+        INTS 只读取的连续int64数组(参数扫描的各组参数)  OUT_INTS 写入的连续int64数组  MASK 只读取的连续bool数组
+        MATRIX MATRIX_MASK 只读取的二维float64/bool数组(symbol × date)  NEW_MATRIX 函数内新分配的二维float64数组
+        OUT_MATRIX 写入结果的二维float64数组 由调用方传入
+    有默认值的参数另外生成省略该参数的版本, 调用时可以不传
+    编译结果写入numba的缓存目录, 可以用 python warmup.py --cache-dir DIR 预先生成(见warmup.py)
+"""
+
+import configparser
+import inspect
+import os
+import shutil
+import tempfile
+from typing import Callable, List
+
+import numba
+from numba import types
+
+IN = types.Array(types.float64, 1, 'C', readonly=True)
+ANY = types.Array(types.float64, 1, 'A', readonly=True)
+OUT = types.Array(types.float64, 1, 'C')
+NEW = OUT
+NEW_PAIR = types.UniTuple(NEW, 2)
+OPT_OUT = types.Optional(OUT)
+INT = types.int64
+BOOL = types.boolean
+FLOAT = types.float64
+NONE = types.none
+INTS = types.Array(types.int64, 1, 'C', readonly=True)
+OUT_INTS = types.Array(types.int64, 1, 'C')
+MASK = types.Array(types.boolean, 1, 'C', readonly=True)
+MATRIX = types.Array(types.float64, 2, 'C', readonly=True)
+MATRIX_MASK = types.Array(types.boolean, 2, 'C', readonly=True)
+NEW_MATRIX = types.Array(types.float64, 2, 'C')
+OUT_MATRIX = NEW_MATRIX
+NEW_MATRIX_PAIR = types.UniTuple(NEW_MATRIX, 2)
+
+
+def use_cache_dir():
+    """
+        使用环境变量NUMBA_CACHE_DIR或config.ini中numba_cache_dir指定的缓存目录, 都没有时numba把缓存写在各模块的__pycache__
+        numba只使用可写的缓存目录, 目录只读时(如只读的部署镜像)先复制到临时目录再使用
+        需在定义任何带cache=True的函数之前调用
+    """
+    conf = configparser.ConfigParser()
+    conf.read('config.ini')
+    path = os.environ.get('NUMBA_CACHE_DIR') or conf.get('Config', 'numba_cache_dir', fallback='')
+    if not path:
+        return
+    if os.path.isdir(path) and not os.access(path, os.W_OK):
+        copy = tempfile.mkdtemp(prefix='numba-cache-')
+        shutil.copytree(path, copy, dirs_exist_ok=True)
+        path = copy
+    numba.config.CACHE_DIR = path
+
+use_cache_dir()
+
+
+def signatures(func: Callable, ret, *args) -> List:
+    """ func的全部签名 args与func的参数一一对应 """
+    defaults = [p.default for p in inspect.signature(func).parameters.values() if p.default is not inspect.Parameter.empty]
+    result = []
+    for omitted in range(len(defaults) + 1):  # 依次省略最后的omitted个参数
+        tail = [types.Omitted(default) for default in defaults[len(defaults) - omitted:]]
+        result.append(ret(*args[:len(args) - omitted], *tail))
+    return result
+
+
+def kernel(ret, *args, **options):
+    """
+        @kernel(OUT, IN, INT, OUT, INT) 相当于带签名的 @numba.jit(nopython=True, cache=True)
+        options传给numba.jit, 如parallel=True
+    """
+    def decorate(func: Callable) -> Callable:
+        return numba.jit(signatures(func, ret, *args), nopython=True, cache=True, **options)(func)
+    return decorate
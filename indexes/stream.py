@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    流式指标: 每来一根K线调用一次update(bar), 以常数时间返回最新的指标值(CCI除外, 见StreamCCI)
+    递推方式与批量计算的核心完全相同, 所以逐根推送全部历史K线得到的值与get_xxx的结果一致
+"""
+
+import math
+from collections import deque
+from typing import Callable, Dict, Tuple
+
+from bar_source import Bar, BarSource
+
+
+class _RollingSum():
+    """ 最近n个值的和 前(n-1)个返回NaN 与indexes.rolling.rolling_sum的递推一致 """
+    __slots__ = ('n', 'window', 'value', 'count')
+
+    def __init__(self, n: int):
+        self.n = n
+        self.window = deque(maxlen=n)
+        self.value = math.nan
+        self.count = 0  # 已传入的值的个数
+
+    def update(self, x: float) -> float:
+        i = self.count
+        self.count += 1
+        leaving = self.window[0] if len(self.window) == self.n else math.nan
+        self.window.append(x)
+        if len(self.window) < self.n:
+            self.value = math.nan
+        elif i % self.n == self.n - 1 or not math.isfinite(self.value):  # 每n个值或前一个为NaN/inf时对整个窗口直接求和
+            _sum = 0.0
+            for v in self.window:
+                _sum += v
+            self.value = _sum
+        else:
+            self.value = self.value + x - leaving
+        return self.value
+
+
+class _RollingMean(_RollingSum):
+    """ 最近n个值的平均 与indexes.rolling.rolling_mean的递推一致 """
+    __slots__ = ()
+
+    def update(self, x: float) -> float:
+        i = self.count
+        self.count += 1
+        leaving = self.window[0] if len(self.window) == self.n else math.nan
+        self.window.append(x)
+        if len(self.window) < self.n:
+            self.value = math.nan
+        elif i % self.n == self.n - 1 or not math.isfinite(self.value):
+            _sum = 0.0
+            for v in self.window:
+                _sum += v
+            self.value = _sum / self.n
+        else:
+            self.value = self.value + (x - leaving) / self.n
+        return self.value
+
+
+class _Recursive():
+    """ SMA(X,N,M)的递推 EMA(X,N)即SMA(X,N+1,2) 初始值为第一个值(NaN时取0) """
+    __slots__ = ('n', 'm', 'value')
+
+    def __init__(self, n: int, m: int):
+        self.n = n
+        self.m = m
+        self.value = None
+
+    def update(self, x: float) -> float:
+        if self.value is None:
+            self.value = 0.0 if math.isnan(x) else x
+        else:
+            self.value = self.value * (self.n - self.m) / self.n + x * self.m / self.n
+        return self.value
+
+
+class _Ema(_Recursive):
+    """ EMA(X,N) 与calc_ema的写法保持一致 保证浮点结果完全相同 """
+    __slots__ = ()
+
+    def __init__(self, days: int):
+        super().__init__(days, 2)
+
+    def update(self, x: float) -> float:
+        if self.value is None:
+            self.value = 0.0 if math.isnan(x) else x
+        else:
+            days = self.n
+            self.value = self.value * (days-1) / (days+1) + x * 2 / (days+1)
+        return self.value
+
+
+class _Extreme():
+    """ n日内的最低值/最高值(LLV/HHV) 单调队列 行为与indexes.rolling.rolling_min/rolling_max一致 """
+    __slots__ = ('n', 'lowest', 'count', 'queue', 'window')
+
+    def __init__(self, n: int, lowest: bool):
+        self.n = n
+        self.lowest = lowest
+        self.count = 0
+        self.queue = deque()  # (下标, 值) 值单调
+        self.window = deque(maxlen=n)  # 窗口内的原始值 用于判断窗口第一个值是否为NaN
+
+    def update(self, x: float) -> float:
+        i = self.count
+        self.count += 1
+        self.window.append(x)
+        if self.queue and self.queue[0][0] <= i - self.n:  # 队首已滑出窗口
+            self.queue.popleft()
+        if not math.isnan(x):
+            if self.lowest:
+                while self.queue and x < self.queue[-1][1]:
+                    self.queue.pop()
+            else:
+                while self.queue and x > self.queue[-1][1]:
+                    self.queue.pop()
+            self.queue.append((i, x))
+        first = self.window[0]
+        return first if math.isnan(first) else self.queue[0][1]
+
+
+class StreamIndex():
+    """ 流式指标基类 """
+
+    def update(self, bar: Bar):
+        """ 传入最新的一根K线, 返回该K线对应的指标值 """
+        raise NotImplementedError
+
+
+class StreamMA(StreamIndex):
+    """ 简单移动平均线 """
+
+    def __init__(self, n: int):
+        self._ma = _RollingMean(n)
+
+    def update(self, bar: Bar) -> float:
+        return self._ma.update(bar.close)
+
+
+class StreamMACD(StreamIndex):
+    """ DIF:EMA(CLOSE,SHORT)-EMA(CLOSE,LONG);  DEA:EMA(DIF,MID);  MACD:(DIF-DEA)*2; """
+
+    def __init__(self, short: int, long: int, mid: int):
+        self._short = _Ema(short)
+        self._long = _Ema(long)
+        self._dea = _Ema(mid)
+
+    def update(self, bar: Bar) -> float:
+        dif = self._short.update(bar.close) - self._long.update(bar.close)
+        dea = self._dea.update(dif)
+        return (dif - dea) * 2
+
+
+class StreamRSI(StreamIndex):
+    """ LC:=REF(CLOSE,1);  RSI:SMA(MAX(CLOSE-LC,0),N1,1)/SMA(ABS(CLOSE-LC),N1,1)*100; """
+
+    def __init__(self, n: int):
+        self._up = _Recursive(n, 1)
+        self._abs = _Recursive(n, 1)
+        self._last_close = math.nan
+
+    def update(self, bar: Bar) -> float:
+        change = bar.close - self._last_close
+        self._last_close = bar.close
+        up = change if (change > 0 or math.isnan(change)) else 0.0  # 与np.maximum(CLOSE-LC,0)一致 NaN保持NaN
+        return self._up.update(up) / (self._abs.update(abs(change)) + 1e-6) * 100  # 避免0÷0
+
+
+class StreamKDJ(StreamIndex):
+    """ RSV:=(CLOSE-LLV(LOW,N))/(HHV(HIGH,N)-LLV(LOW,N))*100;  K:SMA(RSV,M,1);  D:SMA(K,M,1);  返回J:3*K-2*D; """
+
+    def __init__(self, n: int, m: int):
+        assert n > 1, 'n应>=2'
+        self._llv = _Extreme(n, lowest=True)
+        self._hhv = _Extreme(n, lowest=False)
+        self._k = _Recursive(m, 1)
+        self._d = _Recursive(m, 1)
+
+    def update(self, bar: Bar) -> float:
+        llv = self._llv.update(bar.low)
+        hhv = self._hhv.update(bar.high)
+        rsv = (bar.close - llv) / (hhv - llv + 0.00000001) * 100  # 避免除以0
+        if self._k.value is None and math.isnan(rsv):  # 若第一天停牌 则hhv-llv等于0 相除之后会变成nan
+            rsv = 0
+        k = self._k.update(rsv)
+        d = self._d.update(k)
+        return 3 * k - 2 * d
+
+
+class StreamMTM(StreamIndex):
+    """ DELTA:CLOSE-REF(CLOSE,N);  MTMMA:MA(DELTA,M); """
+
+    def __init__(self, n: int, m: int):
+        self._closes = deque(maxlen=n)
+        self._mtmma = _RollingMean(m)
+
+    def update(self, bar: Bar) -> float:
+        previous = self._closes[0] if len(self._closes) == self._closes.maxlen else math.nan  # N日前的收盘价
+        self._closes.append(bar.close)
+        return self._mtmma.update(bar.close - previous)
+
+
+class StreamCCI(StreamIndex):
+    """
+        TYP:=(HIGH+LOW+CLOSE)/3;  CCI:(TYP-MA(TYP,N))/(0.015*AVEDEV(TYP,N));
+        每根K线O(n): AVEDEV是相对于每天都在变化的均值计算的, 没有O(1)的精确递推(同rolling_avedev), 所以对窗口重新累加
+    """
+
+    def __init__(self, n: int):
+        self._ma = _RollingMean(n)
+
+    def update(self, bar: Bar) -> float:
+        typ = (bar.high + bar.low + bar.close) / 3
+        mean = self._ma.update(typ)
+        window = self._ma.window
+        if len(window) < self._ma.n:
+            return math.nan
+        _sum = 0.0
+        for i in range(len(window) - 1, -1, -1):  # 与rolling_avedev相同的累加顺序(从最新的往前)
+            _sum += abs(window[i] - mean)
+        if _sum == 0:  # 窗口内的价格都相同(停牌、一字板) 与get_cci的0/0一样返回NaN
+            return math.nan
+        return (typ - mean) / (0.015 * (_sum / self._ma.n))
+
+
+class StreamDMI(StreamIndex):
+    """
+        MTR:=SUM(MAX(MAX(HIGH-LOW,ABS(HIGH-REF(CLOSE,1))),ABS(REF(CLOSE,1)-LOW)),N);
+        HD:=HIGH-REF(HIGH,1);  LD:=REF(LOW,1)-LOW;
+        DMP:=SUM(IF(HD>0&&HD>LD,HD,0),N);  DMM:=SUM(IF(LD>0&&LD>HD,LD,0),N);
+        返回 (PDI:DMP*100/MTR, MDI:DMM*100/MTR)
+    """
+
+    def __init__(self, n: int):
+        self._mtr = _RollingSum(n)
+        self._dmp = _RollingSum(n)
+        self._dmm = _RollingSum(n)
+        self._last = None  # 上一根K线
+
+    def update(self, bar: Bar) -> Tuple[float, float]:
+        last = self._last
+        self._last = bar
+        if last is None:  # 第一根K线没有REF 与np.nan_to_num/np.maximum的处理一致
+            tr, hd, ld = math.nan, 0.0, 0.0
+        else:
+            tr = max(abs(last.close - bar.low), max(bar.high - bar.low, abs(bar.high - last.close)))
+            hd = bar.high - last.high
+            ld = last.low - bar.low
+        mtr = self._mtr.update(tr)
+        dmp = self._dmp.update(hd if (hd > 0 and hd > ld) else 0.0)
+        dmm = self._dmm.update(ld if (ld > 0 and ld > hd) else 0.0)
+        if mtr == 0:  # n天价格都不变 DMP、DMM也为0, 与get_dmi的0/0一样返回NaN
+            return (math.nan, math.nan)
+        return (dmp * 100 / mtr, dmm * 100 / mtr)
+
+
+class Streamer():
+    """
+        把BarSource推送的K线分发给每只股票各自的一组流式指标
+        factories: {名称: 无参数的构造函数}, 例如 {'ma5': lambda: StreamMA(5)}; 每只股票第一次出现时创建一组新的指标
+        on_update: 每根K线算完后以 (bar, {名称: 指标值}) 调用
+    """
+
+    def __init__(self, factories: Dict[str, Callable[[], StreamIndex]], on_update: Callable[[Bar, Dict], None] = None):
+        self.factories = factories
+        self.on_update = on_update
+        self.latest: Dict[str, Dict] = {}  # {symbol: {名称: 最新的指标值}}
+        self._indexes: Dict[str, Dict[str, StreamIndex]] = {}
+
+    def on_bar(self, bar: Bar):
+        indexes = self._indexes.get(bar.symbol)
+        if indexes is None:
+            indexes = self._indexes[bar.symbol] = {name: factory() for name, factory in self.factories.items()}
+        values = {name: index.update(bar) for name, index in indexes.items()}
+        self.latest[bar.symbol] = values
+        if self.on_update is not None:
+            self.on_update(bar, values)
+
+    def run(self, source: BarSource):
+        """ 从source接收K线直到其结束 可先用ReplaySource回放历史预热, 再接实时推送 """
+        source.run(self.on_bar)
@@ -1,18 +1,248 @@
-from typing import Dict
+import configparser
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
 
 import numpy as np
 
 
+def array_nbytes(array: np.ndarray) -> int:
+    """ 数组实际占用的内存 若是某个缓冲区的视图则按整个缓冲区计算 """
+    base = array.base
+    if isinstance(base, np.ndarray):
+        return base.nbytes
+    return array.nbytes
+
+
+class MemoryBudget:
+    """
+        多个Memo共享的内存预算 按最近最少使用(LRU)的顺序淘汰, 使所有Memo保存的数组总大小不超过max_bytes
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.resident_bytes = 0
+        self._lru: 'OrderedDict[Tuple[Memo, Tuple], int]' = OrderedDict()  # {(memo, key): 字节数} 最近使用的在最后
+        self._lock = threading.RLock()
+
+    def touch(self, memo: 'Memo', key: Tuple):
+        with self._lock:
+            if (memo, key) in self._lru:
+                self._lru.move_to_end((memo, key))
+
+    def add(self, memo: 'Memo', key: Tuple, nbytes: int):
+        """ 记录新存入的数组 超出预算时从最久未使用的开始淘汰(刚存入的这个除外) """
+        with self._lock:
+            self.remove(memo, key)
+            self._lru[(memo, key)] = nbytes
+            self.resident_bytes += nbytes
+            while self.resident_bytes > self.max_bytes and len(self._lru) > 1:
+                (victim_memo, victim_key), _ = next(iter(self._lru.items()))
+                victim_memo._evict(victim_key)
+
+    def remove(self, memo: 'Memo', key: Tuple):
+        with self._lock:
+            nbytes = self._lru.pop((memo, key), None)
+            if nbytes is not None:
+                self.resident_bytes -= nbytes
+
+
+def _default_max_bytes() -> int:
+    """ 读取config.ini中的memo_max_mb 默认2048MB """
+    conf = configparser.ConfigParser()
+    conf.read('config.ini')
+    return int(conf.getfloat('Config', 'memo_max_mb', fallback=2048) * 1024 * 1024)
+
+default_budget = MemoryBudget(_default_max_bytes())
+_all_memos = weakref.WeakSet()
+
+
+class MemoStore:
+    """
+        把Memo中的数组保存到文件 重启后可以直接载入
+        每个数组记录保存时的长度L和数据指纹fingerprint(symbol, L), 即前L根K线(日期与OHLCV)的哈希
+        载入时指纹不一致(数据被复权等改变)则视为不存在; 之后追加的K线不影响前L根的指纹, 载入后只需计算新增部分
+        目录结构: <root>/<symbol>/index.json  {文件名: {'key': repr(key), 'length': L, 'fingerprint': 指纹}}
+                  <root>/<symbol>/<Memo名称>-<key的哈希>.npy
+    """
+
+    def __init__(self, root: str, fingerprint: Callable[[str, int], Optional[str]]):
+        self.root = root
+        self._fingerprint = fingerprint  # fingerprint(symbol, L) 数据不足L根时返回None
+        self._indexes: Dict[str, dict] = {}  # 已读入的各symbol的index.json
+        self._lock = threading.RLock()
+
+    def load(self, symbol: str, name: str, key: Tuple) -> Optional[np.ndarray]:
+        """ 返回保存的数组 不存在或已失效时返回None """
+        file_name = self._file_name(name, key)
+        with self._lock:
+            entry = self._index(symbol).get(file_name)
+        if entry is None or self._fingerprint(symbol, entry['length']) != entry['fingerprint']:
+            return None
+        try:
+            return np.load(os.path.join(self.root, symbol, file_name))
+        except (OSError, ValueError):
+            return None
+
+    def save(self, symbol: str, name: str, key: Tuple, array: np.ndarray):
+        fingerprint = self._fingerprint(symbol, len(array))
+        if fingerprint is None:
+            return
+        file_name = self._file_name(name, key)
+        directory = os.path.join(self.root, symbol)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._replace(os.path.join(directory, file_name), lambda f: np.save(f, array))
+            index = self._index(symbol)
+            index[file_name] = {'key': repr(key), 'length': len(array), 'fingerprint': fingerprint}
+            self._replace(os.path.join(directory, 'index.json'), lambda f: f.write(json.dumps(index, indent=1).encode('utf-8')))
+
+    def _index(self, symbol: str) -> dict:
+        index = self._indexes.get(symbol)
+        if index is None:
+            path = os.path.join(self.root, symbol, 'index.json')
+            index = {}
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            self._indexes[symbol] = index
+        return index
+
+    @staticmethod
+    def _file_name(name: str, key: Tuple) -> str:
+        return f'{name}-{hashlib.sha1(repr(key).encode()).hexdigest()[:16]}.npy'
+
+    @staticmethod
+    def _replace(path: str, write: Callable):
+        """ 先写临时文件再替换 避免写到一半时中断导致文件损坏 """
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+
+
 class Memo:
-    def __init__(self):
-        self._data: Dict[str, np.ndarray] = {}  # key由symbol-column拼装而成，如 {'000001-ma5': np.array([...])}
+    """
+        缓存计算得出的数组 key为元组 (symbol, 名称, 参数...), 如 ('000001', 'ma', 5)
+        所有Memo默认共享同一个内存预算 超出时按LRU淘汰
+        指定store时, 内存中没有的key会尝试从文件载入, save()把新算出的数组写入文件
+    """
+
+    def __init__(self, name: str = '', budget: MemoryBudget = None, store: Optional[MemoStore] = None):
+        self.name = name  # 用于统计 一般是所属指标的类名
+        self.budget = budget if budget is not None else default_budget
+        self.store = store
+        self._data: Dict[Tuple, np.ndarray] = {}
+        self._lock = threading.RLock()
+        self._unsaved: Set[Tuple] = set()  # 新算出 尚未保存到store的key
+        self._probed: Set[Tuple] = set()  # 已尝试过从store载入的key
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.resident_bytes = 0
+        _all_memos.add(self)
+
+    def contains(self, symbol: str, key: Tuple[Hashable, ...]) -> bool:
+        return (symbol, *key) in self._data
+
+    def get(self, symbol: str, key: Tuple[Hashable, ...]) -> np.ndarray:
+        """ 若不存在将抛出异常, 应先调用contains()判断; 或使用lookup() """
+        array = self._data[(symbol, *key)]
+        self.hits += 1
+        self.budget.touch(self, (symbol, *key))
+        return array
+
+    def lookup(self, symbol: str, key: Tuple[Hashable, ...]) -> Optional[np.ndarray]:
+        """ 返回缓存的数组 不存在则返回None """
+        full_key = (symbol, *key)
+        array = self._data.get(full_key)
+        if array is None and self.store is not None and full_key not in self._probed:
+            array = self._load(symbol, key)
+        if array is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.budget.touch(self, full_key)
+        return array
+
+    def _load(self, symbol: str, key: Tuple) -> Optional[np.ndarray]:
+        full_key = (symbol, *key)
+        self._probed.add(full_key)
+        array = self.store.load(symbol, self.name, key)
+        if array is not None:
+            self._put(full_key, array)
+            self.loads += 1
+        return array
+
+    def set(self, symbol: str, key: Tuple[Hashable, ...], array: np.ndarray):
+        full_key = (symbol, *key)
+        self._put(full_key, array)
+        if self.store is not None:
+            self._unsaved.add(full_key)
+
+    def _put(self, full_key: Tuple, array: np.ndarray):
+        nbytes = array_nbytes(array)
+        with self._lock:
+            old = self._data.get(full_key)
+            if old is not None:
+                self.resident_bytes -= array_nbytes(old)
+            self._data[full_key] = array
+            self.resident_bytes += nbytes
+        self.budget.add(self, full_key, nbytes)
+
+    def remove_symbol(self, symbol: str):
+        """ 删除该symbol的全部缓存 """
+        with self._lock:
+            removed = [full_key for full_key in self._data if full_key[0] == symbol]
+            for full_key in removed:
+                self.resident_bytes -= array_nbytes(self._data.pop(full_key))
+            self._unsaved = {full_key for full_key in self._unsaved if full_key[0] != symbol}
+            self._probed = {full_key for full_key in self._probed if full_key[0] != symbol}
+        for full_key in removed:
+            self.budget.remove(self, full_key)
+
+    def _evict(self, full_key: Tuple):
+        """ 由MemoryBudget调用 """
+        with self._lock:
+            array = self._data.pop(full_key, None)
+            if array is not None:
+                self.resident_bytes -= array_nbytes(array)
+                self.evictions += 1
+            self._probed.discard(full_key)  # 保存过的可以再从store载入
+        self.budget.remove(self, full_key)
+
+    def save(self):
+        """ 把新算出的数组保存到store (已被淘汰的不再保存) """
+        if self.store is None:
+            return
+        with self._lock:
+            unsaved = [(full_key, self._data[full_key]) for full_key in self._unsaved if full_key in self._data]
+            self._unsaved.clear()
+        for full_key, array in unsaved:
+            self.store.save(full_key[0], self.name, full_key[1:], array)
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'loads': self.loads, 'evictions': self.evictions,
+                'entries': len(self._data), 'resident_bytes': self.resident_bytes}
+
 
-    def contains(self, symbol: str, name: str) -> bool:
-        return f'{symbol}-{name}' in self._data
+def save_memos():
+    """ 把所有Memo中新算出的数组保存到各自的store """
+    for memo in list(_all_memos):
+        memo.save()
 
-    def get(self, symbol: str, name: str):
-        """ 若不存在将抛出异常, 应先调用contains()判断 """
-        return self._data[f'{symbol}-{name}']
 
-    def set(self, symbol: str, name: str, array: np.ndarray):
-        self._data[f'{symbol}-{name}'] = array
+def memo_stats() -> Dict[str, dict]:
+    """ 所有Memo的统计 {Memo名称: {'hits', 'misses', 'loads', 'evictions', 'entries', 'resident_bytes'}} 同名的合并 """
+    result: Dict[str, dict] = {}
+    for memo in list(_all_memos):
+        stats = memo.stats()
+        if memo.name in result:
+            stats = {k: v + result[memo.name][k] for k, v in stats.items()}
+        result[memo.name] = stats
+    return result
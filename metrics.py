@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    运行时统计: 指标计算耗时, GlobalData查找缓存的命中率, 各数据源的下载耗时与数据量
+    默认关闭, 关闭时各处只多一次属性判断; config.ini中metrics = 1或调用metrics_instance.enable()开启
+    导出: snapshot()为dict, prometheus()为Prometheus文本格式; enable(sentry=True)时每次计时同时作为sentry的span
+    Memo的命中统计一直在记录(见memo.py), 导出时一并读取
+"""
+
+import configparser
+import threading
+import time
+from typing import Dict, Tuple
+
+from memo import memo_stats
+
+LabelKey = Tuple[Tuple[str, str], ...]  # 排序后的 ((标签名, 值), ...)
+
+
+class _NullTimer:
+    """ 关闭时timer()返回的空计时器 """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+
+class _Timer:
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: Dict[str, str]):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+        self._span = None
+
+    def __enter__(self):
+        if self._metrics.sentry:
+            import sentry_sdk
+            self._span = sentry_sdk.start_span(op=self._name, description=' '.join(f'{k}={v}' for k, v in self._labels.items()))
+            self._span.__enter__()
+        self._begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._metrics.observe(self._name, time.perf_counter() - self._begin, **self._labels)
+        if self._span is not None:
+            self._span.__exit__(*exc)
+        return False
+
+
+class Metrics:
+    """
+        counters: {名称: {标签: 累计值}}   timings: {名称: {标签: [次数, 总秒数, 最大秒数]}}
+        多个下载线程同时记录时加锁; 关闭时所有记录方法直接返回
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.sentry = False
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._timings: Dict[str, Dict[LabelKey, list]] = {}
+        self._lock = threading.Lock()
+
+    def enable(self, sentry: bool = False):
+        """ sentry为True时计时同时生成sentry的span, 需要已调用sentry_sdk.init()并处于某个transaction中 """
+        self.sentry = sentry
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.sentry = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            timing = self._timings.setdefault(name, {}).setdefault(key, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def timer(self, name: str, **labels: str):
+        """ with metrics_instance.timer('compute', index='MA'): ...  记录代码块的耗时 """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, name, labels)
+
+    def count_lookup(self, cache: str, hit: bool):
+        """ 查找缓存的命中/未命中 调用前应先判断enabled """
+        self.inc('lookup', cache=cache, result='hit' if hit else 'miss')
+
+    def snapshot(self) -> dict:
+        """
+            {'counters': {名称: [{'labels': {...}, 'value': v}]},
+             'timings': {名称: [{'labels': {...}, 'count': n, 'sum': 秒, 'max': 秒}]},
+             'memo': memo_stats()}
+        """
+        with self._lock:
+            counters = {name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                        for name, series in self._counters.items()}
+            timings = {name: [{'labels': dict(key), 'count': count, 'sum': total, 'max': longest}
+                              for key, (count, total, longest) in series.items()]
+                       for name, series in self._timings.items()}
+        return {'counters': counters, 'timings': timings, 'memo': memo_stats()}
+
+    def prometheus(self, prefix: str = 'tic') -> str:
+        """ Prometheus文本格式 计时为summary(_count _sum), 另加_max为gauge """
+        snapshot = self.snapshot()
+        lines = []
+        for name, samples in sorted(snapshot['counters'].items()):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines += [f'{prefix}_{name}_total{_labels(s["labels"])} {_number(s["value"])}' for s in samples]
+        for name, samples in sorted(snapshot['timings'].items()):
+            lines.append(f'# TYPE {prefix}_{name}_seconds summary')
+            for s in samples:
+                lines.append(f'{prefix}_{name}_seconds_count{_labels(s["labels"])} {s["count"]}')
+                lines.append(f'{prefix}_{name}_seconds_sum{_labels(s["labels"])} {_number(s["sum"])}')
+            lines.append(f'# TYPE {prefix}_{name}_seconds_max gauge')
+            lines += [f'{prefix}_{name}_seconds_max{_labels(s["labels"])} {_number(s["max"])}' for s in samples]
+        memo = snapshot['memo']
+        for field, kind in (('hits', 'counter'), ('misses', 'counter'), ('loads', 'counter'), ('evictions', 'counter'),
+                            ('entries', 'gauge'), ('resident_bytes', 'gauge')):
+            metric = f'{prefix}_memo_{field}' + ('_total' if kind == 'counter' else '')
+            lines.append(f'# TYPE {metric} {kind}')
+            lines += [f'{metric}{_labels({"memo": name})} {stats[field]}' for name, stats in sorted(memo.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _enabled_in_config() -> bool:
+    """ 读取config.ini中的metrics 默认关闭 """
+    conf = configparser.ConfigParser()
+    conf.read('config.ini')
+    return conf.getboolean('Config', 'metrics', fallback=False)
+
+metrics_instance = Metrics(_enabled_in_config())
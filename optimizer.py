@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    参数优化: 为基于指标的交易规则搜索参数 用滚动向前(walk-forward)的方式评估, 代替手工挑选demo.main中的p_MACD、p_KDJ等
+        result = optimize('kdj({n},{m}) < {low}', 'kdj({n},{m}) > 100', {'n': [9, 14], 'm': [3, 5], 'low': [0, 10]})
+        result.table  result.windows  result.summary
+    entry、exit为回测的买入、卖出表达式(见indexes/backtest.py), 其中的{name}为待优化的参数
+    从START_DECISION_DATE起把日期分为若干段: 每段先在train根K线上评估所有候选参数, 选出得分最高的一组, 再在随后的test根K线上检验
+    候选按被选中的段数与训练段得分排名, 检验段只用来评估选出的参数(见OptimizeResult), 不参与排名
+    search:
+        grid     全部参数组合
+        random   随机抽取samples组
+        halving  逐次减半: 随机抽取samples组, 先在少量股票上评估训练段, 每轮保留得分最高的1/eta, 股票数乘以eta, 最后一轮为全部股票
+    指标矩阵在Panel上计算并缓存, 参数相同的指标以及EMA、RSV等中间结果在各候选之间共用(如short相同的MACD共用EMA(CLOSE,SHORT)),
+    用到相同指标的候选依次评估, 指标矩阵在之后的候选都不再用到时才删除
+    计算指标与模拟交易的numba核心在股票之间并行, 使用全部CPU
+        python optimizer.py --symbols 300 --bars 1000    用合成数据运行一个例子
+"""
+
+import argparse
+import itertools
+import math
+import time
+import warnings
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from global_data import global_data_instance
+
+from indexes.backtest import backtest
+from indexes.panel import Panel
+from indexes.screener import Expression, screener_instance
+
+SEARCHES = ('grid', 'random', 'halving')
+METRICS = ('sharpe', 'return', 'annual_return')  # 越大越好的组合统计 见BacktestResult.portfolio
+
+Window = Tuple[str, str, str, str]  # (训练段开始, 训练段结束, 检验段开始, 检验段结束)
+
+
+def candidates(params: Dict[str, Sequence], search: str = 'grid', samples: int = 20, seed: int = 0) -> List[Dict]:
+    """ 待评估的参数组 grid为全部组合, random与halving从中不重复地随机抽取samples组 """
+    if search not in SEARCHES:
+        raise ValueError(f'Unknown search: {search}, use one of {SEARCHES}')
+    names = list(params)
+    combos = [dict(zip(names, values)) for values in itertools.product(*(params[name] for name in names))]
+    if search == 'grid' or samples >= len(combos):
+        return combos
+    rng = np.random.default_rng(seed)
+    return [combos[i] for i in sorted(rng.choice(len(combos), samples, replace=False))]
+
+
+def windows(dates: np.ndarray, train: int, test: int, step: Optional[int] = None) -> List[Window]:
+    """ 把dates分成滚动向前的若干段 每段训练train天、检验随后的test天, 每段向后移动step天(默认为test) """
+    step = step or test
+    result = []
+    for lo in range(0, len(dates) - train - test + 1, step):
+        result.append((dates[lo], dates[lo + train - 1], dates[lo + train], dates[lo + train + test - 1]))
+    if not result:
+        raise ValueError(f'{len(dates)} decision days are fewer than train + test = {train + test}')
+    return result
+
+
+def panel_keys(expression: Expression) -> Set[Tuple]:
+    """ 表达式用到的Panel指标矩阵的键 如 'pdi(14)' -> ('dmi', 14) """
+    keys = set()
+    for name, params in expression.terms.values():
+        if params:
+            keys.add(('dmi', *params) if name in ('pdi', 'mdi') else (name, *params))
+    return keys
+
+
+class WalkForward():
+    """ 在一个Panel上评估候选参数 """
+
+    def __init__(self, entry: str, exit: str, windows: List[Window], metric: str = 'sharpe', **options):
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric: {metric}, use one of {METRICS}')
+        self.entry = entry
+        self.exit = exit
+        self.windows = windows
+        self.metric = metric
+        self.options = options  # 传给backtest 如fee、slippage、lot
+
+    def expressions(self, candidate: Dict) -> Tuple[Expression, Expression]:
+        try:
+            return Expression(self.entry.format(**candidate)), Expression(self.exit.format(**candidate))
+        except KeyError as e:
+            raise ValueError(f'Parameter {e} is not given') from None
+
+    def evaluate(self, panel: Panel, pool: List[Dict], test: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+            返回 (训练段得分, 检验段得分, 检验段收益率) 三个 (候选数 × 段数) 的数组 test为False时只评估训练段
+            各候选都用到的指标矩阵保留, 其余的评估完即从Panel中删除
+        """
+        keys = [set().union(*map(panel_keys, self.expressions(candidate))) for candidate in pool]
+        shared = set.intersection(*keys) if keys else set()
+        remaining = Counter(key for candidate_keys in keys for key in candidate_keys)  # 每个指标矩阵还有几个候选要用
+        shape = (len(pool), len(self.windows))
+        train_scores, test_scores, test_returns = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+        for i in sorted(range(len(pool)), key=lambda i: sorted(keys[i])):  # 用到相同指标的候选相邻
+            entry, exit_ = self.expressions(pool[i])
+            entries = screener_instance.signals(entry.text, panel=panel)
+            exits = screener_instance.signals(exit_.text, panel=panel)
+            for j, (train_start, train_end, test_start, test_end) in enumerate(self.windows):
+                result = backtest(entries, exits, panel=panel, start=train_start, end=train_end, **self.options)
+                train_scores[i, j] = result.portfolio[self.metric]
+                if test:
+                    result = backtest(entries, exits, panel=panel, start=test_start, end=test_end, **self.options)
+                    test_scores[i, j] = result.portfolio[self.metric]
+                    test_returns[i, j] = result.portfolio['return']
+            remaining.subtract(keys[i])
+            panel.forget([key for key in keys[i] - shared if remaining[key] == 0])
+        return train_scores, test_scores, test_returns
+
+    def halve(self, symbols: List[str], pool: List[Dict], eta: int = 3, seed: int = 0) -> List[Dict]:
+        """ 逐次减半 在越来越多的股票上评估训练段, 返回最后留下的候选(最后一轮的股票数少于全部时不再评估) """
+        rng = np.random.default_rng(seed)
+        rungs = math.ceil(math.log(len(pool), eta)) if len(pool) > 1 else 0
+        for rung in range(rungs):
+            count = math.ceil(len(symbols) / eta ** (rungs - rung))
+            subset = sorted(str(symbol) for symbol in rng.choice(symbols, count, replace=False))
+            train_scores, _, _ = self.evaluate(Panel(subset), pool, test=False)
+            score = np.nan_to_num(np.nanmean(train_scores, axis=1), nan=-np.inf)
+            keep = max(1, math.ceil(len(pool) / eta))
+            pool = [pool[i] for i in sorted(np.argsort(-score, kind='stable')[:keep])]
+        return pool
+
+
+class OptimizeResult():
+    """
+        optimize的结果
+        table    各候选参数一行, 按selected、train_<metric>从高到低排列(只用训练段排名):
+                     参数各一列, train_<metric>与test_<metric>为各段训练、检验得分的平均, test_return为检验段收益率的平均,
+                     selected为该组参数在多少段中训练得分最高(即滚动向前时被选中用于检验段)
+        windows  每段一行: 训练、检验段的起止日期, 该段选出的参数, 及其训练得分、检验得分与检验段收益率
+        summary  滚动向前的样本外结果: 各段选出的参数在检验段的平均得分 {metric: , 'return': }
+    """
+
+    def __init__(self, table: pd.DataFrame, windows: pd.DataFrame, metric: str):
+        self.table = table
+        self.windows = windows
+        self.metric = metric
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.summary: Dict[str, float] = {metric: float(np.nanmean(windows[f'test_{metric}'])),
+                                              'return': float(np.nanmean(windows['test_return']))}
+
+
+def optimize(entry: str, exit: str, params: Dict[str, Sequence], symbols: Optional[Sequence[str]] = None,
+             search: str = 'grid', samples: int = 20, eta: int = 3, train: int = 250, test: int = 60, step: Optional[int] = None,
+             metric: str = 'sharpe', seed: int = 0, **options) -> OptimizeResult:
+    """
+        返回各候选参数的评估结果与滚动向前选出的参数在检验段的表现, 见OptimizeResult
+        symbols默认为本地已有数据的全部symbol; options传给backtest, 如fee、slippage、size、lot
+    """
+    symbols = list(dict.fromkeys(symbols if symbols is not None else global_data_instance.loaded_symbols()))
+    pool = candidates(params, search, samples, seed)
+    panel = screener_instance.panel(symbols)
+    decision_dates = panel.dates[np.searchsorted(panel.dates, global_data_instance.START_DECISION_DATE):]
+    walk = WalkForward(entry, exit, windows(decision_dates, train, test, step), metric, **options)
+    if search == 'halving':
+        pool = walk.halve(symbols, pool, eta, seed)
+
+    train_scores, test_scores, test_returns = walk.evaluate(panel, pool)
+    best = np.argmax(np.nan_to_num(train_scores, nan=-np.inf), axis=0)  # 每段训练得分最高的候选
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # 某组参数各段都没有得分(如从未交易)时为NaN
+        table = pd.DataFrame(pool)
+        table[f'train_{metric}'] = np.nanmean(train_scores, axis=1)
+        table[f'test_{metric}'] = np.nanmean(test_scores, axis=1)
+        table['test_return'] = np.nanmean(test_returns, axis=1)
+    table['selected'] = np.bincount(best, minlength=len(pool))
+    table = table.sort_values(['selected', f'train_{metric}'], ascending=False, na_position='last').reset_index(drop=True)
+
+    folds = np.arange(len(walk.windows))
+    chosen = pd.DataFrame(walk.windows, columns=['train_start', 'train_end', 'test_start', 'test_end'])
+    chosen = pd.concat([chosen, pd.DataFrame([pool[i] for i in best])], axis=1)
+    chosen[f'train_{metric}'] = train_scores[best, folds]
+    chosen[f'test_{metric}'] = test_scores[best, folds]
+    chosen['test_return'] = test_returns[best, folds]
+    return OptimizeResult(table, chosen, metric)
+
+
+def main():
+    """ 用合成数据运行一个KDJ规则的例子 """
+    from synthetic import synthetic_ohlcv
+
+    parser = argparse.ArgumentParser(description='walk-forward parameter search on synthetic data')
+    parser.add_argument('--symbols', type=int, default=300, help='number of synthetic symbols')
+    parser.add_argument('--bars', type=int, default=1000, help='bars per symbol')
+    parser.add_argument('--search', default='grid', choices=SEARCHES)
+    parser.add_argument('--samples', type=int, default=12, help='candidates drawn by random / halving')
+    args = parser.parse_args()
+
+    symbols = [f'SYN.{i}' for i in range(args.symbols)]
+    for i, symbol in enumerate(symbols):
+        global_data_instance.put_data(symbol, synthetic_ohlcv(args.bars, seed=i, start=global_data_instance.START_DOWNLOAD_DATE))
+    begin = time.perf_counter()
+    result = optimize('kdj({n},{m}) < {low}', 'kdj({n},{m}) > {high}',
+                      {'n': [9, 14, 21], 'm': [3, 5], 'low': [-10, 0, 10], 'high': [90, 100]},
+                      symbols, search=args.search, samples=args.samples, train=120, test=40, fee=0.0003, lot=100)
+    print(result.table.head(10).to_string())
+    print(result.windows.to_string())
+    print(f'walk-forward out of sample: {result.summary}')
+    print(f'{len(result.table)} candidates on {args.symbols} symbols in {time.perf_counter() - begin:.2f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    令牌桶限速 用于限制对各数据源的请求频率, 多个下载线程共用同一个TokenBucket
+"""
+
+import threading
+import time
+from typing import Callable
+
+
+class TokenBucket:
+    """
+        每秒补充rate个令牌, 最多积累capacity个; 每次请求前调用acquire()取走一个令牌, 没有令牌时等待
+        clock与sleep可以替换 便于测试
+    """
+
+    def __init__(self, rate: float, capacity: float = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        assert rate > 0 and capacity >= 1
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """ 有令牌时取走一个并返回0, 否则返回还需等待的秒数 """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1 - 1e-9:  # 按返回的秒数等待后补充的令牌可能因浮点误差略小于1
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """ 取走一个令牌 必要时等待 (等待时不持有锁, 其他线程可以同时检查) """
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            self._sleep(wait)
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    用多个进程计算大量symbol的指标: numba核心对一只股票是顺序计算的, 一个进程只能用满一个核
+    所有股票的OHLCV首尾相接放入一块共享内存, 各指标的结果写入另一块共享内存, 布局相同:
+        输入: int64的offsets[n+1] 之后是 (5 × 总K线数) 的float64矩阵, 第i只股票占 [offsets[i], offsets[i+1]) 列
+        输出: (输出数 × 总K线数) 的float64矩阵
+    worker进程按名称映射这两块内存, 直接在上面调用indexes.panel.series_xxx, 进程之间只传递symbol的下标范围, 不序列化任何数组
+        panel = scan(symbols, [('ma', 5), ('macd', 12, 26, 9), ('dmi', 14)])
+    返回的IndicatorPanel与tasks.compute_universe的相同; 进程数默认为config.ini中的scan_processes, 0为CPU核数
+    worker用spawn方式启动, 调用scan的脚本需放在 if __name__ == '__main__': 之下; 多次scan时用new_pool()复用进程
+"""
+
+import configparser
+import os
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from dto_enum import OHLCV
+from global_data import global_data_instance
+from indexes.panel import (IndicatorPanel, output_names, series_cci, series_dmi, series_kdj, series_ma, series_macd,
+                           series_mtm, series_rsi)
+
+_conf = configparser.ConfigParser()
+_conf.read('config.ini')
+PROCESSES = _conf.getint('Config', 'scan_processes', fallback=0)
+
+# 名称: f(open, high, low, close, *参数) 返回各输出的序列, 输出的名称见indexes.panel.INDICATOR_OUTPUTS
+SERIES: Dict[str, Callable] = {
+    'ma': lambda o, h, l, c, n: (series_ma(c, n),),
+    'macd': lambda o, h, l, c, short, long, mid: (series_macd(c, short, long, mid),),
+    'rsi': lambda o, h, l, c, n: (series_rsi(c, n),),
+    'kdj': lambda o, h, l, c, n, m: (series_kdj(c, h, l, n, m),),
+    'mtm': lambda o, h, l, c, n, m: (series_mtm(c, n, m),),
+    'cci': lambda o, h, l, c, n: (series_cci(c, h, l, n),),
+    'dmi': lambda o, h, l, c, n: series_dmi(c, h, l, n),
+}
+
+
+def _views(input_block: SharedMemory, output_block: SharedMemory, n_symbols: int, total: int,
+           n_outputs: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ 共享内存上的 (offsets, OHLCV矩阵, 结果矩阵) 不复制 """
+    offsets = np.ndarray(n_symbols + 1, np.int64, buffer=input_block.buf)
+    columns = np.ndarray((len(OHLCV), total), np.float64, buffer=input_block.buf, offset=offsets.nbytes)
+    results = np.ndarray((n_outputs, total), np.float64, buffer=output_block.buf)
+    return offsets, columns, results
+
+
+def _attach(name: str) -> SharedMemory:
+    """ worker中映射已有的共享内存 worker与父进程共用同一个resource_tracker, 由父进程unlink时一并注销 """
+    return SharedMemory(name)
+
+
+_attached: Dict[str, SharedMemory] = {}  # worker进程中当前映射的共享内存 {名称: SharedMemory}
+
+
+def new_pool(processes: Optional[int] = None):
+    """
+        可在多次scan之间复用的进程池, 省去每次启动进程的时间(每个进程要import indexes)
+        用spawn启动: import indexes时numba已启动了线程池(tbb), fork出的进程中不可用
+        进程数保存在pool.processes, scan按它分段
+    """
+    processes = processes or PROCESSES or os.cpu_count() or 1
+    pool = get_context('spawn').Pool(processes)
+    pool.processes = processes
+    return pool
+
+
+def compute_rows(offsets: np.ndarray, columns: np.ndarray, results: np.ndarray, indicators: Sequence[Sequence],
+                 lo: int, hi: int) -> Dict[int, str]:
+    """ 计算第lo到hi-1只股票的各指标写入results 返回计算失败的 {下标: 错误信息} """
+    errors = {}
+    for i in range(lo, hi):
+        a, b = offsets[i], offsets[i + 1]
+        o, h, l, c = columns[0, a:b], columns[1, a:b], columns[2, a:b], columns[3, a:b]  # 按OHLCV的顺序
+        row = 0
+        for indicator in indicators:
+            name, *params = indicator
+            try:
+                outputs = SERIES[name](o, h, l, c, *params)
+            except Exception as e:
+                errors[i] = repr(e)
+                outputs = [np.full(b - a, np.nan)] * len(output_names(indicator))
+            for series in outputs:
+                results[row, a:b] = series
+                row += 1
+    return errors
+
+
+def _compute_task(input_name: str, output_name: str, n_symbols: int, total: int, indicators: List[list],
+                  lo: int, hi: int) -> Dict[int, str]:
+    """ 在worker中执行 参数只有共享内存的名称与下标范围 """
+    if input_name not in _attached:  # 新的一次scan 不再使用之前的共享内存
+        for block in _attached.values():
+            block.close()
+        _attached.clear()
+        _attached.update({input_name: _attach(input_name), output_name: _attach(output_name)})
+    n_outputs = sum(len(output_names(indicator)) for indicator in indicators)
+    offsets, columns, results = _views(_attached[input_name], _attached[output_name], n_symbols, total, n_outputs)
+    return compute_rows(offsets, columns, results, indicators, lo, hi)
+
+
+def split(offsets: np.ndarray, parts: int) -> List[Tuple[int, int]]:
+    """ 把symbol按K线数大致均分为不超过parts段 返回各段的 [lo, hi) """
+    n = len(offsets) - 1
+    bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], parts + 1)[1:-1])
+    bounds = np.unique(np.concatenate([[0], np.minimum(bounds, n), [n]]))
+    return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def _load(symbols: List[str], frames: Optional[Dict[str, pd.DataFrame]]) -> Tuple[Dict[str, Tuple], Dict[str, str]]:
+    """ 返回 {symbol: (日期, OHLCV各列)} 与取数据失败的 {symbol: 错误信息} """
+    errors = {}
+    if frames is None:
+        errors = {symbol: repr(e) for symbol, e in global_data_instance.prefetch(symbols, progress=lambda *args: None).items()}
+    loaded = {}
+    for symbol in symbols:
+        if symbol in errors:
+            continue
+        try:
+            if frames is None:
+                dates = global_data_instance.get_date_index(symbol)
+                columns = [global_data_instance.get_array_since_date(symbol, column, global_data_instance.START_DOWNLOAD_DATE)
+                           for column in OHLCV]
+            else:
+                df = frames[symbol]
+                dates = np.array(df.index, dtype='datetime64[D]')
+                columns = [df[column.name.lower()].to_numpy(np.float64) for column in OHLCV]
+        except Exception as e:
+            errors[symbol] = repr(e)
+            continue
+        loaded[symbol] = (dates, columns)
+    return loaded, errors
+
+
+def scan(symbols: Sequence[str], indicators: Sequence[Sequence], start: str = '', end: str = '9999-12-31',
+         processes: Optional[int] = None, frames: Optional[Dict[str, pd.DataFrame]] = None, pool=None) -> IndicatorPanel:
+    """
+        用processes个进程计算各symbol的指标, 返回日期在 [start, end] 之间的结果
+        indicators如 [('ma', 5), ('macd', 12, 26, 9)], 可用的名称见SERIES
+        默认从global_data_instance取数据(没有的先下载); 也可传入frames直接使用给定的 {symbol: dataframe}
+        传入pool(new_pool()的返回值)时使用其中的进程, 否则每次新建进程池, 用完关闭
+    """
+    indicators = [[indicator[0], *map(int, indicator[1:])] for indicator in indicators]
+    for indicator in indicators:
+        if indicator[0] not in SERIES:
+            raise ValueError(f'Unknown indicator: {indicator[0]}')
+    outputs = [output for indicator in indicators for output in output_names(indicator)]
+    loaded, errors = _load(list(dict.fromkeys(symbols)), frames)
+    n_symbols, total = len(loaded), sum(len(dates) for dates, _ in loaded.values())
+
+    input_block = SharedMemory(create=True, size=max((n_symbols + 1) * 8 + len(OHLCV) * total * 8, 1))
+    output_block = SharedMemory(create=True, size=max(len(outputs) * total * 8, 1))
+    try:
+        return _scan_shared(input_block, output_block, loaded, indicators, outputs, start, end, processes, pool, errors)
+    finally:
+        for block in (input_block, output_block):
+            block.unlink()
+            try:
+                block.close()
+            except BufferError:  # 出错时traceback中仍引用着视图, 随之回收
+                pass
+
+
+def _scan_shared(input_block: SharedMemory, output_block: SharedMemory, loaded: Dict[str, Tuple], indicators: List[list],
+                 outputs: List[str], start: str, end: str, processes: Optional[int], pool, errors: Dict[str, str]) -> IndicatorPanel:
+    n_symbols = len(loaded)
+    lengths = [len(dates) for dates, _ in loaded.values()]
+    offsets, columns, results = _views(input_block, output_block, n_symbols, sum(lengths), len(outputs))
+    offsets[0] = 0
+    np.cumsum(lengths, out=offsets[1:])
+    for i, (_, arrays) in enumerate(loaded.values()):
+        for k, array in enumerate(arrays):
+            columns[k, offsets[i]:offsets[i + 1]] = array
+
+    processes = pool.processes if pool is not None else processes or PROCESSES or os.cpu_count() or 1
+    ranges = split(offsets, processes * 4)  # 每个进程分几段 K线数不均时也能各自忙满
+    if processes == 1 or len(ranges) <= 1:
+        failures = compute_rows(offsets, columns, results, indicators, 0, n_symbols)
+    else:
+        failures = {}
+        own_pool = pool is None
+        pool = new_pool(processes) if own_pool else pool
+        try:
+            tasks = [(input_block.name, output_block.name, n_symbols, sum(lengths), indicators, lo, hi) for lo, hi in ranges]
+            for part in pool.starmap(_compute_task, tasks, chunksize=1):
+                failures.update(part)
+        finally:
+            if own_pool:
+                pool.close()
+                pool.join()
+    symbol_list = list(loaded)
+    for i, error in failures.items():
+        errors[symbol_list[i]] = error
+
+    panel_results = {}
+    for i, (symbol, (dates, _)) in enumerate(loaded.items()):
+        if symbol in errors:
+            continue
+        lo = int(np.searchsorted(dates, np.datetime64(start, 'D'))) if start else 0
+        hi = int(np.searchsorted(dates, np.datetime64(end, 'D'), side='right'))
+        arrays = {'dates': dates[lo:hi]}
+        for row, output in enumerate(outputs):
+            arrays[output] = results[row, offsets[i] + lo:offsets[i] + hi]
+        panel_results[symbol] = arrays
+    return IndicatorPanel(panel_results, outputs, errors)  # 复制到各输出的矩阵中, 返回后即可释放共享内存
+
+
+def main():
+    """ 用合成数据测量不同进程数的吞吐量 python scan_pool.py --symbols 2000 --bars 2000 --processes 1,2,4 """
+    import argparse
+    import time
+    from synthetic import synthetic_ohlcv
+
+    parser = argparse.ArgumentParser(description='throughput of the shared memory process pool on synthetic data')
+    parser.add_argument('--symbols', type=int, default=2000)
+    parser.add_argument('--bars', type=int, default=2000)
+    parser.add_argument('--processes', default=','.join(str(2 ** i) for i in range((os.cpu_count() or 1).bit_length())),
+                        help='comma separated process counts')
+    args = parser.parse_args()
+
+    frames = {f'SYN.{i}': synthetic_ohlcv(args.bars, seed=i, start=global_data_instance.START_DOWNLOAD_DATE) for i in range(args.symbols)}
+    indicators = [('ma', 5), ('macd', 12, 26, 9), ('rsi', 6), ('kdj', 9, 3), ('mtm', 12, 6), ('cci', 14), ('dmi', 14)]
+    base = None
+    for processes in map(int, args.processes.split(',')):
+        with new_pool(processes) as pool:
+            scan(list(frames)[:processes * 4], indicators, frames=frames, pool=pool)  # 等各进程启动完
+            begin = time.perf_counter()
+            scan(list(frames), indicators, frames=frames, pool=pool)
+            seconds = time.perf_counter() - begin
+        base = base or seconds
+        print(f'{processes:3} processes  {seconds:8.3f} s  {args.symbols * args.bars / seconds / 1e6:8.2f} M bars/s  speedup {base / seconds:5.2f}')
+
+if __name__ == '__main__':
+    main()
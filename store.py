@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    按列保存K线数据的本地数据库, 代替整个pickle的database.bin
+    目录结构:
+        manifest.json               {symbol: {'version': 版本号, 'length': K线数, 'first': 首日, 'last': 末日}}
+        <symbol>/dates.<版本号>.npy  datetime64[D]
+        <symbol>/open.<版本号>.npy   同样的还有 high low close volume
+    读取时用内存映射(np.load(mmap_mode='r')), 只在用到某个symbol时才打开它的文件, 也不会复制数据
+    保存某个symbol时写入新版本号的文件, 再更新manifest.json, 所以正在被映射的旧文件不受影响(Windows下也可以保存)
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class ColumnStore:
+    """ 按symbol/列保存的内存映射数据库 """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._manifest_path = os.path.join(root, 'manifest.json')
+        self._lock = threading.Lock()
+        self._manifest: Dict[str, dict] = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+
+    def exists(self) -> bool:
+        """ 数据库是否已建立 """
+        return os.path.exists(self._manifest_path)
+
+    def symbols(self) -> List[str]:
+        return list(self._manifest)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._manifest
+
+    def info(self, symbol: str) -> Optional[dict]:
+        """ manifest中该symbol的信息 不存在时返回None """
+        return self._manifest.get(symbol)
+
+    def load(self, symbol: str) -> Optional[Tuple[np.ndarray, Dict[str, np.ndarray]]]:
+        """ 返回 (日期数组datetime64[D], {列名: 数组}) 均为只读的内存映射; symbol不存在时返回None """
+        info = self._manifest.get(symbol)
+        if info is None:
+            return None
+        # np.asarray去掉np.memmap子类 仍然是同一块映射内存 不复制
+        dates = np.asarray(np.load(self._path(symbol, 'dates', info['version']), mmap_mode='r'))
+        columns = {column: np.asarray(np.load(self._path(symbol, column, info['version']), mmap_mode='r')) for column in COLUMNS}
+        return dates, columns
+
+    def save(self, symbol: str, dates: np.ndarray, columns: Dict[str, np.ndarray]):
+        """ 保存一个symbol的全部K线 dates为datetime64[D]或'YYYY-MM-DD'字符串, columns需包含COLUMNS中的各列 """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        with self._lock:
+            old = self._manifest.get(symbol)
+            version = old['version'] + 1 if old is not None else 1
+            os.makedirs(os.path.join(self.root, symbol), exist_ok=True)
+            np.save(self._path(symbol, 'dates', version), dates)
+            for column in COLUMNS:
+                array = np.asarray(columns[column])
+                assert len(array) == len(dates), f'{symbol} {column} length mismatch'
+                np.save(self._path(symbol, column, version), array)
+
+            self._manifest[symbol] = {'version': version, 'length': len(dates),
+                                      'first': str(dates[0]) if len(dates) else '', 'last': str(dates[-1]) if len(dates) else ''}
+            self._write_manifest()
+            if old is not None:
+                self._remove_files(symbol, old['version'])
+
+    def _write_manifest(self):
+        """ 先写临时文件再替换 避免写到一半时中断导致manifest损坏 """
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = self._manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self._manifest_path)
+
+    def _remove_files(self, symbol: str, version: int):
+        """ 删除旧版本的文件 若仍被映射(Windows下无法删除)则留到下次 """
+        for column in ('dates',) + COLUMNS:
+            try:
+                os.remove(self._path(symbol, column, version))
+            except OSError:
+                pass
+
+    def _path(self, symbol: str, column: str, version: int) -> str:
+        return os.path.join(self.root, symbol, f'{column}.{version}.npy')
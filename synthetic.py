@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    生成合成的日K线数据 用于离线测试与性能测试, 用global_data_instance.put_data(symbol, df)载入
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def max_bars(start: str) -> int:
+    """ 从start开始每天一根K线 'YYYY-MM-DD'格式的日期(到9999-12-31为止)最多能容纳的K线数 """
+    return int((np.datetime64('9999-12-31') - np.datetime64(start, 'D')).astype(np.int64)) + 1
+
+
+def synthetic_arrays(length: int, seed: int = 0):
+    """ 返回 (open, high, low, close, volume) 收盘价为几何随机游走, 最高/最低价包住开盘与收盘价 """
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, length)))
+    open_ = close * (1 + rng.normal(0, 0.005, length))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, length)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, length)))
+    volume = rng.integers(1000, 1000000, length).astype(np.float64)
+    return open_, high, low, close, volume
+
+
+def synthetic_ohlcv(length: int, seed: int = 0, start: str = '2000-01-01') -> pd.DataFrame:
+    """
+        返回与GlobalData.add_data格式相同的dataframe, 以'YYYY-MM-DD'为索引, 从start开始每天一根K线
+        日期不能超过9999-12-31, 所以length最多为max_bars(start)
+    """
+    dates = np.arange(np.datetime64(start, 'D'), np.datetime64(start, 'D') + length)
+    if length > 0 and dates[-1] > np.datetime64('9999-12-31'):
+        raise ValueError(f'{length} bars from {start} go past 9999-12-31')
+    open_, high, low, close, volume = synthetic_arrays(length, seed)
+    return pd.DataFrame({'open': open_, 'close': close, 'high': high, 'low': low, 'volume': volume},
+                        index=np.datetime_as_string(dates).tolist())
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    用Celery把一批symbol分片交给多个worker计算指标, 结果汇总为一个 (symbol × date) 的IndicatorPanel
+    启动worker(在项目根目录):  celery -A tasks worker --loglevel=info
+    提交并等待结果:            panel = compute_universe(symbols, [('ma', 5), ('macd', 12, 26, 9), ('dmi', 14)])
+    broker与结果后端见config.ini中的celery_broker、celery_backend; 测试时设置app.conf.task_always_eager = True在本进程内执行
+    数组以原始字节编码后传输, 比JSON的数字列表小得多; 也可以让worker写入共享目录只返回文件路径(output_dir)
+"""
+
+import base64
+import configparser
+import os
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from celery import Celery, group
+from global_data import global_data_instance
+from indexes import cci_instance, dmi_instance, kdj_instance, ma_instance, macd_instance, mtm_instance, rsi_instance
+from indexes.panel import IndicatorPanel, output_names
+
+_conf = configparser.ConfigParser()
+_conf.read('config.ini')
+
+app = Celery('technical_indicator_calculator',
+             broker=_conf.get('Config', 'celery_broker', fallback='redis://localhost:6379/0'),
+             backend=_conf.get('Config', 'celery_backend', fallback='redis://localhost:6379/1'))
+app.conf.update(task_serializer='json', result_serializer='json', accept_content=['json'], result_compression='zlib',
+                worker_prefetch_multiplier=1)  # 每个分片的计算量大 不预取
+
+SHARD_SIZE = _conf.getint('Config', 'celery_shard_size', fallback=50)
+
+# 名称: f(symbol, start, end, *参数) 返回各输出的序列, 输出的名称见indexes.panel.INDICATOR_OUTPUTS
+INDICATORS: Dict[str, Callable] = {
+    'ma': lambda s, start, end, n: (ma_instance.get_ma_range(s, start, end, n),),
+    'macd': lambda s, start, end, short, long, mid: (macd_instance.get_macd_range(s, start, end, short, long, mid),),
+    'rsi': lambda s, start, end, n: (rsi_instance.get_rsi_range(s, start, end, n),),
+    'kdj': lambda s, start, end, n, m: (kdj_instance.get_kdj_range(s, start, end, n, m),),
+    'mtm': lambda s, start, end, n, m: (mtm_instance.get_mtm_range(s, start, end, n, m),),
+    'cci': lambda s, start, end, n: (cci_instance.get_cci_range(s, start, end, n),),
+    'dmi': lambda s, start, end, n: dmi_instance.get_dmi_range(s, start, end, n),
+}
+
+
+def encode_array(array: np.ndarray) -> dict:
+    array = np.ascontiguousarray(array)
+    return {'dtype': array.dtype.str, 'shape': list(array.shape), 'data': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def decode_array(encoded: dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded['data']), dtype=encoded['dtype']).reshape(encoded['shape'])
+
+
+def compute_symbol(symbol: str, indicators: Sequence[Sequence], start: str = '', end: str = '9999-12-31') -> Dict[str, np.ndarray]:
+    """ 在本进程计算一个symbol的各指标 返回 {'dates': datetime64[D]数组, 输出名称: 序列} """
+    lo, hi = global_data_instance.find_date_range(symbol, start, end)
+    result = {'dates': global_data_instance.get_date_index(symbol)[lo:hi]}
+    for indicator in indicators:
+        name, *params = indicator
+        for output, series in zip(output_names(indicator), INDICATORS[name](symbol, start, end, *params)):
+            result[output] = series
+    return result
+
+
+@app.task(name='tasks.compute_shard')
+def compute_shard(symbols: List[str], indicators: List[list], start: str = '', end: str = '9999-12-31',
+                  output_dir: Optional[str] = None) -> dict:
+    """
+        worker上执行: 计算一个分片中每个symbol的各指标, 本地没有数据的先下载
+        返回 {'results': {symbol: {输出名称: 编码后的数组}}, 'errors': {symbol: 错误信息}}
+        指定output_dir(各worker共享的目录)时把每个symbol的结果写入 <output_dir>/<symbol>.npz, results中只返回 {'path': 文件路径}
+    """
+    errors = {symbol: repr(e) for symbol, e in global_data_instance.prefetch(symbols, progress=lambda *args: None).items()}
+    results = {}
+    for symbol in symbols:
+        if symbol in errors:
+            continue
+        try:
+            arrays = compute_symbol(symbol, indicators, start, end)
+        except Exception as e:
+            errors[symbol] = repr(e)
+            continue
+        arrays['dates'] = arrays['dates'].astype(np.int32)  # 1970-01-01以来的天数
+        if output_dir is None:
+            results[symbol] = {output: encode_array(array) for output, array in arrays.items()}
+        else:
+            path = os.path.join(output_dir, f'{symbol}.npz')
+            np.savez(path, **arrays)
+            results[symbol] = {'path': path}
+    return {'results': results, 'errors': errors}
+
+
+def _load_result(result: dict) -> Dict[str, np.ndarray]:
+    if 'path' in result:
+        with np.load(result['path']) as npz:
+            arrays = {output: npz[output] for output in npz.files}
+    else:
+        arrays = {output: decode_array(encoded) for output, encoded in result.items()}
+    arrays['dates'] = arrays['dates'].astype('datetime64[D]')
+    return arrays
+
+
+def shard(symbols: Sequence[str], shard_size: int) -> List[List[str]]:
+    symbols = list(dict.fromkeys(symbols))  # 去重 保持顺序
+    return [symbols[i:i + shard_size] for i in range(0, len(symbols), shard_size)]
+
+
+def compute_universe(symbols: Sequence[str], indicators: Sequence[Sequence], start: str = '', end: str = '9999-12-31',
+                     shard_size: Optional[int] = None, output_dir: Optional[str] = None, timeout: Optional[float] = None) -> IndicatorPanel:
+    """
+        把symbols按shard_size(默认config.ini中的celery_shard_size)分片, 每片作为一个compute_shard任务并行执行, 等待全部完成后汇总
+        indicators如 [('ma', 5), ('macd', 12, 26, 9)], 可用的名称见INDICATORS
+    """
+    indicators = [list(indicator) for indicator in indicators]
+    for indicator in indicators:
+        if indicator[0] not in INDICATORS:
+            raise ValueError(f'Unknown indicator: {indicator[0]}')
+    job = group(compute_shard.s(part, indicators, start, end, output_dir) for part in shard(symbols, shard_size or SHARD_SIZE))
+    shard_results = job.apply_async().get(timeout=timeout)
+
+    results, errors = {}, {}
+    for shard_result in shard_results:
+        errors.update(shard_result['errors'])
+        for symbol, result in shard_result['results'].items():
+            results[symbol] = _load_result(result)
+    order = {symbol: i for i, symbol in enumerate(dict.fromkeys(symbols))}
+    results = dict(sorted(results.items(), key=lambda item: order[item[0]]))  # 与传入的顺序一致
+    return IndicatorPanel(results, [output for indicator in indicators for output in output_names(indicator)], errors)
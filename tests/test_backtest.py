@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import math
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from global_data import global_data_instance
+from indexes.backtest import backtest
+from indexes.screener import screener_instance
+from synthetic import synthetic_ohlcv
+
+ENTRY = 'kdj(9,3) < 10'
+EXIT = 'kdj(9,3) > 90 or close < ma(20) * 0.95'
+
+
+def simulate_loop(open_, close, mask, entries, exits, begin, fee, slippage, size, lot, capital):
+    """ 逐日模拟一只股票 返回每天的资金 与交易次数 """
+    cash, held, pending, price, trades, equity = capital, 0.0, 0, math.nan, 0, []
+    for t in range(begin, len(open_)):
+        if mask[t]:
+            if pending == 1:
+                fill = open_[t] * (1 + slippage)
+                held = math.floor(cash * size / (fill * (1 + fee)) / lot) * lot
+                if held > 0:
+                    cash -= held * fill * (1 + fee)
+                    trades += 1
+            elif pending == -1:
+                cash += held * open_[t] * (1 - slippage) * (1 - fee)
+                held = 0.0
+            pending = 0
+            price = close[t]
+            if held == 0 and entries[t] and not exits[t]:
+                pending = 1
+            elif held > 0 and exits[t]:
+                pending = -1
+        equity.append(cash + held * price if held > 0 else cash)
+    return equity, trades
+
+
+class TestBacktest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.symbols = [f'BACKTEST.{i}' for i in range(5)]
+        for i, symbol in enumerate(cls.symbols):
+            df = synthetic_ohlcv(300 + 7 * i, seed=20 + i, start='2021-01-01')
+            if i == 0:
+                df = df.drop(df.index[180:186])  # 停牌几天
+            global_data_instance.put_data(symbol, df)
+
+    def test_matches_loop(self):
+        result = backtest(ENTRY, EXIT, self.symbols, fee=0.001, slippage=0.002, size=0.8, lot=100)
+        panel = result.panel
+        begin = int(np.searchsorted(panel.dates, global_data_instance.START_DECISION_DATE))
+        self.assertEqual(result.dates[0], panel.dates[begin])
+        entries = screener_instance.signals(ENTRY, panel=panel)
+        exits = screener_instance.signals(EXIT, panel=panel)
+        for row, symbol in enumerate(self.symbols):
+            equity, trades = simulate_loop(panel.open[row], panel.close[row], panel.mask[row], entries[row], exits[row], begin,
+                                           0.001, 0.002, 0.8, 100, 100000.0)
+            np.testing.assert_allclose(result.equity[row], equity, rtol=1e-12)
+            self.assertEqual(result.stats.loc[symbol, 'trades'], trades)
+            self.assertGreater(trades, 0)
+        self.assertTrue((result.shares % 100 == 0).all())
+        np.testing.assert_allclose(result.portfolio_equity, result.equity.sum(axis=0))
+        self.assertAlmostEqual(result.portfolio['return'], result.portfolio_equity[-1] / 500000 - 1)
+        self.assertEqual(result.portfolio['trades'], result.stats['trades'].sum())
+
+    def test_trades(self):
+        result = backtest(ENTRY, EXIT, self.symbols, fee=0.001, slippage=0.002)
+        trades = result.trades()
+        self.assertEqual(len(trades), result.stats['trades'].sum())
+        closed = trades[trades['exit_date'].notna()]
+        self.assertTrue((closed['exit_date'] > closed['entry_date']).all())
+        for symbol in self.symbols:  # 平仓后的资金 = 初始资金 + 各笔交易的盈亏
+            rows = closed[closed['symbol'] == symbol]
+            if result.shares[result.panel.row(symbol), -1] == 0:
+                self.assertAlmostEqual(result.equity[result.panel.row(symbol), -1],
+                                       100000 + (rows['proceeds'] - rows['cost']).sum(), places=6)
+            wins = (rows['return'] > 0).mean()
+            self.assertAlmostEqual(result.stats.loc[symbol, 'win_rate'], wins)
+
+    def test_matrices(self):
+        panel = screener_instance.panel(self.symbols)
+        entries = np.zeros(panel.close.shape, np.bool_)
+        exits = np.zeros(panel.close.shape, np.bool_)
+        begin = int(np.searchsorted(panel.dates, '2021-08-02'))
+        entries[:, begin] = True  # 第二天开盘买入 一直持有
+        result = backtest(entries, exits, panel=panel, start='2021-08-02', fee=0, slippage=0)
+        row = panel.row(self.symbols[1])
+        held = math.floor(100000 / panel.open[row, begin + 1])
+        expected = 100000 - held * panel.open[row, begin + 1] + held * panel.close[row][panel.mask[row]][-1]  # 最后有K线的一天
+        self.assertAlmostEqual(result.equity[row, -1], expected, places=6)
+        self.assertEqual(result.portfolio['trades'], len(self.symbols))
+        self.assertTrue(np.isnan(result.portfolio['win_rate']))  # 都没有平仓
+
+        with self.assertRaises(ValueError):
+            backtest(entries, exits, self.symbols)  # 没有panel
+        with self.assertRaises(ValueError):
+            backtest(entries[:, 1:], exits[:, 1:], panel=panel)
+        with self.assertRaises(ValueError):
+            backtest(ENTRY, EXIT, self.symbols, start='2099-01-01')
+
+if __name__ == '__main__':
+    unittest.main()
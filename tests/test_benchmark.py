@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import json
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from benchmarks import bench
+from dto_enum import OHLCV
+from global_data import global_data_instance
+from synthetic import max_bars, synthetic_ohlcv
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def test_ohlcv(self):
+        df = synthetic_ohlcv(500, seed=1, start='2021-01-01')
+        self.assertEqual((df.index[0], df.index[-1]), ('2021-01-01', '2022-05-15'))
+        self.assertTrue((df['high'] >= df[['open', 'close']].max(axis=1)).all())
+        self.assertTrue((df['low'] <= df[['open', 'close']].min(axis=1)).all())
+        self.assertTrue((df['low'] > 0).all())
+        np.testing.assert_array_equal(synthetic_ohlcv(500, seed=1, start='2021-01-01')['close'], df['close'])  # 可重复
+        with self.assertRaises(ValueError):
+            synthetic_ohlcv(max_bars('9999-01-01') + 1, start='9999-01-01')
+
+    def test_put_data(self):
+        df = synthetic_ohlcv(100, start=global_data_instance.START_DOWNLOAD_DATE)
+        global_data_instance.put_data('BENCH.TEST', df)
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date('BENCH.TEST', OHLCV.CLOSE, ''), df['close'])
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run(self):
+        result = bench.run([300], repeat=1, log=lambda line: None)
+        json.dumps(result)
+        names = {(r['group'], r['name']) for r in result['results']}
+        self.assertEqual(names, {('kernel', name) for name in bench.KERNELS} | {('getter', name) for name in bench.GETTERS})
+        self.assertTrue(all(r['cold'] > 0 and r['warm'] > 0 for r in result['results']))
+
+        skipped = bench.bench_getters(10**7, 1, ['get_ma'])
+        self.assertIn('skipped', skipped[0])
+
+    def test_compare(self):
+        old = {'results': [{'group': 'kernel', 'name': 'calc_ma', 'size': 1000, 'cold': 1, 'warm': 1e-3}]}
+        new = {'results': [{'group': 'kernel', 'name': 'calc_ma', 'size': 1000, 'cold': 1, 'warm': 2e-3}]}
+        self.assertEqual(len(bench.compare(old, new)), 1)
+        self.assertEqual(bench.compare(new, old), [])
+
+if __name__ == '__main__':
+    unittest.main()
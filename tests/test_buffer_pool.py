@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import threading
+import tracemalloc
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from global_data import global_data_instance
+from indexes import cci_instance, dmi_instance, kdj_instance, macd_instance, mtm_instance, rsi_instance
+from indexes.base import (BufferPool, calc_avedev, calc_ema, calc_hhv, calc_llv, calc_ma, calc_sma, ref,
+                          sum_recent)
+from indexes.dmi import calc_mtr
+from synthetic import synthetic_arrays, synthetic_ohlcv
+
+
+class TestOut(unittest.TestCase):
+
+    def test_out_matches_new(self):
+        _, high, low, close, _ = synthetic_arrays(300, seed=1)
+        kernels = [
+            lambda out: calc_ma(close, 5, out), lambda out: calc_ema(close, 12, out), lambda out: calc_sma(close, 6, 1, out),
+            lambda out: calc_llv(low, 9, out), lambda out: calc_hhv(high, 9, out), lambda out: calc_avedev(close, 14, out),
+            lambda out: sum_recent(close, 14, out), lambda out: ref(close, 1, 0, out), lambda out: calc_mtr(high, low, close, 14, out),
+        ]
+        for i, compute in enumerate(kernels):
+            out = np.empty(300)
+            self.assertIs(compute(out), out, i)
+            np.testing.assert_array_equal(out, compute(None), i)
+            with self.assertRaises(AssertionError, msg=i):  # 长度不对
+                compute(np.empty(299))
+        ma = np.empty(300)
+        np.testing.assert_array_equal(calc_avedev(close, 14, None, ma), calc_avedev(close, 14))
+        np.testing.assert_array_equal(ma, calc_ma(close, 14))
+        np.testing.assert_array_equal(ref(close, 2, 100, np.empty(200)), ref(close, 2)[100:])
+
+
+class TestBufferPool(unittest.TestCase):
+
+    def test_reuse(self):
+        pool = BufferPool()
+        with pool.borrow(100, 2) as (a, b):
+            self.assertEqual((len(a), len(b)), (100, 100))
+            self.assertFalse(np.shares_memory(a, b))
+            with pool.borrow(50) as (c,):  # 嵌套借出的不会重叠
+                self.assertFalse(np.shares_memory(a, c) or np.shares_memory(b, c))
+            address = a.ctypes.data
+        with pool.borrow(90) as (d,):
+            self.assertIn(d.ctypes.data, (address, b.ctypes.data, c.ctypes.data))
+        with pool.borrow(10000) as (e,):  # 不够长时换掉最长的一个
+            self.assertEqual(len(e), 10000)
+        self.assertEqual(len(pool._free), 3)
+
+    def test_per_thread(self):
+        pool = BufferPool()
+        addresses = []
+        def borrow():
+            with pool.borrow(100) as (a,):
+                addresses.append(a.ctypes.data)
+        threads = [threading.Thread(target=borrow) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with pool.borrow(100) as (a,):
+            addresses.append(a.ctypes.data)
+        self.assertEqual(len(set(addresses)), 3)
+
+    def test_no_temporary_arrays(self):
+        """ 缓冲区借出过之后 重算各指标只分配缓存的序列本身 """
+        length = 20000
+        calls = [lambda symbol: kdj_instance._kdj_series(symbol, 9, 3), lambda symbol: rsi_instance._rsi_series(symbol, 6),
+                 lambda symbol: macd_instance._macd_series(symbol, 12, 26, 9), lambda symbol: cci_instance._cci_series(symbol, 14),
+                 lambda symbol: dmi_instance._dmi_series(symbol, 14), lambda symbol: mtm_instance._mtm_series(symbol, 12, 6)]
+        for i in range(2):
+            symbol = f'POOL.{i}'
+            global_data_instance.put_data(symbol, synthetic_ohlcv(length, seed=i, start='2021-01-01'))
+            for compute in calls:
+                tracemalloc.start()
+                try:
+                    compute(symbol)
+                    current, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                if i > 0:
+                    self.assertLess(peak - current, length * 8 // 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from global_data import global_data_instance
+from indexes import cci_instance, dmi_instance, kdj_instance, macd_instance, mtm_instance, rsi_instance
+from indexes.base import calc_hhv, calc_llv, calc_sma
+from indexes.formula import FormulaError, cache_dir, compile_formula
+from synthetic import synthetic_ohlcv
+
+SYMBOL = 'FORMULA.1'
+KDJ = '''RSV:=(CLOSE-LLV(LOW,N))/(HHV(HIGH,N)-LLV(LOW,N)+0.00000001)*100;
+         K:SMA(RSV,M,1); D:SMA(K,M,1); J:3*K-2*D;'''
+CCI = 'TYP:=(HIGH+LOW+CLOSE)/3; CCI:(TYP-MA(TYP,N))/(0.015*AVEDEV(TYP,N));'
+DMI = '''MTR:=SUM(MAX(MAX(HIGH-LOW,ABS(HIGH-REF(CLOSE,1))),ABS(REF(CLOSE,1)-LOW)),N);
+         HD:=HIGH-REF(HIGH,1); LD:=REF(LOW,1)-LOW;
+         DMP:=SUM(IF(HD>0 && HD>LD,HD,0),N); DMM:=SUM(IF(LD>0 && LD>HD,LD,0),N);
+         PDI:DMP*100/MTR; MDI:DMM*100/MTR;'''
+MACD = 'DIF:=EMA(CLOSE,SHORT)-EMA(CLOSE,LONG); DEA:=EMA(DIF,MID); MACD:(DIF-DEA)*2;'
+RSI = 'LC:=REF(CLOSE,1); RSI:SMA(MAX(CLOSE-LC,0),N,1)/(SMA(ABS(CLOSE-LC),N,1)+0.000001)*100;'
+MTM = 'MTM:=CLOSE-REF(CLOSE,N); MTMMA:MA(MTM,M);'
+
+
+class TestFormula(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        global_data_instance.put_data(SYMBOL, synthetic_ohlcv(300, seed=7, start='2021-01-01'))
+
+    def run_small(self, text, close, **params):
+        close = np.asarray(close, np.float64)
+        return compile_formula(text).run(close, close, close, close, close, **params)
+
+    def test_matches_getters(self):
+        result = compile_formula(KDJ).series(SYMBOL, N=9, M=3)
+        self.assertEqual(list(result), ['K', 'D', 'J'])
+        np.testing.assert_array_equal(result['J'], kdj_instance.get_kdj_range(SYMBOL, '', '9999-12-31', 9, 3))
+        np.testing.assert_array_equal(compile_formula(CCI).series(SYMBOL, N=14)['CCI'],
+                                      cci_instance.get_cci_range(SYMBOL, '', '9999-12-31', 14))
+        result = compile_formula(DMI).series(SYMBOL, N=14)
+        pdi, mdi = dmi_instance.get_dmi_range(SYMBOL, '', '9999-12-31', 14)
+        np.testing.assert_array_equal(result['PDI'], pdi)
+        np.testing.assert_array_equal(result['MDI'], mdi)
+        np.testing.assert_array_equal(compile_formula(MACD).series(SYMBOL, SHORT=12, LONG=26, MID=9)['MACD'],
+                                      macd_instance.get_macd_range(SYMBOL, '', '9999-12-31', 12, 26, 9))
+        np.testing.assert_array_equal(compile_formula(RSI).series(SYMBOL, N=6)['RSI'],
+                                      rsi_instance.get_rsi_range(SYMBOL, '', '9999-12-31', 6))
+        np.testing.assert_array_equal(compile_formula(MTM).series(SYMBOL, n=12, m=6)['MTMMA'],
+                                      mtm_instance.get_mtm_range(SYMBOL, '', '9999-12-31', 12, 6))
+
+    def test_flat_bars(self):
+        """ 价格不变(停牌、一字板)时分母为0 与numpy一样得到NaN/inf, 不抛出ZeroDivisionError """
+        close = np.concatenate([np.linspace(10, 12, 30), np.full(30, 12.0), np.linspace(12, 11, 30)])
+        kdj = '''RSV:=(CLOSE-LLV(LOW,N))/(HHV(HIGH,N)-LLV(LOW,N))*100;
+                 K:SMA(RSV,M,1); D:SMA(K,M,1); J:3*K-2*D;'''  # 即模块说明中的KDJ 分母不加0.00000001
+        result = compile_formula(kdj).run(close, close, close, close, close, N=9, M=3)
+        with np.errstate(all='ignore'):
+            rsv = (close - calc_llv(close, 9)) / (calc_hhv(close, 9) - calc_llv(close, 9)) * 100
+        k = calc_sma(rsv, 3, 1)
+        np.testing.assert_array_equal(result['K'], k)
+        np.testing.assert_array_equal(result['J'], 3 * k - 2 * calc_sma(k, 3, 1))
+        self.assertTrue(np.isnan(result['K'][40:]).all())
+        with np.errstate(all='ignore'):
+            np.testing.assert_array_equal(self.run_small('X:C/(C-C);', close)['X'], close / (close - close))
+
+    def test_cached_by_text(self):
+        formula = compile_formula(CCI)
+        self.assertIs(compile_formula(' typ := ( high+low+close ) / 3 ; {注释} cci : (typ-ma(typ,n))/(0.015*avedev(typ,n)) ;'), formula)
+        self.assertTrue(os.path.exists(os.path.join(cache_dir(), f'tdx_{formula.key}.py')))
+        self.assertIsNot(compile_formula(CCI.replace('0.015', '0.02')), formula)
+
+    def test_functions(self):
+        close = [1, 3, 2, 5, 4]
+        result = self.run_small('A:IF(C>2,C,-C); B:CROSS(C,3); X:MAX(C,3); Y:NOT(C>2); Z:REF(C,N+1);', close, N=1)
+        np.testing.assert_array_equal(result['A'], [-1, 3, -2, 5, 4])
+        np.testing.assert_array_equal(result['B'], [0, 0, 0, 1, 0])
+        np.testing.assert_array_equal(result['X'], [3, 3, 3, 5, 4])
+        np.testing.assert_array_equal(result['Y'], [1, 0, 1, 0, 0])
+        np.testing.assert_array_equal(result['Z'], [np.nan, np.nan, 1, 3, 2])
+        result = self.run_small('LO:LLV(C,3); HI:HHV(C,3); S:SUM(C,2);', close)  # 不够n天时LLV、HHV取已有的K线
+        np.testing.assert_array_equal(result['LO'], [1, 1, 1, 2, 2])
+        np.testing.assert_array_equal(result['HI'], [1, 3, 3, 5, 5])
+        np.testing.assert_array_equal(result['S'], [np.nan, 4, 5, 7, 9])
+
+    def test_errors(self):
+        for text in ('X:FOO(C,1);', 'X:(C+1;', 'X:MA(C);', 'X:MA(C,C);', 'X:=C;', 'X:C; X:C;', 'CLOSE:C;', 'X:C $ 1;'):
+            with self.assertRaises(FormulaError, msg=text):
+                compile_formula(text)
+        with self.assertRaises(TypeError):
+            self.run_small('X:MA(C,N);', [1.0, 2.0])
+        with self.assertRaises(ValueError):
+            self.run_small('X:MA(C,N);', [1.0, 2.0], N=0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from dto_enum import OHLCV
+from futu_pool import QuoteContextPool
+from global_data import global_data_instance
+from rate_limit import TokenBucket
+
+
+class FakeQuoteContext:
+    """ 模拟OpenQuoteContext.request_history_kline的分页 page_req_key为下一页的起始位置 """
+    created = 0
+
+    def __init__(self, df=None):
+        FakeQuoteContext.created += 1
+        self.df = df
+        self.closed = False
+        self.requests = []
+
+    def request_history_kline(self, code, start=None, end=None, max_count=1000, page_req_key=None):
+        assert not self.closed
+        begin = page_req_key or 0
+        self.requests.append((code, start, begin, max_count))
+        page = self.df.iloc[begin:begin+max_count].copy()
+        next_key = begin + max_count if begin + max_count < len(self.df) else None
+        return 0, page, next_key
+
+    def close(self):
+        self.closed = True
+
+
+class TestQuoteContextPool(unittest.TestCase):
+
+    def test_reuse(self):
+        contexts = []
+        pool = QuoteContextPool(lambda: contexts.append(FakeQuoteContext()) or contexts[-1], size=2)
+        for _ in range(3):
+            with pool.connection() as ctx:
+                self.assertIs(ctx, contexts[0])
+        self.assertEqual(len(pool), 1)
+
+        with self.assertRaises(ValueError):
+            with pool.connection() as ctx:
+                raise ValueError  # 出错的连接不再放回
+        self.assertTrue(contexts[0].closed)
+        self.assertEqual(len(pool), 0)
+        with pool.connection() as ctx:
+            self.assertIs(ctx, contexts[1])
+
+        pool.close()
+        self.assertTrue(contexts[1].closed)
+
+    def test_size_limit(self):
+        pool = QuoteContextPool(FakeQuoteContext, size=2)
+        running, max_running, lock = [0], [0], threading.Lock()
+        def work():
+            with pool.connection():
+                with lock:
+                    running[0] += 1
+                    max_running[0] = max(max_running[0], running[0])
+                time.sleep(0.02)
+                with lock:
+                    running[0] -= 1
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max_running[0], 2)
+        self.assertEqual(len(pool), 2)
+
+
+class TestPagedKline(unittest.TestCase):
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range('2021-01-04', periods=25)]
+    close = np.arange(25, dtype=np.float64)
+
+    def setUp(self):
+        df = pd.DataFrame({'code': 'SZ.999801', 'time_key': [d + ' 00:00:00' for d in self.dates], 'open': self.close,
+                           'close': self.close, 'high': self.close, 'low': self.close, 'volume': self.close, 'turnover': self.close})
+        self.ctx = FakeQuoteContext(df)
+        self.pool = QuoteContextPool(lambda: self.ctx)
+
+    def patches(self):
+        return (mock.patch.object(global_data_instance, '_futu_pool', self.pool),
+                mock.patch.object(global_data_instance, '_futu_page_size', 10),
+                mock.patch.dict(global_data_instance._rate_limiters, {'futu': TokenBucket(1000, 100)}))
+
+    def test_pages(self):
+        ctx, pool, dates, close = self.ctx, self.pool, self.dates, self.close
+        pool_patch, size_patch, rate_patch = self.patches()
+        with pool_patch, size_patch, rate_patch:
+            pages = list(global_data_instance._get_data_from_futu_opend('SZ.999801', '2021-01-01'))
+            list(global_data_instance._get_data_from_futu_opend('SZ.999801', '2021-01-01'))
+        self.assertEqual([r[2] for r in ctx.requests], [0, 10, 20] * 2)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        result = pd.concat(pages)
+        self.assertEqual(list(result.index), dates)
+        self.assertEqual(list(result.columns), ['open', 'high', 'low', 'close', 'volume'])
+        np.testing.assert_array_equal(result['close'], close)
+        self.assertEqual(len(pool), 1)
+        self.assertFalse(ctx.closed)
+
+    def test_add_data_pages(self):
+        """ 全部页下载完成后一次替换 每列只合并一次, 不把所有页合并成一个DataFrame """
+        symbol = 'SZ.999801'
+        version = global_data_instance.data_version(symbol)
+        pool_patch, size_patch, rate_patch = self.patches()
+        with pool_patch, size_patch, rate_patch, mock.patch('global_data.pd.concat', side_effect=AssertionError('concat')):
+            global_data_instance.add_data(symbol, '2021-01-01')
+        self.assertEqual(global_data_instance.data_version(symbol), version + 1)
+        self.assertEqual(global_data_instance.symbol_to_date_list[symbol], self.dates)
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, ''), self.close)
+
+    def test_failed_download_keeps_data(self):
+        """ 重试全部失败时已有的数据不变 不会只剩下已收到的几页 """
+        symbol = 'SZ.999803'
+        old = pd.DataFrame({column: np.arange(3.0) for column in ('open', 'high', 'low', 'close', 'volume')}, index=self.dates[:3])
+        global_data_instance.put_data(symbol, old)
+        version = global_data_instance.data_version(symbol)
+        replaced = []
+        global_data_instance.add_replace_listener(replaced.append)
+        self.addCleanup(global_data_instance._replace_listeners.remove, replaced.append)
+        def fetch(symbol, start):
+            yield old.iloc[:1] * 2
+            raise RuntimeError('connection lost')
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', fetch), \
+                mock.patch.object(global_data_instance, '_download_retries', 1), \
+                mock.patch.object(global_data_instance, '_download_backoff', 0), \
+                mock.patch.dict(global_data_instance._rate_limiters, {'futu': TokenBucket(1000, 100)}):
+            with self.assertRaises(RuntimeError):
+                global_data_instance.add_data(symbol, '2021-01-01')
+        self.assertEqual(global_data_instance.data_version(symbol), version)
+        self.assertEqual(replaced, [])
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, ''), old['close'])
+
+    def test_retry_resumes(self):
+        """ 翻页时出错 重试从已收到的最后一天接着下载 已收到的页不重复 """
+        symbol = 'SZ.999802'
+        frame = pd.DataFrame({'open': self.close, 'high': self.close, 'low': self.close, 'close': self.close,
+                              'volume': self.close}, index=self.dates)
+        starts = []
+        def fetch(symbol, start):
+            starts.append(start)
+            pages = frame[frame.index >= start]
+            yield pages.iloc[:10]
+            if len(starts) == 1:
+                raise RuntimeError('connection lost')
+            yield pages.iloc[10:]
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', fetch), \
+                mock.patch.object(global_data_instance, '_download_backoff', 0), \
+                mock.patch.dict(global_data_instance._rate_limiters, {'futu': TokenBucket(1000, 100)}):
+            global_data_instance.add_data(symbol, '2021-01-01')
+        self.assertEqual(starts, ['2021-01-01', self.dates[9]])
+        self.assertEqual(global_data_instance.symbol_to_date_list[symbol], self.dates)
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, ''), self.close)
+
+if __name__ == '__main__':
+    unittest.main()
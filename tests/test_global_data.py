@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from dto_enum import OHLCV
+from global_data import global_data_instance
+
+
+def make_frame(dates, close):
+    close = np.asarray(close, dtype=np.float64)
+    return pd.DataFrame({'open': close, 'close': close, 'high': close, 'low': close, 'volume': np.ones(len(close))}, index=dates)
+
+
+class TestDateIndex(unittest.TestCase):
+    symbol = 'SZ.999903'
+    dates = ['2021-01-04', '2021-01-05', '2021-01-06', '2021-01-08', '2021-01-11', '2021-01-12']
+
+    def download(self, df):
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', return_value=df):
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE)
+
+    def setUp(self):
+        self.download(make_frame(self.dates, range(6)))
+
+    def test_find_date_offset(self):
+        self.assertEqual(global_data_instance.get_date_index(self.symbol).dtype, np.dtype('datetime64[D]'))
+        self.assertEqual(global_data_instance.find_date_offset(self.symbol, '2021-01-06'), 2)
+        self.assertEqual(global_data_instance.find_date_offset(self.symbol, '2021-01-07'), 3)  # 非交易日取其后第一个交易日
+        self.assertEqual(global_data_instance.find_date_offset(self.symbol, '2021-01-09'), 4)
+        self.assertEqual(global_data_instance.find_date_offset(self.symbol, '2020-12-31'), 0)
+        self.assertEqual(global_data_instance.find_date_offset(self.symbol, '2021-02-01'), 5)
+
+    def test_find_date_offsets(self):
+        offsets = global_data_instance.find_date_offsets(self.symbol, ['2021-01-12', '2021-01-07', '2021-01-04', '2021-02-01'])
+        np.testing.assert_array_equal(offsets, [5, -1, 0, -1])
+        self.assertEqual(global_data_instance.find_date_range(self.symbol, '2021-01-07', '2021-01-10'), (3, 4))
+        self.assertEqual(global_data_instance.find_date_range(self.symbol, '', '9999-12-31'), (0, 6))
+
+    def test_caches_follow_data_changes(self):
+        version = global_data_instance.data_version(self.symbol)
+        since = global_data_instance.get_array_since_date(self.symbol, OHLCV.CLOSE, '2021-01-07')
+        np.testing.assert_array_equal(since, [3, 4, 5])
+
+        self.download(make_frame(self.dates, range(10, 16)))  # 重新下载 例如复权后价格变化
+        self.assertGreater(global_data_instance.data_version(self.symbol), version)
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date(self.symbol, OHLCV.CLOSE, '2021-01-07'), [13, 14, 15])
+
+        global_data_instance.append_data(self.symbol, make_frame(['2021-01-13'], [16]))
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date(self.symbol, OHLCV.CLOSE, '2021-01-07'), [13, 14, 15, 16])
+        self.assertEqual(global_data_instance.find_date_offset(self.symbol, '2021-01-13'), 6)
+        self.assertEqual(list(global_data_instance.get_dates_since_date(self.symbol, '2021-01-12')), ['2021-01-12', '2021-01-13'])
+
+
+class TestUpdateData(unittest.TestCase):
+    symbol = 'SZ.999905'
+    dates = ['2021-01-04', '2021-01-05', '2021-01-06', '2021-01-07', '2021-01-08']
+
+    def setUp(self):
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', return_value=make_frame(self.dates[:3], range(3))):
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE)
+
+    def test_download_delta_only(self):
+        replaced = []
+        global_data_instance.add_replace_listener(replaced.append)
+        self.addCleanup(global_data_instance._replace_listeners.remove, replaced.append)
+        version = global_data_instance.data_version(self.symbol)
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', return_value=make_frame(self.dates[2:], range(2, 5))) as download:
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE, update=True)
+        download.assert_called_once_with(self.symbol, '2021-01-06')  # 从已有的最后一天开始
+        self.assertEqual(global_data_instance.symbol_to_date_list[self.symbol], self.dates)
+        self.assertEqual(global_data_instance.find_date_offset(self.symbol, '2021-01-08'), 4)
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date(self.symbol, OHLCV.CLOSE, ''), range(5))
+        self.assertEqual(global_data_instance.data_version(self.symbol), version + 1)
+        self.assertNotIn(self.symbol, replaced)
+
+    def test_adjusted_downloads_all(self):
+        adjusted = make_frame(self.dates, np.arange(5) * 0.9)  # 复权后之前的价格都变了
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', side_effect=lambda symbol, start: adjusted[adjusted.index >= start]) as download:
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE, update=True)
+        self.assertEqual([c.args[1] for c in download.call_args_list], ['2021-01-06', global_data_instance.START_DOWNLOAD_DATE])
+        np.testing.assert_array_equal(global_data_instance.get_array_since_date(self.symbol, OHLCV.CLOSE, ''), adjusted['close'])
+
+    def test_no_pages(self):
+        """ 更新时一页也没有收到 与没有新K线一样按数据有变化处理, 重新下载全部 """
+        full = make_frame(self.dates, range(5))
+        def fetch(symbol, start):
+            if start != global_data_instance.START_DOWNLOAD_DATE:
+                return iter([])
+            return full
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', side_effect=fetch):
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE, update=True)
+        self.assertEqual(global_data_instance.symbol_to_date_list[self.symbol], self.dates)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from dto_enum import OHLCV
+from global_data import global_data_instance
+from indexes import dmi_instance, kdj_instance, rsi_instance
+from indexes.base import calc_ema, calc_llv
+from indexes.dmi import calc_mtr
+from indexes.graph import graph_instance, typ_into
+from memo import Memo, MemoStore
+
+
+def make_frame(length, start, seed):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, length))
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start, periods=length)]
+    return pd.DataFrame({'open': close, 'close': close, 'high': close + rng.random(length) * 0.2,
+                         'low': close - rng.random(length) * 0.2, 'volume': np.ones(length)}, index=dates)
+
+
+class TestGraph(unittest.TestCase):
+    symbol = 'SZ.999901'
+
+    def setUp(self):
+        self.df = make_frame(300, '2021-01-04', 0)
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', return_value=self.df):
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE)
+
+    def test_nodes(self):
+        close, high, low = self.df['close'].to_numpy(), self.df['high'].to_numpy(), self.df['low'].to_numpy()
+        np.testing.assert_array_equal(graph_instance.series(self.symbol, ('ema', OHLCV.CLOSE, 12)), calc_ema(close, 12))
+        np.testing.assert_array_equal(graph_instance.series(self.symbol, ('llv', OHLCV.LOW, 9)), calc_llv(low, 9))
+        np.testing.assert_array_equal(graph_instance.series(self.symbol, ('sum', ('tr',), 14)), calc_mtr(high, low, close, 14))
+        delta = graph_instance.series(self.symbol, ('delta', OHLCV.CLOSE, 1))
+        self.assertTrue(np.isnan(delta[0]))
+        np.testing.assert_array_equal(delta[1:], close[1:] - close[:-1])
+
+    def test_shared_across_indicators(self):
+        """ 不同指标/不同参数用到的相同节点只计算一次 """
+        memo = graph_instance.computed_memo
+        date = self.df.index[-1]
+        kdj_instance.get_kdj(self.symbol, date, 9, 3)
+        llv = memo.get(self.symbol, ('llv', OHLCV.LOW, 9))
+        kdj_instance.get_kdj(self.symbol, date, 9, 5)
+        self.assertIs(memo.get(self.symbol, ('llv', OHLCV.LOW, 9)), llv)
+
+        rsi_instance.get_rsi(self.symbol, date, 6)
+        dmi_instance.get_dmi(self.symbol, date, 14)
+        dmi_instance.get_dmi(self.symbol, date, 20)
+        tr = memo.get(self.symbol, ('tr',))
+        dmi_instance.get_dmi(self.symbol, date, 30)
+        self.assertIs(memo.get(self.symbol, ('tr',)), tr)
+        self.assertTrue(memo.contains(self.symbol, ('delta', OHLCV.CLOSE, 1)))
+
+    def test_replaced_data_invalidates(self):
+        graph_instance.series(self.symbol, ('ema', OHLCV.CLOSE, 12))
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', return_value=make_frame(300, '2021-01-04', 1)):
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE)
+        self.assertFalse(graph_instance.computed_memo.contains(self.symbol, ('ema', OHLCV.CLOSE, 12)))
+
+    def test_persist(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = MemoStore(temp_dir, global_data_instance.data_fingerprint)
+            node = ('ma', ('typ',), 14)
+            with mock.patch.object(graph_instance, 'computed_memo', Memo('Graph', store=store)):
+                expected = graph_instance.series(self.symbol, node).copy()
+                graph_instance.computed_memo.save()
+
+            appended = make_frame(301, '2021-01-04', 0).iloc[-1:]
+            global_data_instance.append_data(self.symbol, appended)
+            restarted = Memo('Graph', store=MemoStore(temp_dir, global_data_instance.data_fingerprint))  # 模拟重启
+            with mock.patch.object(graph_instance, 'computed_memo', restarted), \
+                    mock.patch('indexes.graph.typ_into', wraps=typ_into) as typ:
+                series = graph_instance.series(self.symbol, node)
+            self.assertEqual([c.args[-1] for c in typ.call_args_list], [300])  # 保存的TYP仍然有效 只计算新增的一天
+            self.assertEqual(restarted.stats()['loads'], 2)  # MA(TYP,14)与TYP都从文件载入
+            np.testing.assert_array_equal(series[:300], expected)
+            high, low, close = (graph_instance.series(self.symbol, column) for column in (OHLCV.HIGH, OHLCV.LOW, OHLCV.CLOSE))
+            self.assertAlmostEqual(series[-1], ((high + low + close) / 3)[-14:].mean())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from indexes.base import calc_ema, calc_llv, calc_hhv, calc_ma, calc_sma, ref
+from indexes.grid import calc_kdj_grid, calc_ma_grid, calc_macd_grid, calc_rsi_grid
+
+
+class TestGrid(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.close = 10 + np.cumsum(rng.normal(0, 0.2, 400))
+        self.high = self.close + np.abs(rng.normal(0, 0.1, 400))
+        self.low = self.close - np.abs(rng.normal(0, 0.1, 400))
+
+    def test_ma_grid(self):
+        grid = calc_ma_grid(self.close, np.array([5, 20, 500]))
+        np.testing.assert_array_equal(grid[0], calc_ma(self.close, 5))
+        np.testing.assert_array_equal(grid[1], calc_ma(self.close, 20))
+        self.assertTrue(np.isnan(grid[2]).all())  # 数据不够500天
+
+    def test_ma_grid_nan(self):
+        close = self.close.copy()
+        close[10] = np.nan  # 停牌等原因缺一天的数据 窗口滑过之后应恢复
+        grid = calc_ma_grid(close, np.array([5, 20]))
+        np.testing.assert_array_equal(grid[0], calc_ma(close, 5))
+        np.testing.assert_array_equal(grid[1], calc_ma(close, 20))
+        self.assertTrue(np.isnan(grid[1, 10:30]).all())
+        self.assertTrue(np.isfinite(grid[1, 30:]).all())
+
+    def test_macd_grid(self):
+        grid = calc_macd_grid(self.close, np.array([9, 12, 26]), np.array([0, 1]), np.array([2, 2]), np.array([9, 7]))
+        dif = calc_ema(self.close, 12) - calc_ema(self.close, 26)
+        np.testing.assert_array_equal(grid[1], (dif - calc_ema(dif, 7)) * 2)
+
+    def test_rsi_grid(self):
+        grid = calc_rsi_grid(self.close, np.array([6, 12]))
+        lc = ref(self.close, 1)
+        rsi = calc_sma(np.maximum(self.close-lc, 0), 12, 1) / (calc_sma(np.abs(self.close-lc), 12, 1) + 1e-6) * 100
+        np.testing.assert_array_equal(grid[1], rsi)
+
+    def test_kdj_grid(self):
+        grid = calc_kdj_grid(self.close, self.high, self.low, np.array([9]), np.array([0]), np.array([3]))
+        llv, hhv = calc_llv(self.low, 9), calc_hhv(self.high, 9)
+        k = calc_sma((self.close - llv) / (hhv - llv + 0.00000001) * 100, 3, 1)
+        np.testing.assert_array_equal(grid[0], 3 * k - 2 * calc_sma(k, 3, 1))
+
+if __name__ == '__main__':
+    unittest.main()
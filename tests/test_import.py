@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+from trade_calendar import TradeCalendar
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 屏蔽各数据源与网络后import 任何一个被import或访问网络都会报错
+OFFLINE_IMPORT = """
+import socket, sys, time
+for name in ('futu', 'tushare', 'yfinance', 'requests'):
+    sys.modules[name] = None
+def no_network(*args, **kwargs):
+    raise AssertionError('network access at import time')
+socket.socket.connect = no_network
+socket.create_connection = no_network
+begin = time.perf_counter()
+from indexes import *
+import demo
+print(time.perf_counter() - begin)
+"""
+
+
+class TestOfflineImport(unittest.TestCase):
+
+    def test_import_without_providers(self):
+        result = subprocess.run([sys.executable, '-c', OFFLINE_IMPORT], cwd=PACKAGE_DIR, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertLess(float(result.stdout.split()[-1]), 5)
+
+    def test_parallel_modules_lazy(self):
+        """ 只用get_xxx时不import(编译)Panel、参数扫描等并行核心 """
+        code = ('import sys, indexes; from indexes import *\n'
+                'print(sorted(name for name in sys.modules if name in ("indexes.panel", "indexes.grid", "indexes.screener")))\n'
+                'print(indexes.Panel.__module__, type(indexes.screener_instance).__name__)')
+        result = subprocess.run([sys.executable, '-c', code], cwd=PACKAGE_DIR, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.splitlines(), ['[]', 'indexes.panel Screener'])
+
+
+class TestTradeCalendar(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, 'trade_calendar.json')
+        self.fetched = 0
+
+    def fetch(self):
+        self.fetched += 1
+        return ['2021-01-04', '2021-01-05']
+
+    def test_disk_cache(self):
+        self.assertEqual(TradeCalendar(self.path, 3600, self.fetch).newest_trade_date(), '2021-01-05')
+        self.assertEqual(TradeCalendar(self.path, 3600, self.fetch).newest_trade_date(), '2021-01-05')  # 新进程读取缓存文件
+        self.assertEqual(self.fetched, 1)
+
+        with open(self.path, 'w', encoding='utf-8') as f:  # 过期
+            json.dump({'fetched': time.time() - 7200, 'dates': ['2021-01-04']}, f)
+        self.assertEqual(TradeCalendar(self.path, 3600, self.fetch).newest_trade_date(), '2021-01-05')
+        self.assertEqual(self.fetched, 2)
+
+    def test_stale_cache_when_offline(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'fetched': time.time() - 7200, 'dates': ['2021-01-04']}, f)
+        def offline():
+            raise ConnectionError
+        self.assertEqual(TradeCalendar(self.path, 3600, offline).newest_trade_date(), '2021-01-04')
+        os.remove(self.path)
+        with self.assertRaises(ConnectionError):
+            TradeCalendar(self.path, 3600, offline).dates()
+
+if __name__ == '__main__':
+    unittest.main()
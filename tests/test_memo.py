@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from memo import Memo, MemoryBudget, MemoStore, memo_stats
+
+
+class TestMemo(unittest.TestCase):
+    def setUp(self):
+        self.budget = MemoryBudget(3 * 800)  # 最多容纳3个长度100的float64数组
+        self.memo = Memo('test', self.budget)
+
+    def test_lookup_and_stats(self):
+        self.assertIsNone(self.memo.lookup('SZ.000001', ('ma', 5)))
+        self.memo.set('SZ.000001', ('ma', 5), np.ones(100))
+        self.assertEqual(self.memo.lookup('SZ.000001', ('ma', 5))[0], 1)
+        self.assertFalse(self.memo.contains('SZ.000001', ('ma', 10)))
+        stats = self.memo.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries'], stats['resident_bytes']), (1, 1, 1, 800))
+        Memo('test-stats', self.budget).set('SZ.000001', ('rsi', 6), np.ones(10))
+        self.assertEqual(memo_stats()['test-stats']['entries'], 1)  # 按名称汇总
+
+    def test_evict_least_recently_used(self):
+        for n in (5, 10, 20):
+            self.memo.set('SZ.000001', ('ma', n), np.ones(100))
+        self.memo.lookup('SZ.000001', ('ma', 5))  # ma5最近被使用过 应淘汰ma10
+        self.memo.set('SZ.000001', ('ma', 60), np.ones(100))
+        self.assertTrue(self.memo.contains('SZ.000001', ('ma', 5)))
+        self.assertFalse(self.memo.contains('SZ.000001', ('ma', 10)))
+        self.assertEqual(self.memo.evictions, 1)
+        self.assertEqual(self.budget.resident_bytes, 3 * 800)
+
+    def test_shared_budget(self):
+        other = Memo('other', self.budget)
+        self.memo.set('SZ.000001', ('ma', 5), np.ones(100))
+        other.set('SZ.000001', ('rsi', 6), np.ones(300))  # 超出预算 淘汰另一个Memo中的数组
+        self.assertFalse(self.memo.contains('SZ.000001', ('ma', 5)))
+        self.assertEqual(self.budget.resident_bytes, 2400)
+
+    def test_view_counts_whole_buffer(self):
+        buffer = np.empty(200)
+        self.memo.set('SZ.000001', ('ma', 5), buffer[:100])  # 预留了容量的数组按整个缓冲区计算
+        self.assertEqual(self.memo.resident_bytes, 1600)
+
+    def test_remove_symbol(self):
+        self.memo.set('SZ.000001', ('ma', 5), np.ones(100))
+        self.memo.set('SZ.000002', ('ma', 5), np.ones(100))
+        self.memo.remove_symbol('SZ.000001')
+        self.assertFalse(self.memo.contains('SZ.000001', ('ma', 5)))
+        self.assertTrue(self.memo.contains('SZ.000002', ('ma', 5)))
+        self.assertEqual(self.budget.resident_bytes, 800)
+
+
+class TestMemoStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.data = {'SZ.000001': np.arange(100.0)}  # 假的K线数据 指纹只与前L根有关
+        self.store = MemoStore(self.temp_dir.name, self.fingerprint)
+
+    def fingerprint(self, symbol, length):
+        data = self.data[symbol]
+        return f'{length}-{hash(data[:length].tobytes())}' if length <= len(data) else None
+
+    def test_round_trip(self):
+        memo = Memo('test-store', MemoryBudget(10**6), self.store)
+        memo.set('SZ.000001', ('ma', 5), np.ones(100))
+        memo.set('SZ.000001', ('ma', ('typ',), 10), np.full(100, 2.0))
+        memo.save()
+
+        restarted = Memo('test-store', MemoryBudget(10**6), MemoStore(self.temp_dir.name, self.fingerprint))  # 模拟重启
+        np.testing.assert_array_equal(restarted.lookup('SZ.000001', ('ma', 5)), np.ones(100))
+        np.testing.assert_array_equal(restarted.lookup('SZ.000001', ('ma', ('typ',), 10)), np.full(100, 2.0))
+        self.assertIsNone(restarted.lookup('SZ.000001', ('ma', 10)))
+        self.assertEqual(restarted.stats()['loads'], 2)
+        self.assertIsNone(Memo('other-name', MemoryBudget(10**6), self.store).lookup('SZ.000001', ('ma', 5)))
+
+    def test_fingerprint(self):
+        memo = Memo('test-store', MemoryBudget(10**6), self.store)
+        memo.set('SZ.000001', ('ma', 5), np.ones(100))
+        memo.save()
+
+        self.data['SZ.000001'] = np.arange(101.0)  # 追加一根K线 前100根不变 仍可载入
+        appended = Memo('test-store', MemoryBudget(10**6), MemoStore(self.temp_dir.name, self.fingerprint))
+        self.assertEqual(len(appended.lookup('SZ.000001', ('ma', 5))), 100)
+
+        self.data['SZ.000001'] = np.arange(101.0) * 0.9  # 复权 已有数据改变
+        adjusted = Memo('test-store', MemoryBudget(10**6), MemoStore(self.temp_dir.name, self.fingerprint))
+        self.assertIsNone(adjusted.lookup('SZ.000001', ('ma', 5)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+from global_data import global_data_instance
+from indexes import ma_instance
+from metrics import Metrics, metrics_instance
+from synthetic import synthetic_ohlcv
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_disabled(self):
+        with self.metrics.timer('compute', index='MA'):
+            pass
+        self.metrics.inc('download_bytes', 100, provider='futu')
+        snapshot = self.metrics.snapshot()
+        self.assertEqual((snapshot['counters'], snapshot['timings']), ({}, {}))
+
+    def test_snapshot_and_prometheus(self):
+        self.metrics.enable()
+        for seconds in (0.5, 1.5):
+            self.metrics.observe('download', seconds, provider='futu')
+        self.metrics.count_lookup('date_index', True)
+        self.metrics.count_lookup('date_index', False)
+        self.metrics.count_lookup('date_index', True)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['timings']['download'], [{'labels': {'provider': 'futu'}, 'count': 2, 'sum': 2.0, 'max': 1.5}])
+        self.assertIn({'labels': {'cache': 'date_index', 'result': 'hit'}, 'value': 2}, snapshot['counters']['lookup'])
+
+        text = self.metrics.prometheus()
+        self.assertIn('# TYPE tic_download_seconds summary\n', text)
+        self.assertIn('tic_download_seconds_count{provider="futu"} 2\n', text)
+        self.assertIn('tic_download_seconds_sum{provider="futu"} 2.0\n', text)
+        self.assertIn('tic_lookup_total{cache="date_index",result="miss"} 1\n', text)
+        self.assertIn('# TYPE tic_memo_resident_bytes gauge\n', text)
+
+    def test_sentry_span(self):
+        self.metrics.enable(sentry=True)
+        with mock.patch('sentry_sdk.start_span') as start_span:
+            with self.metrics.timer('compute', index='MA'):
+                pass
+        start_span.assert_called_once_with(op='compute', description='index=MA')
+        self.assertEqual(self.metrics.snapshot()['timings']['compute'][0]['count'], 1)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        metrics_instance.reset()
+        metrics_instance.enable()
+        self.addCleanup(metrics_instance.disable)
+        self.addCleanup(metrics_instance.reset)
+
+    def test_compute_and_lookup(self):
+        df = synthetic_ohlcv(300, start=global_data_instance.START_DOWNLOAD_DATE)
+        global_data_instance.put_data('METRICS.TEST', df)
+        ma_instance.get_ma('METRICS.TEST', df.index[-1], 5)
+        ma_instance.get_ma('METRICS.TEST', df.index[-1], 5)  # 第二次命中缓存 不再计算
+        global_data_instance.append_data('METRICS.TEST', synthetic_ohlcv(301, start=global_data_instance.START_DOWNLOAD_DATE).iloc[300:])
+        ma_instance.get_ma('METRICS.TEST', '9999-12-31', 5)
+
+        snapshot = metrics_instance.snapshot()
+        modes = {s['labels']['mode']: s['count'] for s in snapshot['timings']['compute']
+                 if s['labels']['index'] == 'Graph' and s['labels']['series'] == 'ma'}  # MA保存在计算图中
+        self.assertEqual(modes, {'full': 1, 'append': 1})
+        lookups = {(s['labels']['cache'], s['labels']['result']): s['value'] for s in snapshot['counters']['lookup']}
+        self.assertGreater(lookups[('array_since_date', 'hit')], 0)
+        self.assertGreater(snapshot['memo']['Graph']['hits'], 0)
+
+    def test_download(self):
+        df = synthetic_ohlcv(10)
+        with mock.patch.object(global_data_instance, '_get_data_from_yfinance', return_value=df):
+            global_data_instance._download('US.METRICS', '2000-01-01', lambda page: None)
+        snapshot = metrics_instance.snapshot()
+        self.assertEqual(snapshot['timings']['download'][0]['labels'], {'provider': 'yfinance'})
+        counters = {name: samples[0]['value'] for name, samples in snapshot['counters'].items() if name.startswith('download')}
+        self.assertEqual(counters, {'download_bytes': df.memory_usage().sum(), 'download_bars': 10})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from global_data import global_data_instance
+from indexes import panel as panel_module
+from indexes.backtest import backtest
+from indexes.screener import screener_instance
+from optimizer import candidates, optimize, windows
+from synthetic import synthetic_ohlcv
+
+ENTRY = 'macd({short},{long},9) > 0 and kdj({n},3) < {low}'
+EXIT = 'kdj({n},3) > 90'
+PARAMS = {'short': [8, 12], 'long': [26], 'n': [9, 14], 'low': [10, 30]}
+
+
+class TestOptimizer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.symbols = [f'OPTIMIZE.{i}' for i in range(9)]
+        for i, symbol in enumerate(cls.symbols):
+            global_data_instance.put_data(symbol, synthetic_ohlcv(320, seed=40 + i, start='2021-01-01'))
+
+    def test_candidates(self):
+        grid = candidates(PARAMS)
+        self.assertEqual(len(grid), 8)
+        self.assertEqual(grid[0], {'short': 8, 'long': 26, 'n': 9, 'low': 10})
+        sample = candidates(PARAMS, 'random', samples=3, seed=1)
+        self.assertEqual(len(sample), 3)
+        self.assertEqual(sample, candidates(PARAMS, 'random', samples=3, seed=1))
+        self.assertTrue(all(candidate in grid for candidate in sample))
+        self.assertEqual(len(candidates(PARAMS, 'random', samples=100)), 8)
+        with self.assertRaises(ValueError):
+            candidates(PARAMS, 'bayes')
+
+    def test_windows(self):
+        dates = np.array([f'd{i:02d}' for i in range(10)])
+        self.assertEqual(windows(dates, 4, 2), [('d00', 'd03', 'd04', 'd05'), ('d02', 'd05', 'd06', 'd07'),
+                                                ('d04', 'd07', 'd08', 'd09')])
+        self.assertEqual(len(windows(dates, 4, 2, step=1)), 5)
+        with self.assertRaises(ValueError):
+            windows(dates, 8, 3)
+
+    def test_grid(self):
+        panel = screener_instance.panel(self.symbols)
+        panel.forget([key for key in list(panel._computed) if key[0] in ('macd', 'kdj')])
+        with mock.patch.object(panel_module, 'panel_kdj_rsv', wraps=panel_module.panel_kdj_rsv) as kdj, \
+                mock.patch.object(panel_module, 'panel_macd_ema', wraps=panel_module.panel_macd_ema) as macd:
+            result = optimize(ENTRY, EXIT, PARAMS, self.symbols, train=60, test=30, fee=0.001)
+        self.assertEqual((kdj.call_count, macd.call_count), (2, 2))  # 每个不同的指标矩阵只算一次
+        table = result.table
+        self.assertEqual(len(table), 8)
+        self.assertEqual(list(table.columns), ['short', 'long', 'n', 'low', 'train_sharpe', 'test_sharpe', 'test_return', 'selected'])
+        ranking = list(zip(table['selected'], table['train_sharpe'].fillna(-np.inf)))
+        self.assertEqual(ranking, sorted(ranking, reverse=True))  # 只按训练段排名
+
+        self.assertIs(screener_instance.panel(self.symbols), panel)
+        keys = set(panel._computed)  # 各候选共用的中间结果保留 各自的指标矩阵已删除
+        self.assertTrue({('ema', 8), ('ema', 12), ('ema', 26), ('rsv', 9), ('rsv', 14)} <= keys)
+        self.assertFalse(any(key[0] in ('macd', 'kdj') for key in keys))
+        dates = panel.dates[np.searchsorted(panel.dates, global_data_instance.START_DECISION_DATE):]
+        folds = windows(dates, 60, 30)
+        self.assertEqual(table['selected'].sum(), len(folds))
+        self.assertEqual(len(result.windows), len(folds))
+        for fold, window in zip(folds, result.windows.itertuples()):  # 每段选出训练得分最高的参数, 在随后的检验段评估
+            self.assertEqual((window.train_start, window.train_end, window.test_start, window.test_end), fold)
+            chosen = {name: int(getattr(window, name)) for name in PARAMS}
+            check = backtest(ENTRY.format(**chosen), EXIT.format(**chosen), panel=panel, start=fold[2], end=fold[3], fee=0.001)
+            np.testing.assert_equal(window.test_sharpe, check.portfolio['sharpe'])
+        self.assertAlmostEqual(result.summary['sharpe'], np.nanmean(result.windows['test_sharpe']))
+        row = table.iloc[0]
+        best = {name: int(row[name]) for name in PARAMS}
+        expected = [backtest(ENTRY.format(**best), EXIT.format(**best), panel=panel, start=train_start, end=train_end, fee=0.001)
+                    for train_start, train_end, _, _ in folds]
+        self.assertAlmostEqual(row['train_sharpe'], np.nanmean([result.portfolio['sharpe'] for result in expected]))
+
+
+    def test_halving(self):
+        table = optimize(ENTRY, EXIT, PARAMS, self.symbols, search='halving', samples=8, eta=2, train=60, test=30,
+                         metric='return').table
+        self.assertEqual(len(table), 1)  # 8 -> 4 -> 2 -> 1
+        self.assertIn('test_return', table.columns)
+        with self.assertRaises(ValueError):
+            optimize(ENTRY, EXIT, PARAMS, self.symbols, metric='profit')
+        with self.assertRaises(ValueError):
+            optimize(ENTRY, EXIT, {'short': [12]}, self.symbols, train=60, test=30)  # 缺少参数
+
+if __name__ == '__main__':
+    unittest.main()
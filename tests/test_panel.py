@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from indexes import Panel
+from indexes.base import calc_ema, calc_ma
+from indexes.panel import series_kdj
+
+
+def make_frame(length, start, seed):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, length))
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start, periods=length)]
+    return pd.DataFrame({'open': close, 'close': close, 'high': close + 0.1, 'low': close - 0.1,
+                         'volume': np.ones(length)}, index=dates)
+
+
+class TestPanel(unittest.TestCase):
+    def setUp(self):
+        self.frames = {'SZ.000001': make_frame(300, '2021-01-04', 0),
+                       'HK.00700': make_frame(200, '2021-03-01', 1).drop(['2021-04-05', '2021-04-06'])}  # 有停牌
+        self.panel = Panel(list(self.frames), frames=self.frames)
+
+    def test_layout(self):
+        self.assertEqual(self.panel.close.shape, (2, 300))
+        row = self.panel.row('HK.00700')
+        self.assertEqual(self.panel.mask[row].sum(), 198)
+        self.assertTrue(np.isnan(self.panel.close[row, self.panel.date_offset('2021-04-05')]))
+
+    def test_rows_match_single_symbol(self):
+        for symbol, df in self.frames.items():
+            row = self.panel.row(symbol)
+            mask = self.panel.mask[row]
+            close = df['close'].to_numpy()
+            np.testing.assert_array_equal(self.panel.ma(5)[row][mask], calc_ma(close, 5))
+            dif = calc_ema(close, 12) - calc_ema(close, 26)
+            np.testing.assert_array_equal(self.panel.macd(12, 26, 9)[row][mask], (dif - calc_ema(dif, 9)) * 2)
+            self.assertTrue(np.isnan(self.panel.ma(5)[row][~mask]).all())  # 没有K线的日期为NaN
+
+    def test_shared_series(self):
+        ema = self.panel.ema(12)
+        self.panel.macd(12, 26, 9)
+        self.panel.macd(12, 30, 6)
+        self.assertIs(self.panel.ema(12), ema)  # short相同的MACD共用EMA
+        kdj = self.panel.kdj(9, 5)
+        self.assertIn(('rsv', 9), self.panel._computed)
+        for symbol, df in self.frames.items():
+            row = self.panel.row(symbol)
+            close, high, low = (df[column].to_numpy() for column in ('close', 'high', 'low'))
+            np.testing.assert_array_equal(kdj[row][self.panel.mask[row]], series_kdj(close, high, low, 9, 5))
+        self.panel.forget([('kdj', 9, 5), ('kdj', 1, 1)])
+        self.assertNotIn(('kdj', 9, 5), self.panel._computed)
+
+    def test_slice_by_date(self):
+        rsi = self.panel.rsi(6)
+        self.assertEqual(self.panel.at(rsi, '2021-03-01').shape, (2,))
+        self.assertEqual(self.panel.between(rsi, '2021-03-01', '2021-03-05').shape, (2, 5))
+        pdi, mdi = self.panel.dmi(14)
+        self.assertEqual(pdi.shape, mdi.shape)
+
+if __name__ == '__main__':
+    unittest.main()
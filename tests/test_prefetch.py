@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from global_data import global_data_instance
+from rate_limit import TokenBucket
+
+
+def make_frame(length, start, seed):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, length))
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start, periods=length)]
+    return pd.DataFrame({'open': close, 'close': close, 'high': close + 0.1,
+                         'low': close - 0.1, 'volume': np.ones(length)}, index=dates)
+
+
+class FakeProvider:
+    """ 本地的假数据源 记录调用次数与最大并发数, fail中的symbol前几次请求失败 """
+
+    def __init__(self, fail=None, delay=0.02):
+        self.fail = dict(fail or {})
+        self.delay = delay
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, symbol, start):
+        with self._lock:
+            self.calls.append(symbol)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            with self._lock:
+                if self.fail.get(symbol, 0) > 0:
+                    self.fail[symbol] -= 1
+                    raise ConnectionError(f'fake error: {symbol}')
+            return make_frame(30, '2021-01-04', int(symbol[-2:]))
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+        for _ in range(3):  # 开始时可以连续请求capacity次
+            bucket.acquire()
+        self.assertEqual(clock.now, 0)
+        bucket.acquire()
+        self.assertAlmostEqual(clock.now, 0.5)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertAlmostEqual(clock.now, 2.5)
+
+        clock.now += 100  # 长时间空闲后最多积累capacity个令牌
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+
+
+class TestPrefetch(unittest.TestCase):
+    symbols = [f'SZ.9998{i:02d}' for i in range(8)]
+
+    def setUp(self):
+        for symbol in self.symbols:
+            for d in (global_data_instance._symbol_to_columns, global_data_instance._symbol_to_dataframe,
+                      global_data_instance.symbol_to_date_list, global_data_instance.symbol_to_date_set):
+                d.pop(symbol, None)
+        for name, value in (('_download_backoff', 0), ('_download_retries', 2),
+                            ('_rate_limiters', {'futu': TokenBucket(1000, 100), 'yfinance': TokenBucket(1000, 100)})):
+            patcher = mock.patch.object(global_data_instance, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_with_retry(self):
+        provider = FakeProvider(fail={self.symbols[1]: 2, self.symbols[2]: 5})
+        reports = []
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', provider):
+            failures = global_data_instance.prefetch(self.symbols + self.symbols[:1], workers=4,
+                                                     progress=lambda *args: reports.append(args))
+        self.assertGreater(provider.max_running, 1)
+        self.assertEqual(provider.calls.count(self.symbols[1]), 3)  # 失败两次后成功
+        self.assertEqual(list(failures), [self.symbols[2]])  # 超过重试次数
+        self.assertIsInstance(failures[self.symbols[2]], ConnectionError)
+        self.assertEqual([r[0] for r in reports], list(range(1, 9)))
+        self.assertTrue(all(r[1] == 8 for r in reports))
+        for symbol in self.symbols:
+            self.assertEqual(global_data_instance.has_data(symbol), symbol != self.symbols[2])
+        self.assertEqual(len(global_data_instance.symbol_to_date_list[self.symbols[0]]), 30)
+
+        # 已有数据的symbol不再下载
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', FakeProvider()) as provider:
+            self.assertEqual(global_data_instance.prefetch(self.symbols, progress=lambda *args: None), {})
+        self.assertEqual(provider.calls, [self.symbols[2]])
+
+    def test_rate_limited(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, capacity=1, clock=clock, sleep=clock.sleep)
+        with mock.patch.dict(global_data_instance._rate_limiters, {'futu': bucket}), \
+                mock.patch.object(global_data_instance, '_get_data_from_futu_opend', FakeProvider(delay=0)):
+            global_data_instance.prefetch(self.symbols, workers=1, progress=lambda *args: None)
+        self.assertAlmostEqual(clock.now, 0.7)  # 8次请求 第一次不用等待
+
+if __name__ == '__main__':
+    unittest.main()
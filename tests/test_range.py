@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from global_data import global_data_instance
+from indexes import cci_instance, dmi_instance, kdj_instance, ma_instance, macd_instance, mtm_instance, rsi_instance
+
+
+def make_frame(length, start, seed):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, length))
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start, periods=length)]
+    return pd.DataFrame({'open': close, 'close': close, 'high': close + rng.random(length) * 0.2,
+                         'low': close - rng.random(length) * 0.2, 'volume': np.ones(length)}, index=dates)
+
+
+class TestRange(unittest.TestCase):
+    symbol = 'SZ.999902'
+
+    def setUp(self):
+        self.df = make_frame(200, '2021-01-04', 0)
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', return_value=self.df):
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE)
+        self.dates = list(self.df.index)
+
+    def test_range_matches_scalar(self):
+        s = self.symbol
+        cases = [(ma_instance.get_ma, ma_instance.get_ma_range, (5,)),
+                 (macd_instance.get_macd, macd_instance.get_macd_range, (12, 26, 9)),
+                 (rsi_instance.get_rsi, rsi_instance.get_rsi_range, (6,)),
+                 (kdj_instance.get_kdj, kdj_instance.get_kdj_range, (9, 3)),
+                 (mtm_instance.get_mtm, mtm_instance.get_mtm_range, (12, 6)),
+                 (cci_instance.get_cci, cci_instance.get_cci_range, (14,))]
+        for get, get_range, params in cases:
+            values = get_range(s, '2021-02-06', '2021-03-31', *params)  # 从周六开始
+            self.assertEqual(len(values), self.dates.index('2021-03-31') - self.dates.index('2021-02-08') + 1)
+            np.testing.assert_array_equal(values, [get(s, d, *params) for d in self.dates if '2021-02-06' <= d <= '2021-03-31'])
+
+    def test_range_is_readonly_view(self):
+        values = ma_instance.get_ma_range(self.symbol, '', '9999-12-31', 5)
+        self.assertEqual(len(values), 200)
+        self.assertFalse(values.flags.writeable)
+        self.assertTrue(np.shares_memory(values, ma_instance.get_ma_range(self.symbol, '2021-03-01', '2021-03-05', 5)))
+
+    def test_batch(self):
+        dates = [self.dates[50], '2021-02-06', self.dates[10]]  # 中间是周六
+        values = rsi_instance.get_rsi_batch(self.symbol, dates, 6)
+        self.assertEqual(values[0], rsi_instance.get_rsi(self.symbol, self.dates[50], 6))
+        self.assertTrue(np.isnan(values[1]))
+        self.assertEqual(values[2], rsi_instance.get_rsi(self.symbol, self.dates[10], 6))
+
+    def test_dmi_tuple(self):
+        pdi, mdi = dmi_instance.get_dmi_range(self.symbol, self.dates[100], self.dates[109], 14)
+        self.assertEqual((len(pdi), len(mdi)), (10, 10))
+        self.assertEqual((pdi[0], mdi[0]), dmi_instance.get_dmi(self.symbol, self.dates[100], 14))
+        pdi, mdi = dmi_instance.get_dmi_batch(self.symbol, [self.dates[100]], 14)
+        self.assertEqual((pdi[0], mdi[0]), dmi_instance.get_dmi(self.symbol, self.dates[100], 14))
+
+if __name__ == '__main__':
+    unittest.main()
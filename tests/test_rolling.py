@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from indexes.base import calc_ema_into, calc_sma_into
+from indexes.rolling import rolling_avedev, rolling_max, rolling_mean, rolling_min, rolling_sum
+
+
+def naive_llv(array, n):
+    return np.array([min(array[max(0, i-n+1):i+1]) for i in range(len(array))])
+
+def naive_hhv(array, n):
+    return np.array([max(array[max(0, i-n+1):i+1]) for i in range(len(array))])
+
+
+class TestRolling(unittest.TestCase):
+    def setUp(self):
+        self.array = np.random.default_rng(0).normal(10, 2, 500).round(2)
+
+    def test_min_max(self):
+        for n in (2, 3, 9, 30):
+            out = np.empty(len(self.array))
+            np.testing.assert_array_equal(rolling_min(self.array, n, out), naive_llv(self.array, n))
+            np.testing.assert_array_equal(rolling_max(self.array, n, out), naive_hhv(self.array, n))
+
+    def test_sum(self):
+        n = 14
+        result = rolling_sum(self.array, n, np.empty(len(self.array)))
+        self.assertTrue(np.isnan(result[:n-1]).all())  # 前(n-1)个无数据
+        expected = np.array([self.array[i-n+1:i+1].sum() for i in range(n-1, len(self.array))])
+        np.testing.assert_allclose(result[n-1:], expected, rtol=1e-12)
+
+    def test_sum_recovers_after_nan(self):
+        array = self.array.copy()
+        array[0] = np.nan
+        result = rolling_sum(array, 5, np.empty(len(array)))
+        self.assertTrue(np.isnan(result[:5]).all())
+        self.assertAlmostEqual(result[5], array[1:6].sum())
+
+    def test_error_bounded(self):
+        """ 价格先涨到上亿再跌回十几元的长序列 递推的浮点误差不应累积 """
+        length, n = 1_000_000, 20
+        drift = np.where(np.arange(length) < length // 2, 5e-5, -5e-5)
+        array = 100 * np.exp(np.cumsum(drift + np.random.default_rng(1).normal(0, 0.01, length)))
+        result = rolling_mean(array, n, np.empty(length))
+        self.assertAlmostEqual(result[-1] / array[-n:].mean(), 1, places=12)
+        result = rolling_sum(array, n, np.empty(length))
+        self.assertAlmostEqual(result[-1] / array[-n:].sum(), 1, places=12)
+
+    def test_mean_matches_convolve(self):
+        """ 与原先calc_ma(np.convolve)比较 NaN的位置相同, 其余只差最后几位 """
+        array = np.cumsum(np.random.default_rng(2).normal(0, 1, 20000)) + 100
+        eps = np.finfo(np.float64).eps
+        for n in (3, 5, 10, 20, 60, 250):
+            expected = np.concatenate((np.full(n - 1, np.nan), np.convolve(np.ones(n) / n, array)[n-1:1-n]))
+            result = rolling_mean(array, n, np.empty(len(array)))
+            self.assertEqual(np.isnan(result).tolist(), np.isnan(expected).tolist())
+            bound = 2 * n * eps * np.array([np.abs(array[i-n+1:i+1]).max() for i in range(n - 1, len(array))])
+            self.assertEqual(np.flatnonzero(np.abs(result[n-1:] - expected[n-1:]) > bound).tolist(), [])
+
+    def test_avedev(self):
+        n = 14
+        mean = np.full(len(self.array), np.nan)
+        mean[n-1:] = [self.array[i-n+1:i+1].mean() for i in range(n-1, len(self.array))]
+        result = rolling_avedev(self.array, mean, n, np.empty(len(self.array)))
+        self.assertTrue(np.isnan(result[:n-1]).all())
+        expected = [np.abs(self.array[i-n+1:i+1] - mean[i]).mean() for i in range(n-1, len(self.array))]
+        np.testing.assert_allclose(result[n-1:], expected, rtol=1e-12)
+
+    def test_extend_is_bit_identical(self):
+        """ 先算前300天 再从第300天接着往后算 结果应与整条计算完全相同 """
+        n, start = 14, 300
+        begin = start - n  # 只传入start之前n天的数据
+        for kernel in (rolling_min, rolling_max):
+            full = kernel(self.array, n, np.empty(len(self.array)))
+            out = np.empty(len(self.array))
+            kernel(self.array[:start], n, out[:start])
+            kernel(self.array[begin:], n, out[begin:], start - begin)
+            np.testing.assert_array_equal(out, full)
+        for kernel in (rolling_sum, rolling_mean):
+            full = kernel(self.array, n, np.empty(len(self.array)))
+            out = np.empty(len(self.array))
+            kernel(self.array[:start], n, out[:start])
+            kernel(self.array[begin:], n, out[begin:], start - begin, begin)  # 切片在整条序列中从begin开始
+            np.testing.assert_array_equal(out, full)
+        for kernel, params in ((calc_ema_into, (12,)), (calc_sma_into, (6, 1))):
+            full = kernel(self.array, *params, np.empty(len(self.array)))
+            out = np.empty(len(self.array))
+            kernel(self.array[:start], *params, out[:start])
+            kernel(self.array[start-1:], *params, out[start-1:], 1)
+            np.testing.assert_array_equal(out, full)
+
+if __name__ == '__main__':
+    unittest.main()
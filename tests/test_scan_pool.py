@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from global_data import global_data_instance
+from indexes import cci_instance, dmi_instance, kdj_instance, ma_instance, macd_instance
+from synthetic import synthetic_ohlcv
+from scan_pool import new_pool, scan, split
+
+INDICATORS = [('ma', 5), ('macd', 12, 26, 9), ('kdj', 9, 3), ('cci', 14), ('dmi', 14)]
+
+
+class TestScanPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.symbols = [f'SCAN.{i}' for i in range(6)]
+        for i, symbol in enumerate(cls.symbols):  # 长度不同 日期轴取并集
+            global_data_instance.put_data(symbol, synthetic_ohlcv(150 + 20 * i, seed=i, start='2021-01-01'))
+        cls.pool = new_pool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.pool.join()
+
+    def check_rows(self, panel, start='', end='9999-12-31'):
+        for symbol in self.symbols:
+            row = panel.row(symbol)
+            mask = panel.mask[row]
+            np.testing.assert_array_equal(panel['ma(5)'][row][mask], ma_instance.get_ma_range(symbol, start, end, 5))
+            np.testing.assert_array_equal(panel['macd(12,26,9)'][row][mask], macd_instance.get_macd_range(symbol, start, end, 12, 26, 9))
+            np.testing.assert_array_equal(panel['kdj(9,3)'][row][mask], kdj_instance.get_kdj_range(symbol, start, end, 9, 3))
+            np.testing.assert_array_equal(panel['cci(14)'][row][mask], cci_instance.get_cci_range(symbol, start, end, 14))
+            pdi, mdi = dmi_instance.get_dmi_range(symbol, start, end, 14)
+            np.testing.assert_array_equal(panel['pdi(14)'][row][mask], pdi)
+            np.testing.assert_array_equal(panel['mdi(14)'][row][mask], mdi)
+
+    def test_matches_single_symbol(self):
+        self.assertEqual(self.pool.processes, 2)
+        panel = scan(self.symbols + ['XX.BAD'], INDICATORS, pool=self.pool)
+        self.assertEqual(panel.symbols, self.symbols)
+        self.assertIn('XX.BAD', panel.errors)
+        self.assertEqual(panel['ma(5)'].shape, (6, 250))
+        self.check_rows(panel)
+
+        in_process = scan(self.symbols, INDICATORS, processes=1)
+        for output, matrix in panel.matrices.items():
+            np.testing.assert_array_equal(in_process[output], matrix)
+
+    def test_date_range(self):
+        panel = scan(self.symbols, INDICATORS, start='2021-03-01', end='2021-04-30', pool=self.pool)
+        self.assertEqual((panel.dates[0], panel.dates[-1]), ('2021-03-01', '2021-04-30'))
+        self.check_rows(panel, '2021-03-01', '2021-04-30')
+
+    def test_frames(self):
+        frames = {'A': synthetic_ohlcv(100, seed=10, start='2021-01-01'), 'B': synthetic_ohlcv(10, seed=11, start='2021-01-01')}
+        panel = scan(['A', 'B'], [('ma', 20)], frames=frames, pool=self.pool)
+        self.assertTrue(np.isnan(panel['ma(20)'][panel.row('B')]).all())  # K线不够
+        self.assertFalse(np.isnan(panel['ma(20)'][panel.row('A'), -1]))
+
+    def test_unknown_indicator(self):
+        with self.assertRaises(ValueError):
+            scan(self.symbols, [('boll', 20)], pool=self.pool)
+
+    def test_split(self):
+        offsets = np.array([0, 100, 101, 102, 300, 400])
+        self.assertEqual(split(offsets, 2), [(0, 4), (4, 5)])  # 按K线数均分
+        self.assertEqual(split(offsets, 100), [(0, 1), (1, 4), (4, 5)])
+        self.assertEqual(split(np.array([0]), 4), [])
+
+if __name__ == '__main__':
+    unittest.main()
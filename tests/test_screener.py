@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from dto_enum import OHLCV
+from global_data import global_data_instance
+from indexes import kdj_instance, ma_instance, rsi_instance, screener_instance
+from indexes.screener import Expression
+from synthetic import synthetic_ohlcv
+
+EXPRESSION = 'kdj(9,3) < 20 and rsi(6) < 40 or close > ma(20) * 1.05'
+
+
+class TestScreener(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.symbols = [f'SCREEN.{i}' for i in range(8)]
+        for i, symbol in enumerate(cls.symbols):  # 长度不同 前面的股票在最后几天没有K线
+            global_data_instance.put_data(symbol, synthetic_ohlcv(200 + 5 * i, seed=i, start='2021-01-01'))
+
+    def matches(self, symbol, date):
+        """ 逐只股票调用get_xxx判断 返回 (是否满足, ma(20)) """
+        if date not in global_data_instance.symbol_to_date_set[symbol]:
+            return False, np.nan
+        offset = global_data_instance.find_date_offset(symbol, date)
+        close = global_data_instance.get_array_since_date(symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)[offset]
+        kdj = kdj_instance.get_kdj(symbol, date, 9, 3)
+        rsi = rsi_instance.get_rsi(symbol, date, 6)
+        ma = ma_instance.get_ma(symbol, date, 20)
+        return bool(kdj < 20 and rsi < 40 or close > ma * 1.05), ma
+
+    def test_screen_matches_loop(self):
+        dates = global_data_instance.symbol_to_date_list[self.symbols[-1]]
+        for date in dates[-60::6]:
+            result = screener_instance.screen(EXPRESSION, date, self.symbols)
+            self.assertEqual(list(result.columns), ['kdj(9,3)', 'rsi(6)', 'close', 'ma(20)'])
+            expected = [symbol for symbol in self.symbols if self.matches(symbol, date)[0]]
+            self.assertEqual(list(result.index), expected, date)
+            for symbol in expected:
+                self.assertAlmostEqual(result.loc[symbol, 'ma(20)'], self.matches(symbol, date)[1])
+
+    def test_screen_range(self):
+        dates = global_data_instance.symbol_to_date_list[self.symbols[-1]]
+        start, end = dates[-40], dates[-1]
+        result = screener_instance.screen_range(EXPRESSION, start, end, self.symbols)
+        self.assertEqual(result.index.names, ['date', 'symbol'])
+        for date in dates[-40:]:
+            matched = list(result.loc[date].index) if date in result.index.get_level_values('date') else []
+            self.assertEqual(matched, screener_instance.screen(EXPRESSION, date, self.symbols).index.tolist())
+
+    def test_panel_reused(self):
+        panel = screener_instance.panel(self.symbols)
+        self.assertIs(screener_instance.panel(self.symbols), panel)
+        global_data_instance.append_data(self.symbols[0], synthetic_ohlcv(201, seed=0, start='2021-01-01').iloc[200:])
+        self.assertIsNot(screener_instance.panel(self.symbols), panel)  # 数据变化后重新建立
+        self.assertIn(self.symbols[0], global_data_instance.loaded_symbols())
+
+    def test_expression(self):
+        expression = Expression('-1 < macd(12,26,9) <= 1 and not (pdi(14) > mdi(14)) and volume / 2 != 0')
+        self.assertEqual(list(expression.terms), ['macd(12,26,9)', 'pdi(14)', 'mdi(14)', 'volume'])
+        values = {'macd(12,26,9)': np.array([0.5, 2.0, np.nan]), 'pdi(14)': np.array([1.0, 1.0, 1.0]),
+                  'mdi(14)': np.array([2.0, 2.0, 2.0]), 'volume': np.array([10.0, 10.0, 10.0])}
+        np.testing.assert_array_equal(expression.evaluate(values), [True, False, False])
+        for text in ('close >', 'ma(n) > 1', 'ma(5, 10) > 1', '__import__("os")', 'close.real > 1', 'ma(5) > 1 if 1 else 0', '1 < 2'):
+            with self.assertRaises(ValueError, msg=text):
+                Expression(text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numba
+import numpy as np
+import warmup
+from indexes.base import calc_ema, calc_ma, ref
+from indexes.rolling import rolling_sum
+from indexes.signature import use_cache_dir
+
+
+class TestSignature(unittest.TestCase):
+
+    def test_all_kernels_compiled_at_import(self):
+        for name, dispatcher in warmup.kernels().items():
+            self.assertFalse(dispatcher._can_compile, name)  # 全部带签名 调用时不会再编译
+
+    def test_argument_types(self):
+        array = np.random.default_rng(0).normal(10, 1, 100)
+        expected = calc_ma(array, 5)
+        readonly = array.copy()
+        readonly.flags.writeable = False  # 如从数据库映射的数据
+        np.testing.assert_array_equal(calc_ma(readonly, 5), expected)
+        strided = np.repeat(array, 2)[::2]
+        np.testing.assert_array_equal(calc_ema(strided, 12), calc_ema(array, 12))
+        np.testing.assert_array_equal(ref(array, 1), ref(array, 1, 0))  # 省略默认参数
+
+        out = np.empty(100)
+        rolling_sum(array, 5, out)
+        np.testing.assert_array_equal(rolling_sum(array, 5, np.empty(100), 0), out)
+        with self.assertRaises(TypeError):  # 签名之外的类型
+            calc_ma(np.arange(100), 5)
+
+    def test_read_only_cache_dir(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            open(os.path.join(cache_dir, 'kernel.nbi'), 'w').close()
+            with mock.patch.dict(os.environ, {'NUMBA_CACHE_DIR': cache_dir}), mock.patch('os.access', return_value=False), \
+                    mock.patch.object(numba.config, 'CACHE_DIR', ''):
+                use_cache_dir()
+                copy = numba.config.CACHE_DIR
+            self.addCleanup(shutil.rmtree, copy)
+            self.assertNotEqual(copy, cache_dir)
+            self.assertTrue(os.path.exists(os.path.join(copy, 'kernel.nbi')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from dto_enum import OHLCV
+from global_data import global_data_instance
+from indexes import ma_instance
+from store import COLUMNS, ColumnStore
+
+
+def make_frame(length, start, seed):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, length))
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start, periods=length)]
+    return pd.DataFrame({'open': close, 'close': close, 'high': close + 0.1,
+                         'low': close - 0.1, 'volume': np.ones(length)}, index=dates)
+
+
+def is_mapped(array):
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    return array is not None
+
+
+class TestColumnStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_dir.name, 'database')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        df = make_frame(50, '2021-01-04', 0)
+        store = ColumnStore(self.root)
+        self.assertFalse(store.exists())
+        store.save('SZ.000001', list(df.index), {c: df[c].to_numpy() for c in COLUMNS})
+
+        store = ColumnStore(self.root)  # 重新打开
+        self.assertIn('SZ.000001', store)
+        self.assertEqual(store.info('SZ.000001')['last'], df.index[-1])
+        dates, columns = store.load('SZ.000001')
+        self.assertEqual(dates.dtype, np.dtype('datetime64[D]'))
+        self.assertEqual(list(np.datetime_as_string(dates)), list(df.index))
+        for c in COLUMNS:
+            np.testing.assert_array_equal(columns[c], df[c].to_numpy())
+            self.assertFalse(columns[c].flags.writeable)
+            self.assertTrue(is_mapped(columns[c]))  # 内存映射 没有复制
+        self.assertIsNone(store.load('SZ.000002'))
+
+    def test_new_version_removes_old_files(self):
+        store = ColumnStore(self.root)
+        for seed in range(2):
+            df = make_frame(20 + seed, '2021-01-04', seed)
+            store.save('SZ.000001', list(df.index), {c: df[c].to_numpy() for c in COLUMNS})
+        self.assertEqual(store.info('SZ.000001')['version'], 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'SZ.000001'))), sorted(f'{c}.2.npy' for c in ('dates',) + COLUMNS))
+        np.testing.assert_array_equal(store.load('SZ.000001')[1]['close'], df['close'].to_numpy())
+
+
+class TestGlobalDataStore(unittest.TestCase):
+    symbol = 'SZ.999904'
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = ColumnStore(os.path.join(self.temp_dir.name, 'database'))
+        patcher = mock.patch.object(global_data_instance, 'store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_save_only_changed(self):
+        df = make_frame(100, '2021-01-04', 0)
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', return_value=df):
+            global_data_instance.add_data(self.symbol, global_data_instance.START_DOWNLOAD_DATE)
+        global_data_instance.save_database()
+        self.assertEqual(self.store.info(self.symbol)['version'], 1)
+        global_data_instance.save_database()  # 没有变化 不重写
+        self.assertEqual(self.store.info(self.symbol)['version'], 1)
+
+        global_data_instance.append_data(self.symbol, make_frame(1, '2021-05-24', 1))
+        global_data_instance.save_database()
+        self.assertEqual(self.store.info(self.symbol)['length'], 101)
+
+    def test_lazy_load(self):
+        df = make_frame(100, '2021-01-04', 0)
+        self.store.save(self.symbol, list(df.index), {c: df[c].to_numpy() for c in COLUMNS})
+        for d in (global_data_instance._symbol_to_columns, global_data_instance._symbol_to_dataframe,
+                  global_data_instance.symbol_to_date_list, global_data_instance.symbol_to_date_set):
+            d.pop(self.symbol, None)
+        global_data_instance._data_changed(self.symbol)
+        global_data_instance._dirty.discard(self.symbol)
+
+        with mock.patch.object(global_data_instance, '_get_data_from_futu_opend', side_effect=AssertionError):  # 不应下载
+            close = global_data_instance.get_array_since_date(self.symbol, OHLCV.CLOSE, global_data_instance.START_DOWNLOAD_DATE)
+            self.assertTrue(is_mapped(close))
+            np.testing.assert_array_equal(close, df['close'].to_numpy())
+            self.assertAlmostEqual(ma_instance.get_ma(self.symbol, df.index[-1], 5), df['close'].to_numpy()[-5:].mean())
+            self.assertEqual(list(global_data_instance._get_dataframe(self.symbol).index), list(df.index))
+        self.assertNotIn(self.symbol, global_data_instance._dirty)
+
+if __name__ == '__main__':
+    unittest.main()
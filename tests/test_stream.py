@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+import pandas as pd
+from bar_source import FutuKlineSource, ReplaySource
+from indexes.base import calc_ema, calc_hhv, calc_llv, calc_ma, calc_sma
+from indexes.panel import series_cci, series_dmi, series_mtm, series_rsi
+from indexes.stream import StreamCCI, StreamDMI, StreamKDJ, StreamMA, StreamMACD, StreamMTM, StreamRSI, Streamer
+
+
+def make_frame(length, start, seed):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, length))
+    dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start, periods=length)]
+    return pd.DataFrame({'open': close, 'close': close, 'high': close + rng.random(length) * 0.2,
+                         'low': close - rng.random(length) * 0.2, 'volume': np.ones(length)}, index=dates)
+
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        flat = make_frame(120, '2021-02-01', 2)
+        flat.iloc[40:70] = [10.0, 10.0, 10.0, 10.0, 0.0]  # 停牌 价格不变
+        self.frames = {'SZ.000001': make_frame(200, '2021-01-04', 0), 'HK.00700': make_frame(100, '2021-03-01', 1),
+                       'SH.600000': flat}
+        self.history = {}
+        streamer = Streamer({'ma': lambda: StreamMA(5), 'macd': lambda: StreamMACD(12, 26, 9), 'kdj': lambda: StreamKDJ(9, 3),
+                             'rsi': lambda: StreamRSI(6), 'mtm': lambda: StreamMTM(12, 6), 'cci': lambda: StreamCCI(14),
+                             'dmi': lambda: StreamDMI(14)},
+                            on_update=lambda bar, values: self.history.setdefault(bar.symbol, []).append(values))
+        streamer.run(ReplaySource(list(self.frames), frames=self.frames))
+
+    def test_same_as_batch(self):
+        """ 逐根推送得到的值应与批量计算完全相同 """
+        for symbol, df in self.frames.items():
+            close, high, low = df['close'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy()
+            values = self.history[symbol]
+            np.testing.assert_array_equal([v['ma'] for v in values], calc_ma(close, 5))
+            dif = calc_ema(close, 12) - calc_ema(close, 26)
+            np.testing.assert_array_equal([v['macd'] for v in values], (dif - calc_ema(dif, 9)) * 2)
+            llv, hhv = calc_llv(low, 9), calc_hhv(high, 9)
+            k = calc_sma((close - llv) / (hhv - llv + 0.00000001) * 100, 3, 1)
+            np.testing.assert_array_equal([v['kdj'] for v in values], 3 * k - 2 * calc_sma(k, 3, 1))
+            np.testing.assert_array_equal([v['rsi'] for v in values], series_rsi(close, 6))
+            np.testing.assert_array_equal([v['mtm'] for v in values], series_mtm(close, 12, 6))
+            with np.errstate(all='ignore'):
+                np.testing.assert_array_equal([v['cci'] for v in values], series_cci(close, high, low, 14))
+                pdi, mdi = series_dmi(close, high, low, 14)
+            np.testing.assert_array_equal([v['dmi'][0] for v in values], pdi)
+            np.testing.assert_array_equal([v['dmi'][1] for v in values], mdi)
+
+    def test_flat_bars(self):
+        """ 停牌期间CCI、DMI的分母为0 返回NaN而不是抛出异常, 复牌后恢复 """
+        values = self.history['SH.600000']
+        self.assertEqual(len(values), 120)
+        for name, value in (('cci', lambda v: v['cci']), ('pdi', lambda v: v['dmi'][0])):
+            self.assertTrue(np.isnan(value(values[69])), name)
+            self.assertTrue(np.isfinite(value(values[-1])), name)
+
+    def test_futu_emits_completed_bars(self):
+        """ 同一根K线反复推送时 只在下一根K线到来后推送一次 """
+        bars = []
+        source = FutuKlineSource(['HK.00700'])
+        for time_key, close in (('2021-01-04 09:31:00', 1.0), ('2021-01-04 09:31:00', 2.0), ('2021-01-04 09:32:00', 3.0)):
+            df = pd.DataFrame({'code': ['HK.00700'], 'time_key': [time_key], 'open': [1.0], 'high': [3.0],
+                               'low': [1.0], 'close': [close], 'volume': [100]})
+            source.on_kline(df, bars.append)
+        self.assertEqual(len(bars), 1)
+        self.assertEqual(bars[0].close, 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import unittest
+sys.path.append('..')
+sys.path.append(os.getcwd())
+import numpy as np
+from global_data import global_data_instance
+from indexes import dmi_instance, kdj_instance, ma_instance, macd_instance
+from synthetic import synthetic_ohlcv
+from celery.contrib.testing.worker import start_worker
+from tasks import app, compute_universe, decode_array, encode_array
+
+
+class TestTasks(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        app.conf.update(task_always_eager=True, task_eager_propagates=True, broker_url='memory://', result_backend='cache+memory://')
+        cls.symbols = [f'TASKS.{i}' for i in range(5)]
+        for i, symbol in enumerate(cls.symbols):  # 长度不同 日期轴取并集
+            global_data_instance.put_data(symbol, synthetic_ohlcv(200 + 10 * i, seed=i, start='2021-01-01'))
+
+    def test_encode(self):
+        array = np.arange(6.0).reshape(2, 3)
+        np.testing.assert_array_equal(decode_array(encode_array(array)), array)
+
+    def test_compute_universe(self):
+        panel = compute_universe(self.symbols + ['XX.BAD'], [('ma', 5), ('macd', 12, 26, 9), ('dmi', 14)], shard_size=2)
+        self.assertEqual(panel.symbols, self.symbols)
+        self.assertIn('XX.BAD', panel.errors)
+        self.assertEqual(panel['ma(5)'].shape, (5, 240))
+        for symbol in self.symbols:
+            row = panel.row(symbol)
+            mask = panel.mask[row]
+            np.testing.assert_array_equal(panel['ma(5)'][row][mask], ma_instance.get_ma_range(symbol, '', '9999-12-31', 5))
+            np.testing.assert_array_equal(panel['macd(12,26,9)'][row][mask], macd_instance.get_macd_range(symbol, '', '9999-12-31', 12, 26, 9))
+            np.testing.assert_array_equal(panel['mdi(14)'][row][mask], dmi_instance.get_dmi_range(symbol, '', '9999-12-31', 14)[1])
+            self.assertTrue(np.isnan(panel['ma(5)'][row][~mask]).all())
+        self.assertEqual(panel.at('ma(5)', '2021-08-28').shape, (5,))
+        self.assertEqual(panel.to_frame('pdi(14)').shape, (5, 240))
+
+    def test_output_dir(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            stored = compute_universe(self.symbols, [('rsi', 6)], start='2021-03-01', end='2021-03-31', output_dir=output_dir)
+            self.assertTrue(os.path.exists(os.path.join(output_dir, 'TASKS.0.npz')))
+        self.assertEqual(stored.dates[0], '2021-03-01')
+        self.assertEqual(stored['rsi(6)'].shape, (5, 31))
+
+    def test_unknown_indicator(self):
+        with self.assertRaises(ValueError):
+            compute_universe(self.symbols, [('boll', 20)])
+
+
+class TestWorker(unittest.TestCase):
+    """ 用内存中的broker代替redis 结果经过JSON序列化 """
+
+    def test_worker(self):
+        app.conf.update(task_always_eager=False, broker_url='memory://', result_backend='cache+memory://')
+        for i in range(3):
+            global_data_instance.put_data(f'WORKER.{i}', synthetic_ohlcv(100, seed=i, start='2021-01-01'))
+        with start_worker(app, pool='solo', perform_ping_check=False):
+            panel = compute_universe([f'WORKER.{i}' for i in range(3)], [('kdj', 9, 3)], shard_size=2, timeout=30)
+        self.assertEqual(panel['kdj(9,3)'].shape, (3, 100))
+        np.testing.assert_array_equal(panel['kdj(9,3)'][2], kdj_instance.get_kdj_range('WORKER.2', '', '9999-12-31', 9, 3))
+
+if __name__ == '__main__':
+    unittest.main()
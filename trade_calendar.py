@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    沪深交易日历 第一次用到时才从tushare获取, 并缓存到本地文件, 缓存未过期时不访问网络
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+def fetch_from_tushare() -> List[str]:
+    """ 从tushare pro获取2022年以来的交易日 'YYYY-MM-DD' 升序 """
+    import tushare as ts  # reference: https://tushare.pro/
+    calendar = ts.pro_api().trade_cal(is_open=1, start_date='20220101', end_date=time.strftime('%Y%m%d'))
+    return sorted(f'{d[:4]}-{d[4:6]}-{d[6:]}' for d in calendar['cal_date'])
+
+
+class TradeCalendar:
+    """
+        cache_path: 缓存文件路径  ttl: 缓存有效的秒数
+        获取失败时若有过期的缓存则仍使用它
+    """
+
+    def __init__(self, cache_path: str, ttl: float, fetch: Callable[[], List[str]] = fetch_from_tushare):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._fetch = fetch
+        self._dates: Optional[List[str]] = None
+        self._fetched = 0.0  # 获取交易日历的时间戳
+        self._lock = threading.Lock()
+
+    def dates(self) -> List[str]:
+        """ 全部交易日 升序 """
+        if self._dates is None or time.time() - self._fetched >= self.ttl:
+            with self._lock:
+                if self._dates is None or time.time() - self._fetched >= self.ttl:
+                    self._dates, self._fetched = self._load()
+        return self._dates
+
+    def newest_trade_date(self) -> str:
+        """ 最近的一个交易日 'YYYY-MM-DD' """
+        return self.dates()[-1]
+
+    def _load(self) -> Tuple[List[str], float]:
+        """ 返回 (交易日, 获取的时间戳) 缓存文件未过期时直接使用 """
+        cached = None
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if time.time() - cached['fetched'] < self.ttl:
+                return cached['dates'], cached['fetched']
+
+        print('getting newest trade date..')
+        try:
+            dates = self._fetch()
+        except Exception as e:
+            if cached is None:
+                raise
+            print(f'Warning: get trade calendar failed, using cached one: {e}')
+            return cached['dates'], time.time()  # 过一个ttl后再重试
+
+        fetched = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'fetched': fetched, 'dates': dates}, f)
+        except OSError as e:
+            print(f'Warning: save trade calendar failed: {e}')
+        return dates, fetched
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+
+"""
+    预先编译所有numba核心并写入缓存目录 部署时(如构建镜像时)运行一次:
+        python warmup.py --cache-dir /app/numba_cache
+    运行时把环境变量NUMBA_CACHE_DIR或config.ini中的numba_cache_dir设为同一目录, import时直接载入, 第一次查询不再等待编译
+    该目录部署后可以是只读的(见indexes/signature.py的use_cache_dir)
+    numba按源文件的绝对路径与修改时间校验缓存, 所以要在部署后的路径下运行; 源文件有改动时需重新运行
+"""
+
+import argparse
+import importlib
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def kernels() -> Dict[str, object]:
+    """ indexes中所有的numba核心 {'模块.函数名': dispatcher} """
+    from numba.core.registry import CPUDispatcher
+    import indexes  # import时按签名编译或从缓存载入
+    for module in pkgutil.iter_modules(indexes.__path__):  # 包括Panel等第一次用到时才import的模块
+        importlib.import_module(f'indexes.{module.name}')
+    result = {}
+    for name, module in sorted(sys.modules.items()):
+        if not name.startswith('indexes.'):
+            continue
+        for obj in vars(module).values():
+            if isinstance(obj, CPUDispatcher) and obj.__module__ == name:
+                result[f'{name}.{obj.__name__}'] = obj
+    return result
+
+
+def cache_misses() -> List[str]:
+    """ 本进程import时没能从缓存载入(重新编译了)的核心 """
+    return [name for name, dispatcher in kernels().items() if dispatcher.stats.cache_misses]
+
+
+def check(cache_dir: str = '') -> List[str]:
+    """ 在新的进程中import, 返回没能从缓存载入的核心 为空说明缓存完整 """
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir) if cache_dir else os.environ
+    result = subprocess.run([sys.executable, '-c', 'import json, warmup; print(json.dumps(warmup.cache_misses()))'],
+                            cwd=PACKAGE_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compile all numba kernels ahead of time into the cache directory')
+    parser.add_argument('--cache-dir', default='', help='numba cache directory, default NUMBA_CACHE_DIR / numba_cache_dir in config.ini')
+    args = parser.parse_args()
+    if args.cache_dir:
+        os.environ['NUMBA_CACHE_DIR'] = os.path.abspath(args.cache_dir)  # 须在import numba之前设置
+
+    begin = time.perf_counter()
+    compiled = kernels()
+    import numba
+    print(f'{sum(len(d.signatures) for d in compiled.values())} signatures of {len(compiled)} kernels ready in '
+          f'{time.perf_counter() - begin:.1f} s, cache: {numba.config.CACHE_DIR or "__pycache__"}')
+
+    misses = check(os.environ.get('NUMBA_CACHE_DIR', ''))
+    if misses:
+        print('NOT CACHED: ' + ', '.join(misses))
+        sys.exit(1)
+    print('all kernels load from cache')
+
+if __name__ == '__main__':
+    main()